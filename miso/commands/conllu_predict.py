@@ -70,6 +70,10 @@ class ConlluPredict(Subcommand):
         batch_size.add_argument(
             "--batch-size", type=int, default=1, help="The batch size to use for processing"
         )
+        batch_size.add_argument(
+            "--max-tokens", type=int, default=None, 
+            help="batch instances of similar source length up to this many padded source tokens, instead of by batch size"
+        )
 
         subparser.add_argument(
             "--silent", action="store_true", help="do not print output to stdout"
@@ -161,7 +165,8 @@ class ConlluPredictWrapper:
                 line_limit = None,
                 include_attribute_scores = False,
                 oracle = False,
-                output_file = None):
+                output_file = None,
+                max_tokens = None):
 
         self.load_path = load_path
         if self.load_path is not None:
@@ -176,6 +181,7 @@ class ConlluPredictWrapper:
         self.semantics_only = semantics_only
         self.drop_syntax = drop_syntax
         self.line_limit = line_limit
+        self.max_tokens = max_tokens
         self.include_attribute_scores = include_attribute_scores
         self.oracle = oracle
         self.output_file = output_file
@@ -198,7 +204,8 @@ class ConlluPredictWrapper:
                                     self.pred_args.beam_size,
                                     line_limit = self.line_limit,
                                     oracle = self.oracle,
-                                    json_output_file = None)  
+                                    json_output_file = None,
+                                    max_tokens = self.max_tokens)  
 
     @staticmethod
     def conllu_dict_to_str(conllu_dict, id, text):
@@ -217,27 +224,20 @@ class ConlluPredictWrapper:
 
     def predict_and_compute(self):
         assert(self.predictor is not None)
-        input_instances, output_graphs = self.manager.run()
-   
-        # ignore everything except conllu graph 
-        if len(output_graphs) > 0 and type(output_graphs[0]) == tuple:
-            output_graphs = [x[-1] for x in output_graphs]
-
-        input_sents = [inst.fields['syn_tokens_str'].metadata for inst in input_instances]
-
-        las_scores = []
-        uas_scores = []
-        mlas_scores = []
-        blex_scores = []
-        
-        all_strs = []
-        for i in range(len(input_instances)):
-            all_strs.append(output_graphs[i])
 
+        num_written = 0
         with open(self.output_file, "w") as pred_file:
-            pred_file.write("\n".join(all_strs))
+            for __, output_graph in self.manager.iter_predictions():
+                # ignore everything except conllu graph 
+                if type(output_graph) == tuple:
+                    output_graph = output_graph[-1]
+
+                if num_written > 0:
+                    pred_file.write("\n")
+                pred_file.write(output_graph)
+                num_written += 1
 
-        logger.info(f"succesfully wrote {len(all_strs)} to {self.output_file}") 
+        logger.info(f"succesfully wrote {num_written} to {self.output_file}") 
  
     @classmethod
     def from_params(cls, args):
@@ -253,6 +253,7 @@ class ConlluPredictWrapper:
                    line_limit = args.line_limit,
                    include_attribute_scores = args.include_attribute_scores,
                    oracle = args.oracle,
-                   output_file = args.output_file
+                   output_file = args.output_file,
+                   max_tokens = args.max_tokens
                    )
 
@@ -4,7 +4,6 @@ from typing import List, Iterator, Dict
 from collections import namedtuple
 import os
 import overrides
-import tempfile
 
 import numpy as np
 import torch
@@ -25,15 +24,12 @@ from allennlp.common.util import import_submodules
 
 from miso.data.dataset_readers.decomp_parsing.decomp import DecompGraph
 from miso.data.dataset_readers.decomp_parsing.decomp_with_syntax import DecompGraphWithSyntax
-from miso.metrics.conllu import evaluate_wrapper, UDError
+from miso.metrics.conllu import ConlluEvaluator
+from miso.nn.precision import PRECISIONS, set_inference_precision
 from miso.commands.predict import _ReturningPredictManager 
 
 logger = logging.getLogger(__name__) 
 
-compute_args = {"gold_file":None, "system_file": None}  
-
-ComputeTup = namedtuple("compute_args", sorted(compute_args))
-
 class ArgNamespace:
     def __init__(self,
                 input_file,
@@ -70,6 +66,10 @@ class ConlluScore(Subcommand):
         batch_size.add_argument(
             "--batch-size", type=int, default=1, help="The batch size to use for processing"
         )
+        batch_size.add_argument(
+            "--max-tokens", type=int, default=None, 
+            help="batch instances of similar source length up to this many padded source tokens, instead of by batch size"
+        )
 
         subparser.add_argument(
             "--silent", action="store_true", help="do not print output to stdout"
@@ -134,18 +134,25 @@ class ConlluScore(Subcommand):
 
         subparser.add_argument("--oracle", action = "store_true") 
 
+        subparser.add_argument("--precision", type=str, choices=sorted(PRECISIONS), default="float32",
+                                help="run the Linear layers of the encoder and decoder in this precision (float16 needs a GPU)")
+
         subparser.set_defaults(func=_construct_and_predict)
 
         return subparser
 
 def _construct_and_predict(args: argparse.Namespace) -> None:
     predictor = _get_predictor(args)
+    set_inference_precision(predictor._model, args.precision)
     args.predictor = predictor
     scorer = ConlluScorer.from_params(args)
 
     uas, las, mlas, blex = scorer.predict_and_compute()
     print(f"averaged scores") 
     print(f"UAS: {uas}, LAS: {las}, MLAS: {mlas}, BLEX: {blex}") 
+    micro = scorer.evaluator.get_metrics()
+    print(f"micro scores") 
+    print(f"UAS: {micro['UAS_micro']}, LAS: {micro['LAS_micro']}, MLAS: {micro['MLAS_micro']}, BLEX: {micro['BLEX_micro']}") 
 
 class ConlluScorer:
     """
@@ -164,7 +171,8 @@ class ConlluScorer:
                 line_limit = None,
                 include_attribute_scores = False,
                 oracle = False,
-                json_output_file = None):
+                json_output_file = None,
+                max_tokens = None):
 
         self.load_path = load_path
         if self.load_path is not None:
@@ -179,6 +187,7 @@ class ConlluScorer:
         self.semantics_only = semantics_only
         self.drop_syntax = drop_syntax
         self.line_limit = line_limit
+        self.max_tokens = max_tokens
         self.include_attribute_scores = include_attribute_scores
         self.oracle = oracle
         self.json_output_file = json_output_file
@@ -198,7 +207,8 @@ class ConlluScorer:
                                     self.pred_args.beam_size,
                                     line_limit = self.line_limit,
                                     oracle = self.oracle,
-                                    json_output_file = self.json_output_file)
+                                    json_output_file = self.json_output_file,
+                                    max_tokens = self.max_tokens)
 
     @staticmethod
     def conllu_dict_to_str(conllu_dict):
@@ -210,49 +220,30 @@ class ConlluScorer:
         conllu_str += '\n' 
         return conllu_str
 
+    @staticmethod
+    def conllu_dict_to_rows(conllu_dict):
+        colnames = ["ID", "form", "lemma", "upos", "xpos", "feats", "head", "deprel", "deps", "misc"]
+        return [[row[cn] for cn in colnames] for row in conllu_dict]
+
     def predict_and_compute(self):
+        """
+        Score each predicted sentence against its gold tree in memory.
+        :return: per-sentence mean UAS, LAS, MLAS and BLEX F1, in percent; the corpus-level
+            micro scores are kept in ``self.evaluator``.
+        """
         assert(self.predictor is not None)
-        input_instances, output_graphs = self.manager.run()
-   
-        # ignore everything except conllu graph 
-        if len(output_graphs) > 0 and type(output_graphs[0]) == tuple:
-            output_graphs = [x[-1] for x in output_graphs]
-
-        input_sents = [inst.fields['src_tokens_str'].metadata for inst in input_instances]
-
-        las_scores = []
-        uas_scores = []
-        mlas_scores = []
-        blex_scores = []
-
-        for i in range(len(input_instances)):
-            true_conllu_str = ConlluScorer.conllu_dict_to_str(input_instances[i]['true_conllu_dict'].metadata)
-            pred_conllu_str = output_graphs[i]
-
-        # make temp files
-            with tempfile.NamedTemporaryFile("w") as true_file, \
-                tempfile.NamedTemporaryFile("w") as pred_file:
-                true_file.write(true_conllu_str)
-                pred_file.write(pred_conllu_str) 
-                true_file.seek(0) 
-                pred_file.seek(0) 
-                compute_args["gold_file"] = true_file.name
-                compute_args["system_file"] = pred_file.name
-
-                args = ComputeTup(**compute_args)
-                try:
-                    score = evaluate_wrapper(args)
-                    uas_scores.append(100 * score["UAS"].f1)
-                    las_scores.append(100 * score["LAS"].f1)
-                    mlas_scores.append(100 * score["MLAS"].f1)
-                    blex_scores.append(100 * score["BLEX"].f1)
-                except UDError:
-                    uas_scores.append(0)
-                    las_scores.append(0)
-                    mlas_scores.append(0)
-                    blex_scores.append(0)
-
-        return np.mean(uas_scores), np.mean(las_scores), np.mean(mlas_scores), np.mean(blex_scores)  
+
+        self.evaluator = ConlluEvaluator()
+        for input_instance, output_graph in self.manager.iter_predictions():
+            # ignore everything except conllu graph 
+            if type(output_graph) == tuple:
+                output_graph = output_graph[-1]
+
+            true_conllu_rows = ConlluScorer.conllu_dict_to_rows(input_instance['true_conllu_dict'].metadata)
+            self.evaluator.add(true_conllu_rows, output_graph)
+
+        scores = self.evaluator.get_metrics()
+        return scores["UAS"], scores["LAS"], scores["MLAS"], scores["BLEX"]
  
     @classmethod
     def from_params(cls, args):
@@ -268,6 +259,7 @@ class ConlluScorer:
                    line_limit = args.line_limit,
                    include_attribute_scores = args.include_attribute_scores,
                    oracle = args.oracle,
-                   json_output_file = args.json_output_file
+                   json_output_file = args.json_output_file,
+                   max_tokens = args.max_tokens
                    )
 
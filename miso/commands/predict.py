@@ -1,4 +1,4 @@
-from typing import List, Iterator, Optional
+from typing import List, Iterator, Optional, Tuple
 import argparse
 import sys
 import json
@@ -7,6 +7,7 @@ from collections import defaultdict
 import pdb 
 import pickle as pkl 
 import spacy 
+from networkx.readwrite import json_graph
 from spacy.tokenizer import Tokenizer
 
 from allennlp.commands.predict import _get_predictor, Predict
@@ -22,6 +23,7 @@ from allennlp.commands.predict import _PredictManager
 from allennlp.common.util import import_submodules
 
 from miso.predictors.decomp_parsing_predictor import sanitize, DecompSyntaxParsingPredictor
+from miso.nn.precision import PRECISIONS, set_inference_precision
 from miso.data.dataset_readers.decomp_parsing.decomp import DecompGraph
 from miso.data.dataset_readers.decomp_parsing.decomp_with_syntax import DecompGraphWithSyntax
 
@@ -45,11 +47,13 @@ def parse_api_sentence(input_line, args, predictor):
 
     manager._dataset_reader.api_time = True
 
+    __, result = next(manager.iter_predictions())
+
     if isinstance(predictor, DecompSyntaxParsingPredictor):
-        sem_graph, syn_graph, __ = manager.run()[1][0]
+        sem_graph, syn_graph, __ = result
         return DecompGraphWithSyntax.arbor_to_uds(sem_graph, syn_graph, "test-graph", input_line) 
 
-    return DecompGraph.arbor_to_uds(manager.run()[1][0], "test-graph", input_line) 
+    return DecompGraph.arbor_to_uds(result, "test-graph", input_line) 
 
 def get_input_lines(input_file):
     SPACY_MODEL = "en_core_web_sm"
@@ -60,6 +64,7 @@ def get_input_lines(input_file):
 
 def _predict(args: argparse.Namespace) -> None:
     predictor = _get_predictor(args)
+    set_inference_precision(predictor._model, args.precision)
 
     with_syntax = False 
     if "syntax" in args.predictor: 
@@ -88,14 +93,58 @@ def _predict(args: argparse.Namespace) -> None:
                                     input_file = args.input_file,
                                     output_file = args.output_file,
                                     batch_size = args.batch_size,
-                                    print_to_console = False,
+                                    print_to_console = not args.silent,
                                     has_dataset_reader = True,
                                     beam_size = args.beam_size,
                                     line_limit = args.line_limit,
                                     oracle = False,
-                                    json_output_file = None)
+                                    json_output_file = None,
+                                    max_tokens = args.max_tokens)
+
+        manager.write_predictions()
+
+def _source_length(instance: Instance) -> int:
+    if "source_tokens" in instance.fields:
+        return instance.fields["source_tokens"].sequence_length()
+    return 1
 
-        manager.run()
+def token_budget_batches(lengths: List[int], max_tokens: int) -> List[List[int]]:
+    """
+    Group indices of ``lengths`` into batches of similar length whose padded size, 
+    batch size * longest length, stays within ``max_tokens``. A longer item than the 
+    budget gets a batch of its own. 
+    """
+    batches = []
+    batch, batch_max_length = [], 0
+    for i in sorted(range(len(lengths)), key=lambda i: lengths[i]):
+        max_length = max(batch_max_length, lengths[i])
+        if len(batch) > 0 and (len(batch) + 1) * max_length > max_tokens:
+            batches.append(batch)
+            batch, max_length = [], lengths[i]
+        batch.append(i)
+        batch_max_length = max_length
+    if len(batch) > 0:
+        batches.append(batch)
+    return batches
+
+def _graph_to_json(graph) -> Optional[JsonDict]:
+    if graph is None:
+        return None
+    return sanitize(json_graph.node_link_data(graph))
+
+def _prediction_to_json_line(result) -> str:
+    """
+    Serialize a predicted graph, or the (semantic graph, syntactic graph, conllu string) 
+    triple of a syntax predictor, in networkx node-link format. 
+    """
+    if isinstance(result, tuple):
+        sem_graph, syn_graph, conllu_str = result
+        output = dict(semantics=_graph_to_json(sem_graph), 
+                      syntax=_graph_to_json(syn_graph), 
+                      conllu=conllu_str)
+    else:
+        output = _graph_to_json(result)
+    return json.dumps(output) + "\n"
 
 class _ReturningPredictManager(_PredictManager):
     """
@@ -112,17 +161,22 @@ class _ReturningPredictManager(_PredictManager):
                  beam_size: int,
                  line_limit: int = None,
                  oracle: bool = False,
-                 json_output_file: str = None) -> None:
+                 json_output_file: str = None,
+                 max_tokens: int = None,
+                 sorting_window: int = 1000) -> None:
         super(_ReturningPredictManager, self).__init__(predictor,
                                                        input_file,
-                                                       None,
+                                                       output_file,
                                                        batch_size,
-                                                       False,
+                                                       print_to_console,
                                                        has_dataset_reader)
         self.beam_size = beam_size
         self.line_limit = line_limit 
         self.oracle = oracle 
         self._json_output_file = json_output_file
+        # if set, batch by a budget of padded source tokens instead of batch_size
+        self._max_tokens = max_tokens
+        self._sorting_window = sorting_window
 
     @overrides
     def _predict_instances(self, batch):
@@ -133,35 +187,78 @@ class _ReturningPredictManager(_PredictManager):
             results = self._predictor.predict_batch_instance(batch, self.oracle)
             return [results]
 
-    def run(self):
-        has_reader = self._dataset_reader is not None
-        instances, results = [], []
-        if has_reader:
-            self._dataset_reader.line_limit = self.line_limit
+    def _iter_instance_results(self) -> Iterator[Tuple[Instance, JsonDict]]:
+        # oracle prediction returns one result per batch, which can't be reordered
+        if self._max_tokens is None or self.oracle:
             for batch in lazy_groups_of(self._get_instance_data(), self._batch_size):
                 for model_input_instance, result in zip(batch, self._predict_instances(batch)):
-                    instances.append(model_input_instance)
-                    results.append(result)
-
+                    yield model_input_instance, result
+            return
+
+        # bucket by source length within a window of instances, and restore the input
+        # order of the window before yielding
+        for window in lazy_groups_of(self._get_instance_data(), self._sorting_window):
+            results = [None] * len(window)
+            for batch_indices in token_budget_batches([_source_length(x) for x in window], self._max_tokens):
+                batch = [window[i] for i in batch_indices]
+                for i, result in zip(batch_indices, self._predict_instances(batch)):
+                    results[i] = result
+            for model_input_instance, result in zip(window, results):
+                yield model_input_instance, result
+
+    def iter_predictions(self) -> Iterator[Tuple[Instance, JsonDict]]:
+        """
+        Predict batch by batch and yield (instance, result) pairs, so that memory does not 
+        grow with the size of the input. The oracle json output is accumulated on the way 
+        and written once all batches are done. 
+        """
+        has_reader = self._dataset_reader is not None
         # if oracle, unify all dicts
-        if self.oracle:
-            # results: List[List[Dict]]
-            final_dict = defaultdict(lambda: defaultdict(dict))
-            for res_dict in results:
-                #res_dict = res_dict[0]
-                for prop_key in res_dict.keys():
-                    try:
-                        final_dict[prop_key]['true_val_with_node_ids'].update(res_dict[prop_key]['true_val_with_node_ids'])
-                        final_dict[prop_key]['pred_val_with_node_ids'].update(res_dict[prop_key]['pred_val_with_node_ids'])
-                    except KeyError:
-                        # edge attributes
-                        final_dict[prop_key]['true_val_with_edge_ids'].update(res_dict[prop_key]['true_val_with_edge_ids'])
-                        final_dict[prop_key]['pred_val_with_edge_ids'].update(res_dict[prop_key]['pred_val_with_edge_ids'])
-
-            if self._json_output_file is not None:
-                with open(self._json_output_file, "w") as f1:
-                    json.dump(sanitize(final_dict), f1)
+        final_dict = defaultdict(lambda: defaultdict(dict))
+        if has_reader:
+            self._dataset_reader.line_limit = self.line_limit
+            for model_input_instance, result in self._iter_instance_results():
+                if self.oracle:
+                    self._update_oracle_dict(final_dict, result)
+                yield model_input_instance, result
+
+        if self.oracle and self._json_output_file is not None:
+            with open(self._json_output_file, "w") as f1:
+                json.dump(sanitize(final_dict), f1)
+
+    def write_predictions(self) -> None:
+        """
+        Write each predicted graph as a json line to the output file, and to stdout if 
+        printing to console, as soon as its batch is predicted. 
+        """
+        try:
+            for index, (__, result) in enumerate(self.iter_predictions()):
+                self._maybe_print_to_console_and_file(index, _prediction_to_json_line(result))
+        finally:
+            if self._output_file is not None:
+                self._output_file.close()
+
+    @staticmethod
+    def _update_oracle_dict(final_dict, res_dict):
+        # res_dict: Dict
+        for prop_key in res_dict.keys():
+            try:
+                final_dict[prop_key]['true_val_with_node_ids'].update(res_dict[prop_key]['true_val_with_node_ids'])
+                final_dict[prop_key]['pred_val_with_node_ids'].update(res_dict[prop_key]['pred_val_with_node_ids'])
+            except KeyError:
+                # edge attributes
+                final_dict[prop_key]['true_val_with_edge_ids'].update(res_dict[prop_key]['true_val_with_edge_ids'])
+                final_dict[prop_key]['pred_val_with_edge_ids'].update(res_dict[prop_key]['pred_val_with_edge_ids'])
 
+    def run(self):
+        """
+        Return all instances and results as lists; memory grows with the input, so 
+        callers that only need one pass should use ``iter_predictions``
+        """
+        instances, results = [], []
+        for model_input_instance, result in self.iter_predictions():
+            instances.append(model_input_instance)
+            results.append(result)
         return instances, results
 
 
@@ -182,6 +279,11 @@ class Predict(Subcommand):
 
         batch_size = subparser.add_mutually_exclusive_group(required=False)
         batch_size.add_argument('--batch-size', type=int, default=1, help='The batch size to use for processing')
+        batch_size.add_argument('--max-tokens', 
+                                type=int, 
+                                default=None, 
+                                help='batch instances of similar source length up to this many padded source tokens, '
+                                     'instead of by batch size')
 
         subparser.add_argument('--silent', action='store_true', help='do not print output to stdout')
 
@@ -225,6 +327,11 @@ class Predict(Subcommand):
         subparser.add_argument("--line-limit", 
                                 type=int,
                                 default=None)
+        subparser.add_argument("--precision",
+                                type=str,
+                                choices=sorted(PRECISIONS),
+                                default="float32",
+                                help="run the Linear layers of the encoder and decoder in this precision (float16 needs a GPU)")
 
         subparser.set_defaults(func=_predict)
 
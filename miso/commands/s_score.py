@@ -3,6 +3,10 @@ import pickle as pkl
 from typing import List, Iterator, Dict  
 from collections import namedtuple
 import os
+import contextlib
+import hashlib
+import json
+import tempfile
 import overrides
 import pdb 
 
@@ -24,9 +28,11 @@ from allennlp.data import Instance
 from allennlp.common.util import import_submodules
 
 from miso.data.dataset_readers.decomp_parsing.decomp import DecompGraph
-from miso.metrics.s_metric.s_metric import S, TEST1, NORMAL, compute_s_metric
+from miso.metrics.s_metric.s_metric import S, TEST1, NORMAL, compute_s_metric, compute_s_metric_from_pairs, to_scoring_triples
 from miso.metrics.s_metric.repr import Triple, FloatTriple
+from miso.metrics.s_metric.graph_store import GraphPairStoreWriter, is_graph_pair_store, iter_graph_pairs
 from miso.metrics.s_metric import utils
+from miso.nn.precision import PRECISIONS, set_inference_precision
 from miso.commands.predict import _ReturningPredictManager 
 from miso.commands.conllu_score import ConlluScore
 from miso.commands.conllu_predict import ConlluPredict 
@@ -59,6 +65,47 @@ class ArgNamespace:
         self.save_pred_path = save_pred_path
 
 
+class GoldTriplesFile:
+    """
+    ``ScoringTriples`` of the gold graphs of an input file, pickled in input order, so 
+    that repeated runs on the same input only convert the predicted graphs. The file name 
+    hashes the input file and everything that changes the gold triples. 
+    """
+    # bump when the content of ScoringTriples changes
+    VERSION = 1
+
+    def __init__(self, cache_directory: str, input_file: str, settings: Dict) -> None:
+        key = dict(settings, input_file=input_file, version=self.VERSION)
+        if os.path.exists(input_file):
+            # a file split: invalidate when the file changes
+            stat = os.stat(input_file)
+            key.update(input_file=os.path.abspath(input_file), size=stat.st_size, mtime=stat.st_mtime)
+        digest = hashlib.sha1(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()
+
+        self.path = os.path.join(cache_directory, "{}-{}.pkl".format(os.path.basename(input_file), digest[:16]))
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def load(self) -> List:
+        logger.info(f"Reading gold triples from {self.path}")
+        with open(self.path, "rb") as f1:
+            return pkl.load(f1)
+
+    def save(self, gold_triples: List) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        # write to a temporary file first, so that an interrupted run leaves no partial cache 
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f1:
+                pkl.dump(gold_triples, f1, protocol=pkl.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.path)
+            logger.info(f"Cached {len(gold_triples)} gold triples to {self.path}")
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
 class SScore(Subcommand): 
     def add_subparser(self, name: str, parser: argparse._SubParsersAction) -> argparse.ArgumentParser:
         self.name = name 
@@ -81,6 +128,10 @@ class SScore(Subcommand):
         batch_size.add_argument(
             "--batch-size", type=int, default=1, help="The batch size to use for processing"
         )
+        batch_size.add_argument(
+            "--max-tokens", type=int, default=None, 
+            help="batch instances of similar source length up to this many padded source tokens, instead of by batch size"
+        )
 
         subparser.add_argument(
             "--silent", action="store_true", help="do not print output to stdout"
@@ -127,10 +178,10 @@ class SScore(Subcommand):
                           help="Beam size for seq2seq decoding")
 
         subparser.add_argument("--save-pred-path", type=str, required=False, 
-                                help="optionally specify a path for output pkl") 
+                                help="optionally specify a directory to store the predicted and gold graphs") 
 
         subparser.add_argument("--load-path", type=str, required=False, 
-                                help="path to precomuted predicitons") 
+                                help="path to precomuted predicitons, saved with --save-pred-path or as a pkl") 
         
         subparser.add_argument("--semantics-only", action="store_true", default=False)
 
@@ -140,17 +191,35 @@ class SScore(Subcommand):
 
         subparser.add_argument("--line-limit", type=int, default=None)
 
+        subparser.add_argument("--s-metric-workers", type=int, default=0,
+                                help="number of processes used to score graph pairs (0 scores serially)") 
+
+        subparser.add_argument("--gold-triples-cache", type=str, required=False,
+                                help="optionally specify a directory to cache the triples of the gold graphs, "
+                                     "which are then read instead of recomputed on later runs with the same input") 
+
         subparser.add_argument("--json-output-file", type=str, required=False,
                                 help="optionally specify a path to output json dict") 
 
         subparser.add_argument("--oracle", action = "store_true") 
 
+        subparser.add_argument("--precision", type=str, choices=sorted(PRECISIONS), default="float32",
+                                help="run the Linear layers of the encoder and decoder in this precision (float16 needs a GPU)")
+
         subparser.set_defaults(func=_construct_and_predict)
 
         return subparser
 
 def _construct_and_predict(args: argparse.Namespace) -> None:
+    if args.load_path is not None:
+        # re-score saved graphs without loading the model
+        args.predictor = None
+        p, r, f1 = Scorer.from_params(args).load_and_compute()
+        print(f"Precision: {p}, Recall: {r}, F1: {f1}") 
+        return
+
     predictor = _get_predictor(args)
+    set_inference_precision(predictor._model, args.precision)
     args.predictor = predictor
     scorer = Scorer.from_params(args)
     if args.oracle:
@@ -176,9 +245,13 @@ class Scorer:
                 line_limit = None,
                 include_attribute_scores = False,
                 oracle = False,
-                json_output_file = None):
+                json_output_file = None,
+                s_metric_workers = 0,
+                max_tokens = None,
+                gold_triples_file: GoldTriplesFile = None):
 
         self.load_path = load_path
+        self.predictor = None
         if self.load_path is not None:
             # don't use a predictor if provided with pre-computed graphs
             pass
@@ -191,10 +264,16 @@ class Scorer:
         self.semantics_only = semantics_only
         self.drop_syntax = drop_syntax
         self.line_limit = line_limit
+        self.max_tokens = max_tokens
         self.include_attribute_scores = include_attribute_scores
         self.oracle = oracle
         self.json_output_file = json_output_file
+        self.s_metric_workers = s_metric_workers
+        self.gold_triples_file = gold_triples_file
 
+        if self.predictor is None:
+            self.manager = None
+            return
         
         self.manager = _ReturningPredictManager(self.predictor,
                                     self.pred_args.input_file,
@@ -205,7 +284,8 @@ class Scorer:
                                     self.pred_args.beam_size,
                                     line_limit = self.line_limit,
                                     oracle = self.oracle,
-                                    json_output_file = self.json_output_file)
+                                    json_output_file = self.json_output_file,
+                                    max_tokens = self.max_tokens)
 
     @staticmethod
     def flatten_instance_batches(batch_iterator: Iterator[List[Instance]], 
@@ -233,8 +313,19 @@ class Scorer:
         return flat
 
     def load_graphs(self, path: str):
+        true_graphs, pred_graphs = [], []
         with open(path, 'rb') as f1: 
-            true_graphs, pred_graphs = zip(*pkl.load(f1))
+            while True:
+                try:
+                    pairs = pkl.load(f1)
+                except EOFError:
+                    break
+                if not isinstance(pairs, list):
+                    # pairs written one at a time by predict_and_compute
+                    pairs = [pairs]
+                for true_graph, pred_graph in pairs:
+                    true_graphs.append(true_graph)
+                    pred_graphs.append(pred_graph)
         # deserialize
         return [nx.adjacency_graph(x) for x in true_graphs], [nx.adjacency_graph(x) for x in pred_graphs]
 
@@ -242,48 +333,105 @@ class Scorer:
                          true_graphs: List[DecompGraph],
                          pred_graphs: List[DecompGraph],
                          path: str):
-        with open(path, "wb") as f1:
-            pkl.dump(list(zip(true_graphs, pred_graphs)), f1)
+        """
+        save graphs to a columnar graph store, which ``load_and_compute`` scores straight 
+        from memory-mapped arrays 
+        """
+        with GraphPairStoreWriter(path) as writer:
+            for true_graph, pred_graph in zip(true_graphs, pred_graphs):
+                writer.add(pred_graph, true_graph)
+
+    def iter_saved_graph_pairs(self, path: str):
+        """
+        yield (pred, true) pairs saved at ``path``; a graph store is read lazily, while 
+        pkl files from older versions are deserialized into networkx graphs 
+        """
+        if is_graph_pair_store(path):
+            yield from iter_graph_pairs(path)
+            return
+        true_graphs, pred_graphs = self.load_graphs(path)
+        yield from zip(pred_graphs, true_graphs)
+
+    def load_and_compute(self):
+        assert(self.load_path is not None)
+        return compute_s_metric_from_pairs(self.iter_saved_graph_pairs(self.load_path), 
+                                           semantics_only = self.semantics_only,
+                                           drop_syntax = self.drop_syntax,
+                                           include_attribute_scores = self.include_attribute_scores,
+                                           num_workers = self.s_metric_workers)
+
+    def iter_graph_pairs(self, pred_writer = None):
+        """
+        Predict and yield (pred, true) graph pairs one at a time, optionally adding the 
+        pair to ``pred_writer``, a ``GraphPairStoreWriter``. With a ``gold_triples_file``, 
+        the true graphs are replaced by their cached triples, which are computed and saved 
+        on the first run. 
+        """
+        cached_triples, gold_triples = None, None
+        if self.gold_triples_file is not None:
+            if self.gold_triples_file.exists():
+                cached_triples = self.gold_triples_file.load()
+            else:
+                gold_triples = []
+
+        for i, (input_instance, output_graph) in enumerate(self.manager.iter_predictions()):
+            if type(output_graph) == tuple:
+                # ignore conllu graphs here 
+                output_graph = output_graph[0]
+            input_graph = input_instance.fields['graph'].metadata
+
+            if pred_writer is not None:
+                pred_writer.add(output_graph, input_graph)
+
+            if cached_triples is not None:
+                input_graph = cached_triples[i]
+            elif gold_triples is not None:
+                input_graph = to_scoring_triples(input_graph, self.semantics_only, 
+                                                 self.drop_syntax, self.include_attribute_scores)
+                gold_triples.append(input_graph)
+
+            yield output_graph, input_graph
+
+        if gold_triples is not None:
+            self.gold_triples_file.save(gold_triples)
 
     def predict_and_compute(self):
         assert(self.predictor is not None)
-        input_instances, output_graphs = self.manager.run()
-
-        if len(output_graphs) > 0 and type(output_graphs[0]) == tuple:
-            # ignore conllu graphs here 
-            output_graphs = [x[0] for x in output_graphs]
-
-        input_graphs = [inst.fields['graph'].metadata for inst in input_instances] 
-        input_sents = [inst.fields['src_tokens_str'].metadata for inst in input_instances]
-
-        if self.pred_args.save_pred_path is not None:
-            # save serialized graphs to pkl file  
-            try:
-                self.save_graphs([nx.adjacency_data(x) for x in input_graphs],
-                                 [nx.adjacency_data(x) for x in output_graphs], 
-                                self.pred_args.save_pred_path)
-            except AttributeError:
-                self.save_graphs([nx.adjacency_data(x) for x in input_graphs],
-                                 [nx.adjacency_data(x[0]) for x in output_graphs], 
-                                self.pred_args.save_pred_path)
-                
-        
-        return compute_s_metric(input_graphs, 
-                                output_graphs, 
-                                input_sents, 
-                                semantics_only = self.semantics_only,
-                                drop_syntax = self.drop_syntax,
-                                #args, 
-                                include_attribute_scores = self.include_attribute_scores)
+
+        with contextlib.ExitStack() as stack:
+            pred_writer = None
+            if self.pred_args.save_pred_path is not None:
+                pred_writer = stack.enter_context(GraphPairStoreWriter(self.pred_args.save_pred_path))
+
+            return compute_s_metric_from_pairs(self.iter_graph_pairs(pred_writer), 
+                                               semantics_only = self.semantics_only,
+                                               drop_syntax = self.drop_syntax,
+                                               include_attribute_scores = self.include_attribute_scores,
+                                               num_workers = self.s_metric_workers)
    
     def predict_and_save_oracle(self):
         assert(self.predictor is not None)
-        input_instances, output_graphs = self.manager.run()
+        for __ in self.manager.iter_predictions():
+            pass
 
         return 
  
     @classmethod
     def from_params(cls, args):
+        gold_triples_file = None
+        if getattr(args, "gold_triples_cache", None) is not None:
+            # the gold graphs depend on the dataset reader of the model
+            settings = dict(archive_file = os.path.abspath(args.archive_file),
+                            archive_mtime = os.stat(args.archive_file).st_mtime,
+                            overrides = args.overrides,
+                            use_dataset_reader = args.use_dataset_reader,
+                            dataset_reader_choice = args.dataset_reader_choice,
+                            line_limit = args.line_limit,
+                            semantics_only = args.semantics_only,
+                            drop_syntax = args.drop_syntax,
+                            include_attribute_scores = args.include_attribute_scores)
+            gold_triples_file = GoldTriplesFile(args.gold_triples_cache, args.input_file, settings)
+
         return cls(predictor=args.predictor,
                    input_file = args.input_file,
                    batch_size = args.batch_size,
@@ -296,7 +444,10 @@ class Scorer:
                    line_limit = args.line_limit,
                    include_attribute_scores = args.include_attribute_scores,
                    oracle = args.oracle,
-                   json_output_file = args.json_output_file
+                   json_output_file = args.json_output_file,
+                   s_metric_workers = args.s_metric_workers,
+                   max_tokens = args.max_tokens,
+                   gold_triples_file = gold_triples_file
                    )
 
 if __name__ == "__main__":
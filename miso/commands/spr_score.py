@@ -45,7 +45,9 @@ def _predict(args: argparse.Namespace) -> None:
                               oracle = args.oracle,
                               json_output_file = args.json_output_file,
                               line_limit = args.line_limit)
-    manager.run()
+    # only the accumulated oracle json output is kept 
+    for __ in manager.iter_predictions():
+        pass
 
 
 if __name__ == "__main__":
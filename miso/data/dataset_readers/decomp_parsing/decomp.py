@@ -71,13 +71,32 @@ def parse_attributes(attr_list: List, mask_list: List, ontology: List) -> Dict :
     for k, attr_v, mask_v in zip(ontology, attr_list, mask_list):
         mask_val = sigmoid(mask_v)
         if mask_val > 0.5:
-            # upper and lower bound 
-            if attr_v > 0:
-                attr_v = min(3, attr_v)
-            if attr_v < 0:
-                attr_v = max(-3, attr_v)
-            to_ret[k] = attr_v
-    return to_ret 
+            to_ret[k] = bound_attribute(attr_v)
+    return to_ret
+
+def bound_attribute(attr_v):
+    """clip a predicted attribute value to the [-3, 3] range of the annotations"""
+    # upper and lower bound 
+    if attr_v > 0:
+        attr_v = min(3, attr_v)
+    if attr_v < 0:
+        attr_v = max(-3, attr_v)
+    return attr_v
+
+def parse_attribute_matrix(attr_matrix, mask_matrix, ontology: List) -> List[Dict]:
+    """
+    ``parse_attributes`` applied to every row of a [num_rows, len(ontology)] 
+    attribute/mask matrix, with the mask computed for all rows at once 
+    """
+    attr_matrix = np.asarray(attr_matrix)
+    assert(attr_matrix.shape[-1] == len(ontology))
+    if mask_matrix is None:
+        keep = np.ones(attr_matrix.shape, dtype=bool)
+    else:
+        keep = 1/(1+np.exp(-np.asarray(mask_matrix))) > 0.5
+
+    return [{ontology[k]: bound_attribute(attr_row[k]) for k in np.flatnonzero(keep_row)}
+            for attr_row, keep_row in zip(attr_matrix, keep)]
 
 class DecompGraph():
 
@@ -1094,6 +1113,124 @@ class DecompGraph():
         uds_graph = UDSSentenceGraph(uds_subgraph, name)
         return uds_graph
 
+class DecompPrediction:
+    """
+    S-scoring triples read straight from the output of the decomp parser, without 
+    building the arbor graph of ``DecompGraph.from_prediction`` first. 
+    """
+    @staticmethod
+    def get_triples(output,
+                    semantics_only = False,
+                    drop_syntax = True,
+                    threshold = 0.05,
+                    include_attribute_scores = False):
+        """
+        same triples, in the same order, as ``DecompGraph.get_triples`` on the graph built 
+        by ``DecompGraph.from_prediction(output)``, except that nodes are integer ids 
+        (node "predicted-i" is i) and edge attribute nodes are (parent, child) tuples 
+
+        :param output: output of decomp predictor, with ``nodes``, ``node_indices``, 
+            ``edge_heads``, ``edge_types`` and the attribute arrays 
+        """
+        instances = []
+        relations = []
+        attributes = []
+        if output is None:
+            return instances, relations, attributes
+
+        nodes = output['nodes']
+        corefs = output['node_indices']
+        edge_labels = output['edge_types']
+        edge_heads = [int(x) - 1 for x in output['edge_heads']]
+        edge_heads[0] = 0
+
+        node_attr = output['node_attributes'][0]
+        edge_attr = output['edge_attributes']
+        assert(len(edge_labels) == len(edge_heads) == len(edge_attr))
+
+        if include_attribute_scores:
+            # off by 1, as in from_prediction 
+            node_attr = parse_attribute_matrix(node_attr, output['node_attributes_mask'][0],
+                                               NODE_ONTOLOGY)[1:] + [{}]
+            edge_attr = parse_attribute_matrix(edge_attr, output['edge_attributes_mask'],
+                                               EDGE_ONTOLOGY)
+
+        # nodes that are not copies of a previous node, in graph order 
+        node_types = {}
+        real_node_mapping = {}
+        for i in range(min(len(nodes), len(node_attr), len(corefs))):
+            real_node_mapping[i] = int(corefs[i])
+            if real_node_mapping[i] == i:
+                node_types[i] = 'semantics'
+
+        # successors of each node in the order edges are added; repeated edges are merged 
+        successors = {node: {} for node in node_types}
+        for i, (label, head) in enumerate(zip(edge_labels, edge_heads)):
+            try:
+                child = real_node_mapping[i]
+                parent = real_node_mapping[head]
+            except KeyError:
+                continue
+            if parent not in node_types or child not in node_types:
+                raise KeyError(f"the following edge points to a missing node: {parent}, {child}")
+
+            if label != "EMPTY":
+                attr = dict(edge_attr[i]) if include_attribute_scores else {}
+                attr['semrel'] = label
+                node_types[parent] = 'semantics'
+                node_types[child] = 'semantics'
+            else:
+                attr = {'semrel': 'nonhead'}
+                node_types[child] = 'syntax'
+
+            if child in successors[parent]:
+                successors[parent][child].update(attr)
+            else:
+                successors[parent][child] = attr
+
+        for node, node_type in node_types.items():
+            if semantics_only and node_type != 'semantics':
+                continue
+
+            text = nodes[node]
+            if text == "@@ROOT@@":
+                text = "root"
+            instances.append(("instance", node, text))
+
+            if include_attribute_scores and node_type == 'semantics' and text != "root":
+                node_attrs = node_attr[node]
+                for key in NODE_ONTOLOGY:
+                    if key in node_attrs and abs(node_attrs[key]) > threshold:
+                        attributes.append((key, node, node_attrs[key]))
+
+        for parent, children in successors.items():
+            for child, edge_attrs in children.items():
+                # skip self-edges
+                if parent == child:
+                    continue
+
+                if semantics_only and \
+                   (node_types[parent] != 'semantics' or node_types[child] != 'semantics'):
+                    continue
+
+                rel = edge_attrs['semrel']
+                if rel != 'arg' and drop_syntax:
+                    rel = "nonhead"
+
+                if include_attribute_scores and rel == "arg":
+                    any_annotated = False
+                    for key in EDGE_ONTOLOGY:
+                        if key in edge_attrs and abs(edge_attrs[key]) > threshold:
+                            attributes.append((key, (parent, child), edge_attrs[key]))
+                            any_annotated = True
+                    if any_annotated:
+                        instances.append(("instance", (parent, child), "arg"))
+
+                relations.append((rel, child, parent))
+
+        return instances, relations, attributes
+
+
 class SourceCopyVocabulary:
     def __init__(self, sentence, pad_token=DEFAULT_PADDING_TOKEN, unk_token=DEFAULT_OOV_TOKEN):
         if type(sentence) is not list:
@@ -1134,3 +1271,16 @@ class SourceCopyVocabulary:
 
     def __repr__(self):
         return json.dumps(self.idx_to_token)
+
+
+def copy_map_to_slots(copy_map: List, length: int) -> np.ndarray:
+    """
+    :param copy_map: (token index, dynamic vocab index) pairs, e.g. from
+        ``SourceCopyVocabulary.get_copy_map``.
+    :param length: the number of tokens.
+    :return: [length] the dynamic vocab index of each token, -1 for tokens without one.
+    """
+    slots = np.full(length, -1, dtype=np.int64)
+    for token_idx, copy_idx in copy_map:
+        slots[token_idx] = copy_idx
+    return slots
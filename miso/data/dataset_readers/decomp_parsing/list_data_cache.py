@@ -0,0 +1,105 @@
+from typing import Dict, Iterable, Iterator, Optional
+import hashlib
+import json
+import logging
+import mmap
+import os
+import pickle
+import shutil
+import tempfile
+
+import numpy as np
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+# bump when the content of list_data changes
+CACHE_VERSION = 1
+
+
+def tokenizer_name(tokenizer) -> Optional[str]:
+    if tokenizer is None:
+        return None
+    name = getattr(tokenizer, "name_or_path", None)
+    if name is None:
+        # older tokenizers don't keep their name; the class and vocab size identify them
+        # well enough, since tokenizers with the same vocab split words the same way
+        name = "{}-{}".format(type(tokenizer).__name__, len(tokenizer))
+    return name
+
+
+class ListDataCache:
+    """
+    On-disk cache of the linearized ``list_data`` records of a split, so that later reads
+    skip loading the UDS corpus and traversing the graphs.
+
+    Records are pickled back to back into one data file with an index of byte offsets,
+    and read lazily from a memory map. Skipped graphs (``list_data`` is None) are stored
+    as empty records, so that ``line_limit`` counts graphs the same way with and without
+    the cache.
+    """
+    def __init__(self, cache_directory: str, split: str, settings: Dict) -> None:
+        key = dict(settings, split=split, version=CACHE_VERSION)
+        if os.path.exists(split):
+            # a file split: invalidate when the file changes
+            stat = os.stat(split)
+            key.update(split=os.path.abspath(split), size=stat.st_size, mtime=stat.st_mtime)
+        digest = hashlib.sha1(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()
+
+        self.key = key
+        self.path = os.path.join(cache_directory, "{}-{}".format(os.path.basename(split), digest[:16]))
+
+    @property
+    def _data_file(self) -> str:
+        return os.path.join(self.path, "records.bin")
+
+    @property
+    def _offsets_file(self) -> str:
+        return os.path.join(self.path, "offsets.npy")
+
+    def exists(self) -> bool:
+        return os.path.exists(self._offsets_file)
+
+    def read(self) -> Iterator[Optional[Dict]]:
+        offsets = np.load(self._offsets_file, mmap_mode="r")
+        logger.info("Reading %d cached records from %s", len(offsets) - 1, self.path)
+        if offsets[-1] == 0:
+            for __ in range(len(offsets) - 1):
+                yield None
+            return
+        with open(self._data_file, "rb") as data_file:
+            with mmap.mmap(data_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                for start, end in zip(offsets[:-1], offsets[1:]):
+                    if start == end:
+                        yield None
+                    else:
+                        yield pickle.loads(data[start:end])
+
+    def write(self, list_data_iterable: Iterable[Optional[Dict]]) -> Iterator[Optional[Dict]]:
+        """
+        Pass ``list_data_iterable`` through while caching it. The cache is only committed
+        once the iterable is exhausted, so an interrupted read leaves no partial cache.
+        """
+        parent = os.path.dirname(self.path)
+        os.makedirs(parent, exist_ok=True)
+        tmp_path = tempfile.mkdtemp(dir=parent, prefix=".tmp-")
+        try:
+            offsets = [0]
+            with open(os.path.join(tmp_path, "records.bin"), "wb") as data_file:
+                for list_data in list_data_iterable:
+                    if list_data is not None:
+                        data_file.write(pickle.dumps(list_data, protocol=pickle.HIGHEST_PROTOCOL))
+                    offsets.append(data_file.tell())
+                    yield list_data
+            np.save(os.path.join(tmp_path, "offsets.npy"), np.array(offsets, dtype=np.int64))
+            with open(os.path.join(tmp_path, "key.json"), "w") as key_file:
+                json.dump(self.key, key_file, indent=2, sort_keys=True)
+
+            try:
+                os.rename(tmp_path, self.path)
+                logger.info("Cached %d records to %s", len(offsets) - 1, self.path)
+            except OSError:
+                # another process committed the same cache first
+                pass
+        finally:
+            if os.path.exists(tmp_path):
+                shutil.rmtree(tmp_path)
@@ -0,0 +1,45 @@
+from typing import Dict, Iterator, Optional
+import logging
+import multiprocessing
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+# Set in the main process right before the pool forks, so that workers inherit the
+# reader and the corpus instead of receiving pickled graphs.
+_worker_reader = None
+_worker_graphs = None
+
+
+def _graph_to_list_data(name: str) -> Optional[Dict]:
+    return _worker_reader.graph_to_list_data(_worker_graphs[name])
+
+
+def iter_list_data(reader,
+                   graphs: Dict,
+                   num_workers: int = 0,
+                   ordered: bool = True,
+                   chunksize: int = 16) -> Iterator[Optional[Dict]]:
+    """
+    Linearize graphs with ``reader.graph_to_list_data``, in a pool of forked worker
+    processes if ``num_workers`` > 0. Workers return the picklable ``list_data`` records
+    and the caller builds the Fields, so Instances are still made in the main process.
+
+    :param graphs: a dict from graph name to graph, e.g. ``UDSCorpus.graphs``.
+    :param ordered: yield records in corpus order; otherwise yield them as soon as they
+        are ready, which keeps all workers busy when graph sizes vary a lot.
+    """
+    global _worker_reader, _worker_graphs  # pylint: disable=global-statement
+    if num_workers <= 0:
+        for graph in graphs.values():
+            yield reader.graph_to_list_data(graph)
+        return
+
+    logger.info("Linearizing %d graphs with %d workers", len(graphs), num_workers)
+    _worker_reader, _worker_graphs = reader, graphs
+    try:
+        with multiprocessing.get_context("fork").Pool(num_workers) as pool:
+            imap = pool.imap if ordered else pool.imap_unordered
+            for list_data in imap(_graph_to_list_data, graphs.keys(), chunksize=chunksize):
+                yield list_data
+    finally:
+        _worker_reader, _worker_graphs = None, None
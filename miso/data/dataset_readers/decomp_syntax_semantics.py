@@ -6,10 +6,12 @@ import sys
 from glob import glob 
 from overrides import overrides
 
+import numpy as np
+
 from allennlp.data.dataset_readers.dataset_reader import DatasetReader
 from allennlp.data.token_indexers import TokenIndexer, SingleIdTokenIndexer
 from allennlp.data.tokenizers import Tokenizer, Token
-from allennlp.data.fields import TextField, ArrayField, SequenceLabelField, MetadataField, AdjacencyField
+from allennlp.data.fields import TextField, ArrayField, SequenceLabelField, MetadataField
 from allennlp.data.instance import Instance
 from allennlp.common.util import START_SYMBOL, END_SYMBOL
 
@@ -19,7 +21,10 @@ from miso.data.fields.continuous_label_field import ContinuousLabelField
 from miso.data.dataset_readers.decomp_parsing.ontology import NODE_ONTOLOGY, EDGE_ONTOLOGY
 from miso.data.dataset_readers.decomp_parsing.tests import DROP_TEST_CASES, NODROP_TEST_CASES, test_reader
 from miso.data.dataset_readers.decomp_parsing.decomp_with_syntax import DecompGraphWithSyntax 
+from miso.data.dataset_readers.decomp_parsing.decomp import copy_map_to_slots
 from miso.data.dataset_readers.decomp_parsing.uds import TestUDSCorpus
+from miso.data.dataset_readers.decomp_parsing.list_data_cache import ListDataCache, tokenizer_name
+from miso.data.dataset_readers.decomp_parsing.list_data_pool import iter_list_data
 from miso.data.tokenizers import AMRBertTokenizer, AMRXLMRobertaTokenizer, MisoTokenizer
 
 import pdb 
@@ -44,6 +49,9 @@ class DecompDatasetReader(DatasetReader):
                  lazy: bool = False,
                  api_time: bool = False,
                  full_ud_parse: bool = False, 
+                 cache_directory: str = None,
+                 num_workers: int = 0,
+                 ordered: bool = True,
                  ) -> None:
 
         super().__init__(lazy=lazy)
@@ -80,6 +88,11 @@ class DecompDatasetReader(DatasetReader):
     
         self.over_len = 0
         self.api_time = api_time
+        self.cache_directory = cache_directory
+        # linearize graphs in this many worker processes; if not ordered, instances are 
+        # yielded as soon as their graph is done rather than in corpus order 
+        self.num_workers = num_workers
+        self.ordered = ordered
 
     def report_coverage(self):
         if self._number_bert_ids != 0:
@@ -96,37 +109,51 @@ class DecompDatasetReader(DatasetReader):
     def set_evaluation(self):
         self.eval = True
     
+    def _load_corpus(self, split: str):
+        if split in ['train', 'test', 'dev']:
+            return UDSCorpus(split = split)
+        # if not standard (pretraining data)
+        if split.endswith(".json"):
+            return UDSCorpus.from_json(split)
+        # data is just lines of input text
+        if self.api_time:
+            return TestUDSCorpus.from_single_line(split)
+        return TestUDSCorpus.from_ud_lines(split)
+
+    def _get_list_data_cache(self, split: str) -> ListDataCache:
+        if self.cache_directory is None or self.api_time:
+            return None
+        return ListDataCache(self.cache_directory, split, self._list_data_settings())
+
     @overrides
     def _read(self, split: str) -> Iterable[Instance]:
         logger.info("Reading decompositional semantic data from: %s", split)
-        if split in ['train', 'test', 'dev']:
-            uds = UDSCorpus(split = split)
+
+        cache = self._get_list_data_cache(split)
+        if cache is not None and cache.exists():
+            # skip the corpus and graph traversal entirely
+            list_data_iterable = cache.read()
         else:
-            # if not standard (pretraining data)
-            if split.endswith(".json"):
-                uds = UDSCorpus.from_json(split)
-            else:
-                # data is just lines of input text
-                if self.api_time:
-                    uds = TestUDSCorpus.from_single_line(split)
-                else:
-                    uds = TestUDSCorpus.from_ud_lines(split)
+            uds = self._load_corpus(split)
+            list_data_iterable = iter_list_data(self, uds.graphs, self.num_workers, self.ordered)
+            # only complete splits in corpus order are cached
+            if cache is not None and self.line_limit is None and self.ordered:
+                list_data_iterable = cache.write(list_data_iterable)
 
         # corpus is Graphs and annotations 
         i=0
         skipped = 0
-        for name, graph in uds.graphs.items():               
+        for list_data in list_data_iterable:
             i+=1
 
-            t2i = self.text_to_instance(graph)
-            if t2i is None:
+            if list_data is None:
                 skipped += 1
                 continue
             if self.line_limit is not None:
                 if i > self.line_limit:
                     break
 
-            yield t2i
+            yield self.list_data_to_instance(list_data)
 
     def pprint_graph(self, graph, full_graph = 0):
         if full_graph:
@@ -160,31 +187,51 @@ class DecompDatasetReader(DatasetReader):
         #print("===========================")
         #print()
 
-    @overrides
-    def text_to_instance(self, graph, do_print=False) -> Instance:
+    def _max_tgt_length(self) -> int:
+        return None if self.eval else 90
+
+    def _list_data_settings(self) -> Dict:
         """
-        Does bulk of work converting a graph to an Instance of Fields 
+        Reader settings that determine list_data, used to key the list_data cache 
         """
-        # pylint: disable=arguments-differ
-
-        fields: Dict[str, Field] = {}
-
-        max_tgt_length = None if self.eval else 90
-        d = DecompGraphWithSyntax(graph, drop_syntax = self.drop_syntax, order = self.order, syntactic_method = self.syntactic_method, full_ud_parse = self.full_ud_parse) 
-
-        list_data = d.get_list_data(
+        settings = dict(drop_syntax = self.drop_syntax,
+                        semantics_only = self.semantics_only,
+                        order = self.order,
+                        tokenizer = tokenizer_name(self._tokenizer),
+                        max_tgt_length = self._max_tgt_length())
+        settings.update(dict(syntactic_method = self.syntactic_method,
+                    full_ud_parse = self.full_ud_parse))
+        return settings
+
+    def graph_to_list_data(self, graph) -> Dict:
+        """
+        Linearize a graph, None if it should be skipped 
+        """
+        d = DecompGraphWithSyntax(graph, drop_syntax = self.drop_syntax, order = self.order, syntactic_method = self.syntactic_method, full_ud_parse = self.full_ud_parse)
+        return d.get_list_data(
              bos=START_SYMBOL, 
              eos=END_SYMBOL, 
              bert_tokenizer = self._tokenizer, 
-             max_tgt_length = max_tgt_length, 
+             max_tgt_length = self._max_tgt_length(), 
              semantics_only = self.semantics_only)
 
+    @overrides
+    def text_to_instance(self, graph, do_print=False) -> Instance:
+        """
+        Does bulk of work converting a graph to an Instance of Fields 
+        """
+        # pylint: disable=arguments-differ
+        list_data = self.graph_to_list_data(graph)
         if list_data is None:
             return None
 
         if do_print:
             self.spot_check(graph, list_data)
 
+        return self.list_data_to_instance(list_data)
+
+    def list_data_to_instance(self, list_data: Dict) -> Instance:
+        fields: Dict[str, Field] = {}
 
         # These four fields are used for seq2seq model and target side self copy
         fields["source_tokens"] = TextField(
@@ -246,10 +293,10 @@ class DecompDatasetReader(DatasetReader):
             label_namespace="target_copy_indices",
         )
 
-        fields["target_attention_map"] = AdjacencyField(  # TODO: replace it with ArrayField.
-            indices=list_data["tgt_copy_map"],
-            sequence_field=fields["generation_outputs"],
-            padding_value=0
+        fields["target_attention_map"] = ArrayField(
+            array=copy_map_to_slots(list_data["tgt_copy_map"], fields["generation_outputs"].sequence_length()),
+            padding_value=-1,
+            dtype=np.int64
         )
 
 
@@ -262,12 +309,13 @@ class DecompDatasetReader(DatasetReader):
             label_namespace="source_copy_indices",
         )
 
-        fields["source_attention_map"] = AdjacencyField(  # TODO: replace it with ArrayField.
-            indices=list_data["src_copy_map"],
-            sequence_field=TextField(
-                [Token(x) for x in list_data["src_copy_vocab"].get_special_tok_list() + list_data["src_tokens"]], None
+        fields["source_attention_map"] = ArrayField(
+            array=copy_map_to_slots(
+                list_data["src_copy_map"],
+                len(list_data["src_copy_vocab"].get_special_tok_list()) + len(list_data["src_tokens"])
             ),
-            padding_value=0
+            padding_value=-1,
+            dtype=np.int64
         )
 
         # These two fields are used in biaffine parser
@@ -15,6 +15,18 @@ from allennlp.data.vocabulary import Vocabulary
 
 logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
 
+# sorted ontology and its index, shared by all fields with the same ontology
+_ONTOLOGY_INDICES: Dict[frozenset, Tuple[List[str], Dict[str, int]]] = {}
+
+
+def ontology_index(ontology) -> Tuple[List[str], Dict[str, int]]:
+    key = frozenset(ontology)
+    if key not in _ONTOLOGY_INDICES:
+        sorted_ontology = sorted(key)
+        _ONTOLOGY_INDICES[key] = (sorted_ontology, {k: i for i, k in enumerate(sorted_ontology)})
+    return _ONTOLOGY_INDICES[key]
+
+
 class ContinuousLabelField(Field[torch.Tensor]):
     """
     A ``ContinuousLabelField`` assigns a vector of continuous labels to each element in a
@@ -42,60 +54,78 @@ class ContinuousLabelField(Field[torch.Tensor]):
                  labels: List[Dict],
                  sequence_field: SequenceField,
                  ontology: set) -> None:
-        # sort ontology
-        self.ontology = sorted(list(set(ontology)))
-        self.ontology_to_idx = {}
-        self.idx_to_ontology = {}
-        for i, k in enumerate(self.ontology):
-            self.ontology_to_idx[k] = i
-            self.idx_to_ontology[i] = k
-
-        self.labels = [None for i in range(sequence_field.sequence_length())]
-        self.masks = [None for i in range(sequence_field.sequence_length())]
-        for lab_idx, label_dict in enumerate(labels):
-            mask_vector = np.zeros((len(self.ontology)))
-            label_vector = np.zeros((len(self.ontology)))
-            for k,v in label_dict.items():
-                # skip everything that isn't in the ontology
-                if k not in self.ontology:
-                    continue
-                k_idx = self.ontology_to_idx[k]
-                value = v['value']
-                confidence = v['confidence']
-                label_vector[k_idx] = value
-                mask_vector[k_idx] = confidence
-
-            self.labels[lab_idx] = label_vector
-            self.masks[lab_idx] = mask_vector
-
+        self.ontology, self.ontology_to_idx = ontology_index(ontology)
         self.sequence_field = sequence_field
 
         if len(labels) != sequence_field.sequence_length():
             raise ConfigurationError("Label length and sequence length "
                                      "don't match: %d and %d" % (len(labels), sequence_field.sequence_length()))
 
+        # sparse labels: the (position, ontology index) of every annotated attribute,
+        # with its value and confidence
+        positions, indices, values, confidences = [], [], [], []
+        for lab_idx, label_dict in enumerate(labels):
+            for k, v in label_dict.items():
+                k_idx = self.ontology_to_idx.get(k)
+                # skip everything that isn't in the ontology
+                if k_idx is None:
+                    continue
+                positions.append(lab_idx)
+                indices.append(k_idx)
+                values.append(v['value'])
+                confidences.append(v['confidence'])
+
+        self.positions = np.array(positions, dtype=np.int32)
+        self.indices = np.array(indices, dtype=np.int32)
+        self.values = np.array(values, dtype=np.float64)
+        self.confidences = np.array(confidences, dtype=np.float64)
+
+    def _dense(self, sparse_values: np.ndarray) -> List[np.ndarray]:
+        dense = np.zeros((self.sequence_field.sequence_length(), len(self.ontology)))
+        dense[self.positions, self.indices] = sparse_values
+        return list(dense)
+
+    @property
+    def labels(self) -> List[np.ndarray]:
+        """the attribute values of each element, as dense vectors over the ontology"""
+        return self._dense(self.values)
+
+    @property
+    def masks(self) -> List[np.ndarray]:
+        """the annotator confidence of each attribute of each element, 0 if not annotated"""
+        return self._dense(self.confidences)
 
     @overrides
     def get_padding_lengths(self) -> Dict[str, int]:
         return {'num_tokens': self.sequence_field.sequence_length()}
 
     @overrides
-    def as_tensor(self, padding_lengths: Dict[str, int]) -> torch.Tensor:
-        empty_vector = np.zeros((len(self.ontology)))
+    def as_tensor(self, padding_lengths: Dict[str, int]) -> Tuple[np.ndarray, ...]:
+        """
+        Returns the sparse labels that fit in the padded length; they are scattered into
+        the padded batch tensor by ``batch_tensors``.
+        """
         desired_num_tokens = padding_lengths['num_tokens']
-        padded_tags = pad_sequence_to_length(self.labels, desired_num_tokens, default_value = lambda: empty_vector)
-        padded_masks = pad_sequence_to_length(self.masks, desired_num_tokens, default_value = lambda: empty_vector)
-        tensor = torch.FloatTensor(padded_tags)
-        mask = torch.FloatTensor(padded_masks)
-        assert(tensor.shape == mask.shape)
-        return tensor, mask
+        keep = self.positions < desired_num_tokens
+        return (self.positions[keep], self.indices[keep],
+                self.values[keep], self.confidences[keep], desired_num_tokens)
 
     @overrides
-    def batch_tensors(self, tensor_list: List[Tuple[DataArray]]) -> DataArray:
-        attribute_tensors, mask_tensors = zip(*tensor_list)
-        stack = torch.stack((torch.stack(attribute_tensors), torch.stack(mask_tensors)))
+    def batch_tensors(self, tensor_list: List[Tuple[np.ndarray, ...]]) -> DataArray:
+        """
+        :return: [2, batch_size, num_tokens, ontology_size] attribute values and masks.
+        """
+        positions, indices, values, confidences, num_tokens = zip(*tensor_list)
+        batch_indices = np.repeat(np.arange(len(tensor_list)), [len(x) for x in positions])
+        index = (torch.from_numpy(batch_indices).long(),
+                 torch.from_numpy(np.concatenate(positions)).long(),
+                 torch.from_numpy(np.concatenate(indices)).long())
+
         # concat attributes and mask 
-        return torch.stack((torch.stack(attribute_tensors), torch.stack(mask_tensors)))
+        tensor = torch.zeros(2, len(tensor_list), max(num_tokens), len(self.ontology))
+        tensor[0].index_put_(index, torch.from_numpy(np.concatenate(values)).float())
+        tensor[1].index_put_(index, torch.from_numpy(np.concatenate(confidences)).float())
+        return tensor
 
     @overrides
     def empty_field(self) -> 'ContinuousLabelField':  # pylint: disable=no-self-use
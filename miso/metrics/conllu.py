@@ -97,7 +97,6 @@ import io
 import sys
 import unicodedata
 import unittest
-import pdb 
 
 # CoNLL-U column names
 ID, FORM, LEMMA, UPOS, XPOS, FEATS, HEAD, DEPREL, DEPS, MISC = range(10)
@@ -195,7 +194,6 @@ def load_conllu(file):
             # Add parent and children UDWord links and check there are no cycles
             def process_word(word):
                 if word.parent == "remapping":
-                    pdb.set_trace() 
                     raise UDError("There is a cycle in a sentence")
                 if word.parent is None:
                     head = int(word.columns[HEAD])
@@ -484,6 +482,98 @@ def evaluate_wrapper(args):
     system_ud = load_conllu_file(args.system_file)
     return evaluate(gold_ud, system_ud)
 
+# In-memory evaluation, without writing or re-reading CoNLL-U files
+class _LineReader:
+    """Gives `load_conllu` the `readline` of a file over in-memory lines."""
+    def __init__(self, lines):
+        self._lines = iter(lines)
+
+    def readline(self):
+        return next(self._lines, "")
+
+def _sentence_lines(sentence):
+    # A sentence is either CoNLL-U text or a list of 10-column token rows.
+    if isinstance(sentence, str):
+        for line in sentence.splitlines():
+            yield line + "\n"
+        # `load_conllu` ends each sentence at an empty line
+        if not sentence.endswith("\n\n"):
+            yield "\n"
+    else:
+        for row in sentence:
+            yield "\t".join(row) + "\n"
+        yield "\n"
+
+def load_conllu_sentences(sentences):
+    """Load an iterable of sentences, each CoNLL-U text or a list of token rows."""
+    return load_conllu(_LineReader(line for sentence in sentences for line in _sentence_lines(sentence)))
+
+class ConlluEvaluator:
+    """
+    Scores gold/system sentence pairs one at a time and accumulates both the
+    per-sentence mean F1 and the corpus-level micro scores of every metric.
+
+    A pair that cannot be loaded or aligned (UDError) gets an F1 of 0 in the
+    per-sentence mean, and its gold words still count towards the micro recall.
+    """
+    METRICS = ["Tokens", "Sentences", "Words", "UPOS", "XPOS", "UFeats", "AllTags",
+               "Lemmas", "UAS", "LAS", "CLAS", "MLAS", "BLEX"]
+
+    def __init__(self):
+        self.num_sentences = 0
+        self.num_errors = 0
+        self._f1_sums = {metric: 0.0 for metric in self.METRICS}
+        # correct, gold_total, system_total
+        self._counts = {metric: [0, 0, 0] for metric in self.METRICS}
+
+    def add(self, gold_sentence, system_sentence):
+        """
+        :return: the evaluation of the pair as returned by `evaluate`, or None on a UDError.
+        """
+        self.num_sentences += 1
+        try:
+            gold_ud = load_conllu_sentences([gold_sentence])
+        except UDError:
+            self.num_errors += 1
+            return None
+        try:
+            evaluation = evaluate(gold_ud, load_conllu_sentences([system_sentence]))
+        except UDError:
+            self.num_errors += 1
+            evaluation = evaluate(gold_ud, gold_ud)
+            for metric in self.METRICS:
+                self._counts[metric][1] += evaluation[metric].gold_total
+            return None
+
+        for metric in self.METRICS:
+            score = evaluation[metric]
+            self._f1_sums[metric] += score.f1
+            counts = self._counts[metric]
+            counts[0] += score.correct
+            counts[1] += score.gold_total
+            counts[2] += score.system_total
+        return evaluation
+
+    def add_corpus(self, gold_sentences, system_sentences):
+        for gold_sentence, system_sentence in zip(gold_sentences, system_sentences):
+            self.add(gold_sentence, system_sentence)
+        return self
+
+    def mean_f1(self, metric):
+        return self._f1_sums[metric] / self.num_sentences if self.num_sentences else 0.0
+
+    def micro_f1(self, metric):
+        correct, gold_total, system_total = self._counts[metric]
+        return 2 * correct / (gold_total + system_total) if gold_total + system_total else 0.0
+
+    def get_metrics(self, metrics=("UAS", "LAS", "MLAS", "BLEX")):
+        """Per-sentence mean and micro F1 scores, in percent."""
+        scores = {}
+        for metric in metrics:
+            scores[metric] = 100 * self.mean_f1(metric)
+            scores[metric + "_micro"] = 100 * self.micro_f1(metric)
+        return scores
+
 def main():
     # Parse arguments
     parser = argparse.ArgumentParser()
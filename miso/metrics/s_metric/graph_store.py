@@ -0,0 +1,331 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from collections import namedtuple
+import json
+import logging
+import os
+
+import numpy as np
+import networkx as nx
+
+from miso.data.dataset_readers.decomp_parsing.ontology import NODE_ONTOLOGY, EDGE_ONTOLOGY
+
+logger = logging.getLogger(__name__)
+
+STORE_VERSION = 1
+
+# name: (dtype, number of columns or None for 1-d)
+NODE_COLUMNS = {"node_name": ("int32", None),
+                "node_text": ("int32", None),
+                "node_type": ("int32", None),
+                "node_attributes": ("float64", len(NODE_ONTOLOGY))}
+EDGE_COLUMNS = {"edge_source": ("int32", None),
+                "edge_target": ("int32", None),
+                "edge_semrel": ("int32", None),
+                "edge_attributes": ("float64", len(EDGE_ONTOLOGY))}
+
+
+def _convert_attrs(attrs: Dict) -> Dict:
+    """The attribute flattening of ``DecompGraph.get_triples`` for PredPatt graphs."""
+    to_ret = {}
+    for key in attrs.keys():
+        if type(attrs[key]) == dict:
+            for subkey in attrs[key].keys():
+                fullkey = key + "-" + subkey
+                if fullkey in NODE_ONTOLOGY or fullkey in EDGE_ONTOLOGY:
+                    to_ret[fullkey] = attrs[key][subkey]['value'] * attrs[key][subkey]['confidence']
+        else:
+            to_ret[key] = attrs[key]
+    return to_ret
+
+
+def _attribute_row(attrs: Dict, ontology: List[str]) -> List[float]:
+    if "frompredpatt" in attrs.keys():
+        attrs = _convert_attrs(attrs)
+    row = []
+    for key in ontology:
+        value = attrs.get(key, None)
+        row.append(np.nan if value is None else float(value))
+    return row
+
+
+class GraphStoreWriter:
+    """
+    Append graphs to a columnar store: node and edge columns are written back to back in
+    flat binary files, strings (node names, texts, types, edge relations) are interned
+    into a string table, and per-graph offsets are written on ``close``.
+    Graphs can be ``None``, which ``get_triples`` scores as an empty graph.
+    """
+    def __init__(self, path: str) -> None:
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._files = {name: open(os.path.join(path, name + ".bin"), "wb")
+                       for name in list(NODE_COLUMNS) + list(EDGE_COLUMNS) + ["strings"]}
+        self._string_ids = {}
+        self._string_offsets = [0]
+        self._node_offsets = [0]
+        self._edge_offsets = [0]
+        self._is_none = []
+
+    def _intern(self, string) -> int:
+        if string is None:
+            return -1
+        string = str(string)
+        string_id = self._string_ids.get(string, None)
+        if string_id is None:
+            string_id = len(self._string_ids)
+            self._string_ids[string] = string_id
+            data = string.encode("utf-8")
+            self._files["strings"].write(data)
+            self._string_offsets.append(self._string_offsets[-1] + len(data))
+        return string_id
+
+    def _write(self, name: str, values: List, dtype: str) -> None:
+        np.asarray(values, dtype=dtype).tofile(self._files[name])
+
+    def add(self, graph: Optional[nx.DiGraph]) -> None:
+        self._is_none.append(graph is None)
+        if graph is None:
+            self._node_offsets.append(self._node_offsets[-1])
+            self._edge_offsets.append(self._edge_offsets[-1])
+            return
+
+        node_index = {}
+        names, texts, types, node_attributes = [], [], [], []
+        for node, attrs in graph.nodes(data=True):
+            node_index[node] = len(node_index)
+            names.append(self._intern(node))
+            texts.append(self._intern(attrs.get("text", None)))
+            types.append(self._intern(attrs.get("type", None)))
+            node_attributes.append(_attribute_row(attrs, NODE_ONTOLOGY))
+
+        sources, targets, semrels, edge_attributes = [], [], [], []
+        for source, target, attrs in graph.edges(data=True):
+            sources.append(node_index[source])
+            targets.append(node_index[target])
+            semrels.append(self._intern(attrs.get("semrel", None)))
+            edge_attributes.append(_attribute_row(attrs, EDGE_ONTOLOGY))
+
+        self._write("node_name", names, "int32")
+        self._write("node_text", texts, "int32")
+        self._write("node_type", types, "int32")
+        self._write("node_attributes", node_attributes, "float64")
+        self._write("edge_source", sources, "int32")
+        self._write("edge_target", targets, "int32")
+        self._write("edge_semrel", semrels, "int32")
+        self._write("edge_attributes", edge_attributes, "float64")
+        self._node_offsets.append(self._node_offsets[-1] + len(names))
+        self._edge_offsets.append(self._edge_offsets[-1] + len(sources))
+
+    def close(self) -> None:
+        for f in self._files.values():
+            f.close()
+        np.save(os.path.join(self.path, "string_offsets.npy"), np.array(self._string_offsets, dtype=np.int64))
+        np.save(os.path.join(self.path, "node_offsets.npy"), np.array(self._node_offsets, dtype=np.int64))
+        np.save(os.path.join(self.path, "edge_offsets.npy"), np.array(self._edge_offsets, dtype=np.int64))
+        np.save(os.path.join(self.path, "is_none.npy"), np.array(self._is_none, dtype=bool))
+        # written last, so that a store without it is known to be incomplete
+        with open(os.path.join(self.path, "meta.json"), "w") as f:
+            json.dump({"version": STORE_VERSION,
+                       "num_graphs": len(self._is_none),
+                       "node_ontology": NODE_ONTOLOGY,
+                       "edge_ontology": EDGE_ONTOLOGY}, f)
+
+    def __enter__(self) -> "GraphStoreWriter":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+class GraphStore:
+    """
+    Read-only, memory-mapped view of a store written by ``GraphStoreWriter``. Triples are
+    built straight from the columns, without deserializing networkx graphs.
+    """
+    _open_stores: Dict[str, "GraphStore"] = {}
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        if meta["version"] != STORE_VERSION or meta["node_ontology"] != NODE_ONTOLOGY \
+                or meta["edge_ontology"] != EDGE_ONTOLOGY:
+            raise ValueError(f"{path} was written by an incompatible version of GraphStoreWriter")
+
+        self._node_offsets = np.load(os.path.join(path, "node_offsets.npy"))
+        self._edge_offsets = np.load(os.path.join(path, "edge_offsets.npy"))
+        self._is_none = np.load(os.path.join(path, "is_none.npy"))
+        self._columns = {}
+        for columns, count in [(NODE_COLUMNS, self._node_offsets[-1]), (EDGE_COLUMNS, self._edge_offsets[-1])]:
+            for name, (dtype, width) in columns.items():
+                shape = (int(count),) if width is None else (int(count), width)
+                if count == 0:
+                    self._columns[name] = np.zeros(shape, dtype=dtype)
+                else:
+                    self._columns[name] = np.memmap(os.path.join(path, name + ".bin"),
+                                                    dtype=dtype, mode="r", shape=shape)
+        self._strings = None
+
+    @classmethod
+    def open(cls, path: str) -> "GraphStore":
+        """Open a store once per process, e.g. in each S-metric worker."""
+        store = cls._open_stores.get(path, None)
+        if store is None:
+            store = cls._open_stores[path] = cls(path)
+        return store
+
+    def __len__(self) -> int:
+        return len(self._is_none)
+
+    def __getitem__(self, index: int) -> "StoredGraph":
+        return StoredGraph(self.path, index)
+
+    def _get_strings(self) -> List[str]:
+        if self._strings is None:
+            offsets = np.load(os.path.join(self.path, "string_offsets.npy"))
+            with open(os.path.join(self.path, "strings.bin"), "rb") as f:
+                data = f.read()
+            self._strings = [data[start:end].decode("utf-8") for start, end in zip(offsets[:-1], offsets[1:])]
+        return self._strings
+
+    def get_triples(self,
+                    index: int,
+                    semantics_only: bool = False,
+                    drop_syntax: bool = True,
+                    threshold: float = 0.05,
+                    include_attribute_scores: bool = False):
+        """
+        Same triples, in the same order, as ``DecompGraph.get_triples`` on the stored graph.
+        """
+        instances = []
+        relations = []
+        attributes = []
+        if self._is_none[index]:
+            return instances, relations, attributes
+
+        strings = self._get_strings()
+
+        def get_string(string_id):
+            return None if string_id < 0 else strings[string_id]
+
+        node_start, node_end = self._node_offsets[index], self._node_offsets[index + 1]
+        names = [strings[i] for i in self._columns["node_name"][node_start:node_end].tolist()]
+        texts = [get_string(i) for i in self._columns["node_text"][node_start:node_end].tolist()]
+        types = [get_string(i) for i in self._columns["node_type"][node_start:node_end].tolist()]
+        # NaN (not annotated) compares False
+        with np.errstate(invalid="ignore"):
+            node_annotated = np.abs(self._columns["node_attributes"][node_start:node_end]) > threshold
+
+        for i, node in enumerate(names):
+            if semantics_only:
+                if node == "dummy-semantics-root" or 'semantics' in node:
+                    types[i] = 'semantics'
+                if 'syntax' in node or types[i] != 'semantics':
+                    continue
+
+            text = texts[i]
+            if text == "@@ROOT@@":
+                text = "root"
+            if text is not None:
+                inst = ("instance", node, text)
+            else:
+                # root node
+                assert node == "dummy-semantics-root", f"the following node is broken {node}"
+                inst = ("instance", node, "root")
+
+            if include_attribute_scores \
+             and ('semantics' in node or types[i] == 'semantics') \
+             and node != "dummy-semantics-root" \
+             and text != "root":
+                for k in np.nonzero(node_annotated[i])[0].tolist():
+                    attributes.append((NODE_ONTOLOGY[k], node, float(self._columns["node_attributes"][node_start + i, k])))
+            instances.append(inst)
+
+        edge_start, edge_end = self._edge_offsets[index], self._edge_offsets[index + 1]
+        sources = self._columns["edge_source"][edge_start:edge_end].tolist()
+        targets = self._columns["edge_target"][edge_start:edge_end].tolist()
+        semrels = [get_string(i) for i in self._columns["edge_semrel"][edge_start:edge_end].tolist()]
+        with np.errstate(invalid="ignore"):
+            edge_annotated = np.abs(self._columns["edge_attributes"][edge_start:edge_end]) > threshold
+
+        for j, (source, target, rel) in enumerate(zip(sources, targets, semrels)):
+            # skip self-edges
+            if source == target:
+                continue
+
+            if semantics_only:
+                if 'syntax' in names[source] or types[source] != 'semantics' or \
+                   'syntax' in names[target] or types[target] != 'semantics':
+                    continue
+
+            if rel is None:
+                # semantic edge
+                rel = "arg"
+            elif rel != 'arg' and drop_syntax:
+                rel = "nonhead"
+            relation = (rel, names[target], names[source])
+
+            if include_attribute_scores and rel == "arg":
+                node_name = f"{names[source]}-{names[target]}"
+                annotated = np.nonzero(edge_annotated[j])[0].tolist()
+                for k in annotated:
+                    attributes.append((EDGE_ONTOLOGY[k], node_name, float(self._columns["edge_attributes"][edge_start + j, k])))
+                if len(annotated) > 0:
+                    instances.append(("instance", node_name, "arg"))
+
+            relations.append(relation)
+
+        return instances, relations, attributes
+
+
+class StoredGraph(namedtuple("StoredGraph", ["path", "index"])):
+    """
+    A graph in a ``GraphStore``; small to send to S-metric worker processes, which open
+    the store themselves.
+    """
+    @staticmethod
+    def get_triples(graph: "StoredGraph",
+                    semantics_only: bool = False,
+                    drop_syntax: bool = True,
+                    threshold: float = 0.05,
+                    include_attribute_scores: bool = False):
+        return GraphStore.open(graph.path).get_triples(graph.index, semantics_only, drop_syntax,
+                                                       threshold, include_attribute_scores)
+
+
+class GraphPairStoreWriter:
+    """Write (pred, gold) graph pairs to the "pred" and "gold" stores under ``path``."""
+    def __init__(self, path: str) -> None:
+        self.pred_writer = GraphStoreWriter(os.path.join(path, "pred"))
+        self.gold_writer = GraphStoreWriter(os.path.join(path, "gold"))
+
+    def add(self, pred_graph: Optional[nx.DiGraph], gold_graph: Optional[nx.DiGraph]) -> None:
+        self.pred_writer.add(pred_graph)
+        self.gold_writer.add(gold_graph)
+
+    def close(self) -> None:
+        self.pred_writer.close()
+        self.gold_writer.close()
+
+    def __enter__(self) -> "GraphPairStoreWriter":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+def is_graph_pair_store(path: str) -> bool:
+    return os.path.exists(os.path.join(path, "pred", "meta.json")) and \
+        os.path.exists(os.path.join(path, "gold", "meta.json"))
+
+
+def iter_graph_pairs(path: str) -> Iterator[Tuple[StoredGraph, StoredGraph]]:
+    """Yield the (pred, gold) pairs of a store written by ``GraphPairStoreWriter``."""
+    pred_store = GraphStore.open(os.path.join(path, "pred"))
+    gold_store = GraphStore.open(os.path.join(path, "gold"))
+    assert len(pred_store) == len(gold_store)
+    for index in range(len(pred_store)):
+        yield pred_store[index], gold_store[index]
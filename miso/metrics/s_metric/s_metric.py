@@ -3,20 +3,25 @@
 from __future__ import print_function
 from __future__ import division
 
-from typing import List, Dict 
+from typing import List, Dict, Iterable, Tuple
 import random
 import logging
+import weakref
+import contextlib
+import multiprocessing
 from tqdm import tqdm
-from collections import namedtuple
+from collections import namedtuple, deque
 import pdb 
 
 from miso.metrics.s_metric.candidate_mappings import CandidateMappings
 from miso.metrics.s_metric.weight_dict import WeightDict
+from miso.metrics.s_metric.weight_table import WeightTable
 from miso.metrics.s_metric.bleu import BLEU
 from miso.metrics.s_metric import utils
 from miso.metrics.s_metric import constants
 from miso.metrics.s_metric.repr import Triple, FloatTriple
-from miso.data.dataset_readers.decomp_parsing.decomp import DecompGraph
+from miso.metrics.s_metric.graph_store import StoredGraph
+from miso.data.dataset_readers.decomp_parsing.decomp import DecompGraph, DecompPrediction
 from miso.data.dataset_readers.decomp_parsing.decomp_with_syntax import DecompGraphWithSyntax
 
 logger = logging.getLogger(__name__) 
@@ -41,26 +46,52 @@ class S(object):
     """
     Encapsulates all SPR scoring routines 
     """
+    # hill-climb on array-backed weights whenever they are integral (see WeightTable) 
+    use_weight_table = True
+
     def __init__(self, instance1, attribute1, relation1,
                  instance2, attribute2, relation2,
                  iter_num=4,
                  compute_instance=True,
                  compute_attribute=True,
                  compute_relation=True,
-                 mode=NORMAL):
+                 mode=NORMAL,
+                 indices1=None,
+                 indices2=None):
+        """
+        :param indices1, indices2: the ``triple_indices`` of each representation, if 
+            precomputed, e.g. for gold triples that are scored repeatedly 
+        """
         self.match_triple_dict = {}
         self.log = utils.get_logging()
         self.compute_instance = compute_instance
         self.compute_attribute = compute_attribute
         self.compute_relation = compute_relation
         self.mode = mode
-        self.x_node2id = {x.gov: i for i, x in enumerate(instance1)}
-        self.y_node2id = {y.gov: i for i, y in enumerate(instance2)}
+        if indices1 is None:
+            indices1 = self.triple_indices(instance1, attribute1, relation1)
+        if indices2 is None:
+            indices2 = self.triple_indices(instance2, attribute2, relation2)
+        self.x_node2id = indices1[0]
+        self.y_node2id = indices2[0]
         self.candidate_mappings, self.weight_dict = self.compute_pool(
             instance1, attribute1, relation1,
             instance2, attribute2, relation2,
+            indices1, indices2
         )
 
+    @staticmethod
+    def triple_indices(instances, attributes, relations):
+        """
+        :return: (node2id, attribute_ids, relation_ids): the position of each node in 
+            ``instances``, the node position of each attribute and the (gov, dep) node 
+            positions of each relation; None for nodes without an instance triple 
+        """
+        node2id = {x.gov: i for i, x in enumerate(instances)}
+        attribute_ids = [node2id.get(x.node) for x in attributes]
+        relation_ids = [(node2id.get(x.gov), node2id.get(x.dep)) for x in relations]
+        return node2id, attribute_ids, relation_ids
+
     def instance_match_score(self, x, y):
         norm_x, norm_y = x.dep.lower(), y.dep.lower()
         return int(x.dep == y.dep)
@@ -75,7 +106,8 @@ class S(object):
         return int(x.rel == y.rel)
 
     def compute_pool(self, instance1, attribute1, relation1,
-                     instance2, attribute2, relation2):
+                     instance2, attribute2, relation2,
+                     indices1, indices2):
         """Compute all possible node mapping candidates and their weights
         (the triple matching number gain resulting from mapping one node in
         representation1 to another node in representation2).
@@ -85,6 +117,8 @@ class S(object):
         :param instance2: instance triples of representation2
         :param attribute2: attribute triples of representation2
         :param relation2: relation triples of representation2
+        :param indices1: ``triple_indices`` of representation1
+        :param indices2: ``triple_indices`` of representation2
 
         :return candidate_mappings: a dictionary whose key is the node in
                 representation1, and the corresponding value is a set of
@@ -95,6 +129,8 @@ class S(object):
         """
         candidate_mappings = CandidateMappings()
         weight_dict = WeightDict()
+        __, attribute_ids1, relation_ids1 = indices1
+        __, attribute_ids2, relation_ids2 = indices2
         for x_id, x in enumerate(instance1):
             x_mappings = set()
             candidate_mappings.append(x_mappings)
@@ -110,21 +146,21 @@ class S(object):
                     weight_dict.add_instance_pair(x_id, y_id, score)
 
         if self.compute_attribute:
-            for x in attribute1:
-                for y in attribute2:
+            for x, x_id in zip(attribute1, attribute_ids1):
+                for y, y_id in zip(attribute2, attribute_ids2):
                     try:
                         score = x.similarity(y)
                     except NotImplementedError:
                         score = self.attribute_match_score(x, y)
                     if score == 0:
                         continue
-                    x_id = self.x_node2id[x.node]
-                    y_id = self.y_node2id[y.node]
+                    if x_id is None or y_id is None:
+                        raise KeyError(f"attribute of a node without instance: {x if x_id is None else y}")
                     weight_dict.add_attribute_pair(x_id, y_id, score)
 
         if self.compute_relation:
-            for x in relation1:
-                for y in relation2:
+            for x, (x1_id, x2_id) in zip(relation1, relation_ids1):
+                for y, (y1_id, y2_id) in zip(relation2, relation_ids2):
                     try:
                         score = x.similarity(y)
                     except NotImplementedError:
@@ -132,10 +168,8 @@ class S(object):
                     if score == 0:
                         continue
 
-                    x1_id = self.x_node2id[x.gov]
-                    x2_id = self.x_node2id[x.dep]
-                    y1_id = self.y_node2id[y.gov]
-                    y2_id = self.y_node2id[y.dep]
+                    if None in (x1_id, x2_id, y1_id, y2_id):
+                        raise KeyError(f"relation of a node without instance: {x}, {y}")
 
                     candidate_mappings[x1_id].add(y1_id)
                     candidate_mappings[x2_id].add(y2_id)
@@ -149,6 +183,11 @@ class S(object):
 
         if self.mode == TEST1:
             candidate_mappings.sort()
+
+        self.weight_table = None
+        if self.use_weight_table:
+            self.weight_table = WeightTable.build(candidate_mappings, weight_dict,
+                                                  len(instance1), len(instance2), len(self.y_node2id))
         #self.log.info("Candidate mappings:\n" + str(candidate_mappings))
         #self.log.info("Weight dictionary:\n" + str(weight_dict))
         #self.log.info("")
@@ -453,6 +492,8 @@ class S(object):
         return largest_gain, cur_mapping
 
     def hill_climb(self, cur_mapping, match_num):
+        if self.weight_table is not None:
+            return self.weight_table.hill_climb(cur_mapping, match_num)
         #self.log.info("Start hill climbing.")
         while True:
             gain, new_mapping = self.get_best_gain(cur_mapping, match_num)
@@ -480,7 +521,8 @@ class S(object):
 
     @classmethod
     def get_best_match(cls, instance1, attribute1, relation1,
-                       instance2, attribute2, relation2, opts):
+                       instance2, attribute2, relation2, opts,
+                       indices1=None, indices2=None):
         """Get the highest triple match number between two sets of triples via
         hill-climbing.
         :param instance1: instance triples of representation1
@@ -496,6 +538,7 @@ class S(object):
         :param relation2: relation triples of representation2
                 (relation name, node 1 name, node 2 name)
         :param opts: Options.
+        :param indices1, indices2: precomputed ``triple_indices`` of each representation
 
         :return best_match: the node mapping that results in the highest triple matching number
         :return best_match_num: the highest triple matching number
@@ -508,7 +551,9 @@ class S(object):
             compute_instance=opts.compute_instance,
             compute_attribute=opts.compute_attribute,
             compute_relation=opts.compute_relation,
-            mode=opts.mode
+            mode=opts.mode,
+            indices1=indices1,
+            indices2=indices2
         )
 
         best_match_num = 0
@@ -560,75 +605,171 @@ def normalize(item):
     item = item.lower()
     return item
 
+def _to_triples(GraphType, graph, semantics_only, drop_syntax, include_attribute_scores):
+    instances, relations, attributes = GraphType.get_triples(graph,
+                                                             semantics_only,
+                                                             drop_syntax,
+                                                             include_attribute_scores = include_attribute_scores)
+
+    instances = [Triple(x[1], x[0], x[2]) for x in instances]
+    attributes = [FloatTriple(x[0], x[1], x[2]) for x in attributes]
+    relations = [Triple(x[1], x[0], x[2]) for x in relations]
+    return instances, attributes, relations
+
+class ScoringTriples(namedtuple("ScoringTriples", ["instances", "attributes", "relations", "indices"])):
+    """the triples of a graph as scored by ``S.get_best_match``, with their ``S.triple_indices``"""
+
+def _graph_type(graph):
+    if isinstance(graph, dict):
+        # predictions are scored from the predictor output, without building a graph 
+        return DecompPrediction
+    if isinstance(graph, StoredGraph):
+        return StoredGraph
+    if isinstance(graph, DecompGraph):
+        return DecompGraph
+    return DecompGraphWithSyntax
+
+def to_scoring_triples(graph, semantics_only, drop_syntax, include_attribute_scores) -> ScoringTriples:
+    if isinstance(graph, ScoringTriples):
+        return graph
+    instances, attributes, relations = _to_triples(_graph_type(graph), graph, semantics_only, 
+                                                   drop_syntax, include_attribute_scores)
+    return ScoringTriples(instances, attributes, relations, 
+                          S.triple_indices(instances, attributes, relations))
+
+class GoldTripleCache(object):
+    """
+    ``ScoringTriples`` of gold graphs, computed once per graph and scoring configuration, 
+    so that repeated evaluation on the same split only converts the predictions. Graphs are 
+    identified by object, which holds for the validation instances of a trainer; entries 
+    are dropped with their graph, so re-read (lazy) splits don't pile up. 
+    """
+    def __init__(self):
+        self._triples = weakref.WeakKeyDictionary()
+
+    def get(self, graphs: List, semantics_only: bool, drop_syntax: bool, 
+            include_attribute_scores: bool = False) -> List[ScoringTriples]:
+        settings = (semantics_only, drop_syntax, include_attribute_scores)
+        triples = []
+        for graph in graphs:
+            try:
+                graph_triples = self._triples.setdefault(graph, {})
+            except TypeError:
+                # e.g. None, which can't be cached 
+                triples.append(to_scoring_triples(graph, *settings))
+                continue
+            if settings not in graph_triples:
+                graph_triples[settings] = to_scoring_triples(graph, *settings)
+            triples.append(graph_triples[settings])
+        return triples
+
+def _score_pair(args):
+    """
+    score a single (pred, gold) pair; module-level so that it can be sent to worker processes 
+    :return: (best_match_num, test_triple_num, gold_triple_num)
+    """
+    g1, g2, semantics_only, drop_syntax, include_attribute_scores = args
+
+    triples1 = to_scoring_triples(g1, semantics_only, drop_syntax, include_attribute_scores)
+    triples2 = to_scoring_triples(g2, semantics_only, drop_syntax, include_attribute_scores)
+
+    # get_best_match resets the seed for every pair, so the result of a pair does not 
+    # depend on which process scores it or in what order 
+    best_mapping, best_match_num, test_triple_num, gold_triple_num = S.get_best_match(
+            triples1.instances, triples1.attributes, triples1.relations,
+            triples2.instances, triples2.attributes, triples2.relations, c_args,
+            indices1 = triples1.indices, indices2 = triples2.indices)
+
+    return best_match_num, test_triple_num, gold_triple_num
+
+def _imap_bounded(pool, func, iterable, max_pending):
+    """
+    like ``pool.imap``, but pulls from ``iterable`` in the calling thread and keeps at most 
+    ``max_pending`` items in flight, so a lazily produced input is never buffered whole 
+    """
+    pending = deque()
+    for args in iterable:
+        pending.append(pool.apply_async(func, (args,)))
+        if len(pending) >= max_pending:
+            yield pending.popleft().get()
+    while len(pending) > 0:
+        yield pending.popleft().get()
+
+def scoring_pool(num_workers: int):
+    """
+    a pool of ``num_workers`` processes for ``compute_s_metric``; the workers are spawned, 
+    not forked, since forking a process that runs threads or has initialized CUDA, like 
+    a trainer that scores in the background, can leave the children deadlocked or broken 
+    """
+    return multiprocessing.get_context("spawn").Pool(num_workers)
+
 def compute_s_metric(true_graphs: List[DecompGraph],
                      pred_graphs: List[DecompGraph],
                      input_sents: List[str], 
                      semantics_only: bool,
                      drop_syntax: bool, 
-                     include_attribute_scores: bool = False):
+                     include_attribute_scores: bool = False,
+                     num_workers: int = 0,
+                     pool = None):
     """
-    compute s-score between lists of decomp graphs
+    compute s-score between lists of decomp graphs; predicted graphs can also be 
+    decomp predictor outputs, which are scored with ``DecompPrediction``, and either 
+    side can be precomputed ``ScoringTriples``, e.g. from a ``GoldTripleCache`` 
+
+    :param num_workers: if > 0, score the graph pairs in a pool of this many processes.
+        Pairs are summed in input order, so the result is identical to the serial path.
+    :param pool: a ``multiprocessing`` pool to score in instead of starting one, e.g. one 
+        that is reused across calls; see ``scoring_pool``.
     """
     
     assert(len(true_graphs) == len(pred_graphs))
 
-    # select DecompGraph or DecompGraphWithSyntax
-    GraphType = None 
-    if len(true_graphs) > 0:
-        tg = true_graphs[0]
-        print(tg)
-        if isinstance(tg, DecompGraph):
-            GraphType = DecompGraph
-        else:
-            GraphType = DecompGraphWithSyntax
-
-    else:
-        return None
-
-    total_match_num, total_test_num, total_gold_num = 0, 0, 0
-
-    for g1, g2, sent  in tqdm(zip(pred_graphs, true_graphs, input_sents), total = len(true_graphs)):
-
-        instances1, relations1, attributes1 = GraphType.get_triples(g1, 
-                                                                    semantics_only, 
-                                                                    drop_syntax, 
-                                                                    include_attribute_scores = include_attribute_scores)
-
-        instances1 = [Triple(x[1], x[0], x[2]) for x in instances1]
-        attributes1 = [FloatTriple(x[0], x[1], x[2]) for x in attributes1]
-        relations1 = [Triple(x[1], x[0], x[2]) for x in relations1]
-
-        instances2, relations2, attributes2 = GraphType.get_triples(g2, 
-                                                                    semantics_only, 
-                                                                    drop_syntax, 
-                                                                    include_attribute_scores = include_attribute_scores)
-
-
-        instances2 = [Triple(x[1], x[0], x[2]) for x in instances2]
-        attributes2 = [FloatTriple(x[0], x[1], x[2]) for x in attributes2]
-        relations2 = [Triple(x[1], x[0], x[2]) for x in relations2]
-
-        best_mapping, best_match_num, test_triple_num, gold_triple_num = S.get_best_match(
-                instances1, attributes1, relations1,
-                instances2, attributes2, relations2, c_args)
+    return compute_s_metric_from_pairs(zip(pred_graphs, true_graphs),
+                                       semantics_only,
+                                       drop_syntax,
+                                       include_attribute_scores,
+                                       num_workers,
+                                       total = len(true_graphs),
+                                       pool = pool)
+
+def compute_s_metric_from_pairs(graph_pairs: Iterable[Tuple[DecompGraph, DecompGraph]],
+                                semantics_only: bool,
+                                drop_syntax: bool, 
+                                include_attribute_scores: bool = False,
+                                num_workers: int = 0,
+                                total: int = None,
+                                pool = None):
+    """
+    compute s-score over a stream of (pred, true) graph pairs, keeping only the match 
+    counts in memory; returns None if there are no pairs 
 
-        #print('instances')
-        #print([str(x) for x in instances1])
-        #print([str(x) for x in instances2])
+    pairs of ``StoredGraph`` are read from their ``GraphStore`` in the process that scores them 
+    """
+    def get_pair_args():
+        for g1, g2 in graph_pairs:
+            yield (g1, g2, semantics_only, drop_syntax, include_attribute_scores)
+
+    num_pairs, total_match_num, total_test_num, total_gold_num = 0, 0, 0, 0
+
+    with contextlib.ExitStack() as stack:
+        if pool is None and num_workers > 0:
+            pool = stack.enter_context(scoring_pool(num_workers))
+        if pool is not None:
+            scores = _imap_bounded(pool, _score_pair, get_pair_args(), 
+                                   max_pending = 16 * max(num_workers, 1))
+        else:
+            scores = (_score_pair(args) for args in get_pair_args())
 
-        #print('relations')
-        #print([str(x) for x in relations1])
-        #print([str(x) for x in relations2])
+        # accumulate in input order so that float match counts sum the same way in both modes 
+        for best_match_num, test_triple_num, gold_triple_num in tqdm(scores, total = total):
+            num_pairs += 1
+            total_match_num += best_match_num
+            total_test_num += test_triple_num
+            total_gold_num += gold_triple_num
 
-        #print(best_mapping)
-        #print(f"match {best_match_num}")
-        #print(f"test {test_triple_num}")
-        #print(f"gold {gold_triple_num}")
-        total_match_num += best_match_num
-        total_test_num += test_triple_num
-        total_gold_num += gold_triple_num
+    if num_pairs == 0:
+        return None
 
-    #print(f"total match {total_match_num} total_test {total_test_num} total gold {total_gold_num}") 
     precision, recall, best_f_score = utils.compute_f(
         total_match_num, total_test_num, total_gold_num)
     return precision, recall, best_f_score
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import numpy as np
+
+
+class WeightTable(object):
+    """
+    Array-backed copy of ``CandidateMappings`` and ``WeightDict`` for hill-climbing.
+
+    Every move/swap gain is the exact difference between the triple match numbers of two
+    mappings, so with integer weights all gains of an iteration can be computed in a few
+    array ops and still pick the same step as ``S.get_best_gain``:
+        move (x: y -> y'):   A[x, y'] - A[x, y]
+        swap (x1 <-> x2):    A[x1, y2] + A[x2, y1] - A[x1, y1] - A[x2, y2] + D[x1, x2]
+    where A[x, y] is the node pair weight of (x, y) plus the weight of its relation pairs
+    whose other node pair is in the current mapping, and D corrects for the relation pairs
+    between the two swapped node pairs. A is updated incrementally after each step.
+    """
+
+    def __init__(self, node_weights, candidates, edges, num_y_ids):
+        # [num_x, num_y] instance + attribute + circle pair weights
+        self.node_weights = node_weights
+        # [num_x, num_y] bool, the candidate mappings of each x node
+        self.candidates = candidates
+        self.num_x, self.num_y = node_weights.shape
+        # y nodes that get_best_gain considers when moving, i.e. range(len(y_node2id))
+        self.movable_y = np.arange(self.num_y) < num_y_ids
+
+        # relation pairs ((x1, y1), (x2, y2), weight) with x1 < x2, each stored once
+        self.edge_x1, self.edge_y1, self.edge_x2, self.edge_y2, self.edge_weights = edges
+
+        # both directions of every relation pair, sorted by the (x, y) pair they point to,
+        # to update the relation support of the neighbours of a node pair
+        src_x = np.concatenate([self.edge_x1, self.edge_x2])
+        src_y = np.concatenate([self.edge_y1, self.edge_y2])
+        dst_x = np.concatenate([self.edge_x2, self.edge_x1])
+        dst_y = np.concatenate([self.edge_y2, self.edge_y1])
+        weights = np.concatenate([self.edge_weights, self.edge_weights])
+        dst = dst_x * self.num_y + dst_y
+        order = np.argsort(dst, kind="stable")
+        self._src_x, self._src_y, self._src_weights = src_x[order], src_y[order], weights[order]
+        self._dst_offsets = np.searchsorted(dst[order], np.arange(self.num_x * self.num_y + 1))
+
+    @classmethod
+    def build(cls, candidate_mappings, weight_dict, num_x, num_y, num_y_ids):
+        """
+        :return: a WeightTable, or None if the weights cannot be handled exactly with
+            integer arithmetic (e.g. float attribute similarities), in which case
+            the dict-based hill-climbing is used.
+        """
+        pair_weights = [weight_dict.instance_pair_weight,
+                        weight_dict.attribute_pair_weight,
+                        weight_dict.circle_pair_weight]
+        for weights in pair_weights:
+            if any(type(w) is not int for w in weights.values()):
+                return None
+
+        node_weights = np.zeros((num_x, num_y), dtype=np.int64)
+        for weights in pair_weights:
+            for (x, y), w in weights.items():
+                node_weights[x, y] += w
+
+        candidates = np.zeros((num_x, num_y), dtype=bool)
+        for x, x_mappings in candidate_mappings.items():
+            candidates[x, list(x_mappings)] = True
+
+        edges = []
+        for (x1, y1), node_pair_dict in weight_dict.relation_pair_weight.items():
+            for (x2, y2), w in node_pair_dict.items():
+                if type(w) is not int or x1 == x2:
+                    # relations within one node are scored differently by move/swap gains
+                    return None
+                if x1 < x2:
+                    edges.append((x1, y1, x2, y2, w))
+        edges = np.array(edges, dtype=np.int64).reshape(-1, 5)
+        return cls(node_weights, candidates, tuple(edges.T), num_y_ids)
+
+    def relation_support(self, mapping):
+        """
+        :param mapping: [num_x] y node of each x node, -1 if unmapped.
+        :return: [num_x, num_y] weight of the relation pairs of each (x, y) whose other
+            node pair is in the mapping.
+        """
+        support = np.zeros((self.num_x, self.num_y), dtype=np.int64)
+        for src_x, src_y, dst_x, dst_y in [(self.edge_x1, self.edge_y1, self.edge_x2, self.edge_y2),
+                                           (self.edge_x2, self.edge_y2, self.edge_x1, self.edge_y1)]:
+            mapped = mapping[dst_x] == dst_y
+            np.add.at(support, (src_x[mapped], src_y[mapped]), self.edge_weights[mapped])
+        return support
+
+    def update_relation_support(self, support, x, old_y, new_y):
+        """Update ``support`` in place after x is remapped from old_y to new_y."""
+        for y, sign in [(old_y, -1), (new_y, 1)]:
+            if y < 0:
+                continue
+            start, end = self._dst_offsets[x * self.num_y + y], self._dst_offsets[x * self.num_y + y + 1]
+            np.add.at(support, (self._src_x[start:end], self._src_y[start:end]),
+                      sign * self._src_weights[start:end])
+
+    def swap_correction(self, mapping):
+        """
+        :return: [num_x, num_x] weight of the relation pairs between the two node pairs of
+            each swap that A[x1, y2] + A[x2, y1] - A[x1, y1] - A[x2, y2] gets wrong.
+        """
+        y1, y2 = mapping[self.edge_x1], mapping[self.edge_x2]
+        correction = ((self.edge_y1 == y2) & (self.edge_y2 == y1)).astype(np.int64) \
+            + ((self.edge_y1 == y1) & (self.edge_y2 == y2)) \
+            - ((self.edge_y1 == y2) & (self.edge_y2 == y2)) \
+            - ((self.edge_y1 == y1) & (self.edge_y2 == y1))
+        swap_correction = np.zeros((self.num_x, self.num_x), dtype=np.int64)
+        np.add.at(swap_correction, (self.edge_x1, self.edge_x2), correction * self.edge_weights)
+        return swap_correction
+
+    def get_best_gain(self, mapping, support):
+        """
+        Same search order and tie-breaking as ``S.get_best_gain``: the first largest move
+        gain in (x, y) order, unless a swap in (x1, x2) order has a strictly larger gain.
+        :return: (largest_gain, x_node1, node2, use_swap); node2 is a y node for moves
+            and an x node for swaps.
+        """
+        # column num_y stands for unmapped (-1) and has zero weight
+        padded = np.zeros((self.num_x, self.num_y + 1), dtype=np.int64)
+        padded[:, :self.num_y] = self.node_weights + support
+        columns = np.where(mapping < 0, self.num_y, mapping)
+        current = padded[np.arange(self.num_x), columns]
+
+        largest_gain, node1, node2, use_swap = 0, None, None, True
+
+        unmatched = np.ones(self.num_y + 1, dtype=bool)
+        unmatched[columns] = False
+        movable = self.candidates & (unmatched[:self.num_y] & self.movable_y)
+        if movable.any():
+            move_gains = np.where(movable, padded[:, :self.num_y] - current[:, None],
+                                  np.iinfo(np.int64).min)
+            best = np.argmax(move_gains)
+            if move_gains.flat[best] > largest_gain:
+                largest_gain = int(move_gains.flat[best])
+                node1, node2 = divmod(int(best), self.num_y)
+                use_swap = False
+
+        if self.num_x > 1:
+            # swapped[x1, x2] = A[x1, y2]
+            swapped = padded[:, columns]
+            swap_gains = swapped + swapped.T - current[:, None] - current[None, :] \
+                + self.swap_correction(mapping)
+            swap_gains[np.tril_indices(self.num_x)] = np.iinfo(np.int64).min
+            best = np.argmax(swap_gains)
+            if swap_gains.flat[best] > largest_gain:
+                largest_gain = int(swap_gains.flat[best])
+                node1, node2 = divmod(int(best), self.num_x)
+                use_swap = True
+
+        return largest_gain, node1, node2, use_swap
+
+    def hill_climb(self, cur_mapping, match_num):
+        mapping = np.array(cur_mapping, dtype=np.int64).reshape(-1)
+        support = self.relation_support(mapping)
+        while True:
+            gain, node1, node2, use_swap = self.get_best_gain(mapping, support)
+
+            if gain <= 0:
+                break
+
+            match_num += gain
+            if use_swap:
+                y1, y2 = mapping[node1], mapping[node2]
+                mapping[node1], mapping[node2] = y2, y1
+                self.update_relation_support(support, node1, y1, y2)
+                self.update_relation_support(support, node2, y2, y1)
+            else:
+                self.update_relation_support(support, node1, mapping[node1], node2)
+                mapping[node1] = node2
+        return mapping.tolist(), match_num
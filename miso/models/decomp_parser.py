@@ -26,6 +26,7 @@ from miso.modules.decoders.attribute_decoder import NodeAttributeDecoder
 from miso.modules.decoders.edge_decoder import EdgeAttributeDecoder 
 from miso.metrics.decomp_metrics import DecompAttrMetrics
 from miso.nn.beam_search import BeamSearch
+from miso.nn.step_input_tables import StepInputTables, index_tokens, supports_token_indexers
 from miso.data.dataset_readers.decomp_parsing.ontology import NODE_ONTOLOGY, EDGE_ONTOLOGY
 from miso.metrics.pearson_r import pearson_r
 # The following imports are added for mimick testing.
@@ -117,9 +118,20 @@ class DecompParser(Transduction):
         )
         self._tree_parser.reset_edge_type_bilinear(num_labels=vocab.get_vocab_size(edge_type_namespace))
         self._label_smoothing.reset_parameters(pad_index=self._vocab_pad_index)
-        self._beam_search = BeamSearch(self._vocab_eos_index, self._max_decoding_steps, self._beam_size)
+        # Finished sentences are dropped from the decoding group; the step inputs find the
+        # instance of each hypothesis through the "batch_indices" state.
+        self._beam_search = BeamSearch(self._vocab_eos_index, self._max_decoding_steps, self._beam_size,
+                                       compact_finished=True)
 
         self.oracle = False 
+        # Build next-step decoder inputs with lookup tables instead of AllenNLP instances.
+        self.vectorized_step_inputs = True
+        self._step_input_vocab_token_ids = None
+        # Keep the decoded target states in a [group_size, max_steps, dim] buffer with masked
+        # target attention, instead of concatenating them and padding the attention.
+        self.preallocated_target_memory = True
+        # Don't reindex the source-side decoding state along the beam backpointers.
+        self.share_beam_invariant_state = True
 
     @overrides
     def get_metrics(self, reset: bool = False) -> Dict[str, float]:
@@ -156,15 +168,7 @@ class DecompParser(Transduction):
                                        misc: Dict,
                                        ) -> Tuple[torch.Tensor, Dict[str, torch.Tensor], Dict[str, List[Any]]]:
         
-        inputs = self._prepare_next_inputs(
-            predictions=last_predictions,
-            target_attention_map=state["target_attention_map"],
-            target_dynamic_vocabs=auxiliaries["target_dynamic_vocabs"],
-            meta_data=misc["instance_meta"],
-            batch_size=misc["batch_size"],
-            last_decoding_step=misc["last_decoding_step"],
-            source_dynamic_vocab_size=misc["source_dynamic_vocab_size"]
-        )
+        inputs = self._prepare_step_inputs(last_predictions, state, auxiliaries, misc)
 
         decoder_inputs = torch.cat([
             self._decoder_token_embedder(inputs["tokens"]),
@@ -177,12 +181,13 @@ class DecompParser(Transduction):
             state["hidden_state_2"].permute(1, 0, 2),
         )
 
+        decoding_step = misc["last_decoding_step"] + 1
         decoding_outputs = self._decoder.one_step_forward(
             input_tensor=decoder_inputs,
             source_memory_bank=state["source_memory_bank"],
             source_mask=state["source_mask"],
             target_memory_bank=state.get("target_memory_bank", None),
-            decoding_step=misc["last_decoding_step"] + 1,
+            decoding_step=decoding_step,
             total_decoding_steps=self._max_decoding_steps,
             input_feed=state.get("input_feed", None),
             hidden_state=hidden_states,
@@ -197,26 +202,50 @@ class DecompParser(Transduction):
         state["rnn_output"] = decoding_outputs["rnn_output"].squeeze(1)
         if decoding_outputs["coverage"] is not None:
             state["coverage"] = decoding_outputs["coverage"]
-        if state.get("target_memory_bank", None) is None:
+        if self.preallocated_target_memory:
+            if state.get("target_memory_bank", None) is None:
+                # [group_size, max_steps, vector_dim]; filled up to the current decoding step,
+                # so beam search reorders it in place of growing it.
+                state["target_memory_bank"] = decoding_outputs["attentional_tensor"].new_zeros(
+                    (decoder_inputs.size(0), self._max_decoding_steps,
+                     decoding_outputs["attentional_tensor"].size(2)))
+            state["target_memory_bank"][:, decoding_step] = decoding_outputs["attentional_tensor"].squeeze(1)
+        elif state.get("target_memory_bank", None) is None:
             state["target_memory_bank"] = decoding_outputs["attentional_tensor"]
         else:
             state["target_memory_bank"] = torch.cat(
                 [state["target_memory_bank"], decoding_outputs["attentional_tensor"]], 1
             )
 
+        log_probs = self._predict_node_log_probs(last_predictions, decoding_outputs, state, misc)
+
+        misc["last_decoding_step"] += 1
+
+
+        return log_probs, state, auxiliaries
+
+    def _predict_node_log_probs(self,
+                                last_predictions: torch.Tensor,
+                                decoding_outputs: Dict[str, torch.Tensor],
+                                state: Dict[str, torch.Tensor],
+                                misc: Dict) -> torch.Tensor:
+        """
+        Run the pointer generator on the decoder outputs of one step.
+        :param last_predictions: [group_size].
+        :return: [group_size, num_classes].
+        """
         node_prediction_outputs = self._extended_pointer_generator(
             inputs=decoding_outputs["attentional_tensor"],
             source_attention_weights=decoding_outputs["source_attention_weights"],
             target_attention_weights=decoding_outputs["target_attention_weights"],
+            # [batch_size or group_size, source_length]; the generator broadcasts it to the group
             source_attention_map=state["source_attention_map"],
-            target_attention_map=state["target_attention_map"]
+            target_attention_map=state["target_attention_map"],
+            source_dynamic_vocab_size=misc["source_dynamic_vocab_size"],
+            target_dynamic_vocab_size=self._max_decoding_steps + 1,
+            eps=self._eps
         )
-        log_probs = (node_prediction_outputs["hybrid_prob_dist"] + self._eps).squeeze(1).log()
-
-        misc["last_decoding_step"] += 1
-
-
-        return log_probs, state, auxiliaries
+        return node_prediction_outputs["hybrid_log_prob_dist"].squeeze(1)
 
     def _read_edge_predictions(self,
                                edge_predictions: Dict[str, torch.Tensor],
@@ -238,58 +267,74 @@ class DecompParser(Transduction):
 
     def _read_node_predictions(self,
                                predictions: torch.Tensor,
-                               meta_data: List[Dict],
-                               target_dynamic_vocabs: List[Dict],
                                source_dynamic_vocab_size: int
-                               ) -> Tuple[List[List[str]], List[List[int]], torch.Tensor, torch.Tensor]:
+                               ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
         """
+        Compute the node indices and masks of the decoded nodes with tensor ops; the node
+        tokens are only looked up for the outputs, see `_read_node_tokens`.
         :param predictions: [batch_size, max_steps].
         :return:
-            node_predictions: [batch_size, max_steps].
             node_index_predictions: [batch_size, max_steps].
             edge_head_mask: [batch_size, max_steps, max_steps].
             valid_node_mask: [batch_size, max_steps].
         """
         batch_size, max_steps = predictions.size()
+        # Nodes up to the first <EOS> are valid.
+        valid_node_mask = (predictions == self._vocab_eos_index).long().cumsum(1).eq(0).long()
+
+        # Generation and source-side copy create node j at step j. Target-side copy points to
+        # a previous node; valid target dynamic vocab indices start from 1 (0 is reserved for
+        # the sentinel), so minus 1 to get the node index.
+        target_copy_offset = self._vocab_size + source_dynamic_vocab_size
+        is_target_copy = (predictions >= target_copy_offset) & valid_node_mask.bool()
+        steps = torch.arange(max_steps, device=predictions.device).unsqueeze(0).expand_as(predictions)
+        node_index_predictions = torch.where(is_target_copy, predictions - target_copy_offset - 1, steps)
+
+        # A target-side copy can't take a previous node with the same index as its head.
+        edge_head_mask = torch.tril(predictions.new_ones((batch_size, max_steps, max_steps)), diagonal=-1)
+        same_node = node_index_predictions.unsqueeze(2) == node_index_predictions.unsqueeze(1)
+        edge_head_mask = edge_head_mask.masked_fill(same_node & is_target_copy.unsqueeze(2), 0)
+
+        return node_index_predictions, edge_head_mask, valid_node_mask
+
+    def _read_node_tokens(self,
+                          predictions: torch.Tensor,
+                          node_index_predictions: torch.Tensor,
+                          valid_node_mask: torch.Tensor,
+                          meta_data: List[Dict],
+                          source_dynamic_vocab_size: int) -> Tuple[List[List[str]], List[List[int]]]:
+        """
+        Look up the token of each valid node prediction.
+        :param predictions: [batch_size, max_steps].
+        :param node_index_predictions: [batch_size, max_steps].
+        :param valid_node_mask: [batch_size, max_steps].
+        :return:
+            node_predictions: a batch_size list of node tokens.
+            node_index_predictions: a batch_size list of node indices.
+        """
+        num_nodes = valid_node_mask.sum(1).tolist()
         node_predictions = []
-        node_index_predictions = []
-        edge_head_mask = predictions.new_ones((batch_size, max_steps, max_steps))
-        edge_head_mask = torch.tril(edge_head_mask, diagonal=-1).long()
-        valid_node_mask = predictions.new_zeros((batch_size, max_steps))
-
-        for i in range(batch_size):
+        node_index_lists = []
+        for i, (prediction_list, node_indices) in enumerate(zip(predictions.tolist(),
+                                                                node_index_predictions.tolist())):
+            source_dynamic_vocab = meta_data[i]["source_dynamic_vocab"]
+            node_indices = node_indices[:num_nodes[i]]
+            # The token of each node index, as the target dynamic vocab had it while decoding.
+            node_tokens = {}
             nodes = []
-            node_indices = []
-            instance_meta = meta_data[i]
-            source_dynamic_vocab = instance_meta["source_dynamic_vocab"]
-            target_dynamic_vocab = target_dynamic_vocabs[i]
-            prediction_list = predictions[i].tolist()
-            for j, index in enumerate(prediction_list):
-                if index == self._vocab_eos_index:
-                    break
-                valid_node_mask[i, j] = 1
+            for index, node_index in zip(prediction_list, node_indices):
                 if index < self._vocab_size:
                     node = self.vocab.get_token_from_index(index, self._target_output_namespace)
-                    node_index = j
-                elif self._vocab_size <= index < self._vocab_size + source_dynamic_vocab_size:
+                elif index < self._vocab_size + source_dynamic_vocab_size:
                     node = source_dynamic_vocab.get_token_from_idx(index - self._vocab_size)
-                    node_index = j
                 else:
-                    node = target_dynamic_vocab[index - self._vocab_size - source_dynamic_vocab_size]
-                    target_dynamic_vocab_index = index - self._vocab_size - source_dynamic_vocab_size
-                    # Valid target_dynamic_vocab_index starts from 1; 0 is reserved for sentinel.
-                    # Minus 1 to ensure node indices created here are consistent with node indices
-                    # created by pre-defined vocab and source-side copy.
-                    node_index = target_dynamic_vocab_index - 1
-                    for k, prev_node_index in enumerate(node_indices):
-                        if node_index == prev_node_index:
-                            edge_head_mask[i, j, k] = 0
+                    node = node_tokens[node_index]
+                node_tokens[node_index] = node
                 nodes.append(node)
-                node_indices.append(node_index)
             node_predictions.append(nodes)
-            node_index_predictions.append(node_indices)
+            node_index_lists.append(node_indices)
 
-        return node_predictions, node_index_predictions, edge_head_mask, valid_node_mask
+        return node_predictions, node_index_lists
     
 
     @overrides
@@ -315,13 +360,14 @@ class DecompParser(Transduction):
         inputs["target_copy_indices"] = raw_inputs["target_copy_indices"][:, 1:]
 
 
-        # [batch, target_seq_length, target_seq_length + 1(sentinel)]
+        # [batch, target_seq_length], indices into target_seq_length + 1(sentinel) slots
         inputs["target_attention_map"] = raw_inputs["target_attention_map"][:, 1:]  # exclude UNK
-        # [batch, 1(unk) + source_seq_length, dynamic_vocab_size]
+        # [batch, source_seq_length], indices into the dynamic vocab.
         # Exclude unk and the last pad.
         inputs["source_attention_map"] = raw_inputs["source_attention_map"][:, 1:-1]
 
-        inputs["source_dynamic_vocab_size"] = inputs["source_attention_map"].size(2)
+        inputs["source_dynamic_vocab_size"] = raw_inputs["source_attention_map"].size(1)
+        inputs["target_dynamic_vocab_size"] = raw_inputs["target_attention_map"].size(1)
 
         inputs["edge_types"] = raw_inputs["edge_types"]["edge_types"]
 
@@ -361,11 +407,10 @@ class DecompParser(Transduction):
             "hidden_state_2": encoding_outputs["final_states"][1].permute(1, 0, 2),
             "source_mask": inputs["source_mask"],
             "source_attention_map": inputs["source_attention_map"],
-            "target_attention_map": inputs["source_attention_map"].new_zeros(
-                (batch_size, self._max_decoding_steps, self._max_decoding_steps + 1))
-        }
-        auxiliaries = {
-            "target_dynamic_vocabs": inputs["target_dynamic_vocab"]
+            # [batch_size, max_steps], the target node index of each step, -1 until decoded
+            "target_attention_map": inputs["source_attention_map"].new_full(
+                (batch_size, self._max_decoding_steps), -1),
+            "batch_indices": torch.arange(batch_size, device=inputs["source_mask"].device)
         }
         misc = {
             "batch_size": batch_size,
@@ -373,11 +418,32 @@ class DecompParser(Transduction):
             "source_dynamic_vocab_size": inputs["source_dynamic_vocab_size"],
             "instance_meta": inputs["instance_meta"]
         }
+        auxiliaries = self._prepare_decoding_auxiliaries(inputs, misc)
 
         #print(f"prepared first input hidden_state_1 {start_state['hidden_state_1'].shape}")
         #print(f"prepared first input hidden_state_2 {start_state['hidden_state_2'].shape}")
         return start_predictions, start_state, auxiliaries, misc
 
+    def _prepare_decoding_auxiliaries(self, inputs: Dict, misc: Dict) -> Dict[str, List[Any]]:
+        """
+        Only `_prepare_next_inputs` needs a target dynamic vocab dict per hypothesis; the
+        vectorized path keeps the target nodes in the "target_node_slots" state tensor.
+        """
+        if self._uses_step_input_tables(misc):
+            return {}
+        return {"target_dynamic_vocabs": inputs["target_dynamic_vocab"]}
+
+    def _beam_invariant_state_names(self) -> List[str]:
+        """
+        Decoding state that is the same for all beams of an instance and never updated by
+        the step function. Beam search keeps it at [batch_size, *] instead of reindexing it
+        at every step; the source attention and the pointer generator broadcast its rows over
+        the hypotheses of each instance without copying them.
+        """
+        if not self.share_beam_invariant_state:
+            return []
+        return ["source_memory_bank", "source_mask", "source_attention_map"]
+
     def _prepare_next_inputs(self,
                              predictions: torch.Tensor,
                              target_attention_map: torch.Tensor,
@@ -385,19 +451,23 @@ class DecompParser(Transduction):
                              meta_data: List[Dict],
                              batch_size: int,
                              last_decoding_step: int,
-                             source_dynamic_vocab_size: int) -> Dict:
+                             source_dynamic_vocab_size: int,
+                             batch_indices: torch.Tensor = None) -> Dict:
         """
         Read out a group of hybrid predictions. Based on different ways of node prediction,
         find the corresponding token, node index and pos tags. Prepare the tensorized inputs
         for the next decoding step. Update the target attention map, target dynamic vocab, etc.
         :param predictions: [group_size,]
-        :param target_attention_map: [group_size, target_length, target_dynamic_vocab_size].
+        :param target_attention_map: [group_size, target_length], the target node index
+            of each decoded step, updated in place.
         :param target_dynamic_vocabs: a group_size list of target dynamic vocabs.
         :param meta_data: meta data for each instance.
         :param batch_size: int.
         :param last_decoding_step: the decoding step starts from 0, so the last decoding step
             starts from -1.
         :param source_dynamic_vocab_size: int.
+        :param batch_indices: [group_size], the instance of each hypothesis. If None, the group
+            is either the batch or the full beam of every instance.
         """
         # On the default, if a new node is created via either generation or source-side copy,
         # its node index will be last_decoding_step + 1. One shift between the last decoding
@@ -406,6 +476,8 @@ class DecompParser(Transduction):
         default_node_index = last_decoding_step + 1
 
         def batch_index(instance_i: int) -> int:
+            if batch_indices is not None:
+                return batch_indices[instance_i].item()
             if predictions.size(0) == batch_size * self._beam_size:
                 return instance_i // self._beam_size
             else:
@@ -442,16 +514,22 @@ class DecompParser(Transduction):
             node_indices[i] = node_index
             pos_tags[i] = self.vocab.get_token_index(pos_tag, self._pos_tag_namespace)
             if last_decoding_step != -1:  # For <BOS>, we set the last decoding step to -1.
-                target_attention_map[i, last_decoding_step, node_index] = 1
+                target_attention_map[i, last_decoding_step] = node_index
                 target_dynamic_vocab[node_index] = token
 
+        group_size = len(token_instances)
+        if self._has_finished_hypotheses(group_size, batch_size, last_decoding_step):
+            # Pad as if the finished hypotheses dropped by beam search were still in the group.
+            end_token = TextField([Token(END_SYMBOL)], meta_data[0]["target_token_indexers"])
+            token_instances.append(Instance({"target_tokens": end_token}))
+
         # Covert tokens to tensors.
         batch = Batch(token_instances)
         batch.index_instances(self.vocab)
         padding_lengths = batch.get_padding_lengths()
         tokens = {}
         for key, tensor in batch.as_tensor_dict(padding_lengths)["target_tokens"].items():
-            tokens[key] = tensor.type_as(predictions)
+            tokens[key] = tensor[:group_size].type_as(predictions)
 
         return dict(
             tokens=tokens,
@@ -460,6 +538,123 @@ class DecompParser(Transduction):
             pos_tags=pos_tags.unsqueeze(1),
         )
 
+    def _prepare_step_inputs(self,
+                             predictions: torch.Tensor,
+                             state: Dict[str, torch.Tensor],
+                             auxiliaries: Dict[str, List[Any]],
+                             misc: Dict) -> Dict:
+        """
+        Prepare the inputs of the next decoding step, using the vectorized lookup path
+        when the target token indexers allow it and falling back to `_prepare_next_inputs`.
+        """
+        if not self._uses_step_input_tables(misc):
+            return self._prepare_next_inputs(
+                predictions=predictions,
+                target_attention_map=state["target_attention_map"],
+                target_dynamic_vocabs=auxiliaries["target_dynamic_vocabs"],
+                meta_data=misc["instance_meta"],
+                batch_size=misc["batch_size"],
+                last_decoding_step=misc["last_decoding_step"],
+                source_dynamic_vocab_size=misc["source_dynamic_vocab_size"],
+                batch_indices=state.get("batch_indices", None)
+            )
+
+        if misc.get("step_input_tables", None) is None:
+            token_indexers = misc["instance_meta"][0]["target_token_indexers"]
+            if self._step_input_vocab_token_ids is None:
+                vocab_tokens = [self.vocab.get_token_from_index(index, self._target_output_namespace)
+                                for index in range(self._vocab_size)]
+                self._step_input_vocab_token_ids = index_tokens(vocab_tokens, token_indexers, self.vocab)
+            misc["step_input_tables"] = StepInputTables.build(
+                meta_data=misc["instance_meta"],
+                vocab=self.vocab,
+                vocab_namespace=self._target_output_namespace,
+                pos_tag_namespace=self._pos_tag_namespace,
+                source_dynamic_vocab_size=misc["source_dynamic_vocab_size"],
+                vocab_token_ids=self._step_input_vocab_token_ids,
+                device=predictions.device
+            )
+        if "target_node_slots" not in state:
+            # [group_size, max_steps + 1]; the slot of the token behind each target node index.
+            state["target_node_slots"] = predictions.new_full(
+                (predictions.size(0), self._max_decoding_steps + 1), self._vocab_pad_index)
+
+        return self._prepare_next_inputs_from_tables(
+            predictions=predictions,
+            step_input_tables=misc["step_input_tables"],
+            target_node_slots=state["target_node_slots"],
+            target_attention_map=state["target_attention_map"],
+            batch_size=misc["batch_size"],
+            last_decoding_step=misc["last_decoding_step"],
+            source_dynamic_vocab_size=misc["source_dynamic_vocab_size"],
+            batch_indices=state.get("batch_indices", None)
+        )
+
+    def _uses_step_input_tables(self, misc: Dict) -> bool:
+        token_indexers = misc["instance_meta"][0]["target_token_indexers"]
+        return self.vectorized_step_inputs and supports_token_indexers(token_indexers)
+
+    def _has_finished_hypotheses(self, group_size: int, batch_size: int, last_decoding_step: int) -> bool:
+        """
+        Whether beam search has dropped finished instances from the group. Their hypotheses
+        would have been fed <EOS>, which still counts towards the padding of the inputs.
+        """
+        return last_decoding_step != -1 and group_size < batch_size * self._beam_size
+
+    def _prepare_next_inputs_from_tables(self,
+                                         predictions: torch.Tensor,
+                                         step_input_tables: StepInputTables,
+                                         target_node_slots: torch.Tensor,
+                                         target_attention_map: torch.Tensor,
+                                         batch_size: int,
+                                         last_decoding_step: int,
+                                         source_dynamic_vocab_size: int,
+                                         batch_indices: torch.Tensor = None) -> Dict:
+        """
+        Vectorized version of `_prepare_next_inputs`; produces the same inputs and updates.
+        :param predictions: [group_size,]
+        :param step_input_tables: lookup tables of the batch.
+        :param target_node_slots: [group_size, max_steps + 1], updated in place.
+        :param target_attention_map: [group_size, target_length], the target node index
+            of each decoded step, updated in place.
+        :param batch_size: int.
+        :param last_decoding_step: the decoding step starts from 0, so the last decoding step
+            starts from -1.
+        :param source_dynamic_vocab_size: int.
+        :param batch_indices: [group_size], the instance of each hypothesis. If None, the group
+            is either the batch or the full beam of every instance.
+        """
+        group_size = predictions.size(0)
+        group_indices = torch.arange(group_size, device=predictions.device)
+        if batch_indices is None:
+            # [group_size]
+            batch_indices = group_indices // (group_size // batch_size)
+
+        # Target-side copy points to a previous node; see `_prepare_next_inputs`.
+        target_copy_offset = self._vocab_size + source_dynamic_vocab_size
+        is_target_copy = predictions >= target_copy_offset
+        target_copy_indices = (predictions - target_copy_offset).clamp(min=0)
+        node_indices = torch.where(
+            is_target_copy, target_copy_indices, torch.full_like(predictions, last_decoding_step + 1))
+        slots = torch.where(
+            is_target_copy, target_node_slots.gather(1, target_copy_indices.unsqueeze(1)).squeeze(1), predictions)
+
+        padding_slot = None
+        if self._has_finished_hypotheses(group_size, batch_size, last_decoding_step):
+            padding_slot = self._vocab_eos_index
+        tokens, pos_tags = step_input_tables.lookup(slots, batch_indices, padding_slot)
+
+        if last_decoding_step != -1:  # For <BOS>, we set the last decoding step to -1.
+            target_attention_map[:, last_decoding_step] = node_indices
+            target_node_slots[group_indices, node_indices] = slots
+
+        return dict(
+            tokens={key: tensor.type_as(predictions) for key, tensor in tokens.items()},
+            # [group_size, 1]
+            node_indices=node_indices.unsqueeze(1),
+            pos_tags=pos_tags.type_as(predictions).unsqueeze(1),
+        )
+
     def _node_attribute_predict(self, rnn_outputs, tgt_attr, tgt_attr_mask):
         pred_dict = self._node_attribute_module(rnn_outputs)
         if tgt_attr is not None:
@@ -550,7 +745,10 @@ class DecompParser(Transduction):
             source_attention_weights=decoding_outputs["source_attention_weights"],
             target_attention_weights=decoding_outputs["target_attention_weights"],
             source_attention_map=inputs["source_attention_map"],
-            target_attention_map=inputs["target_attention_map"]
+            target_attention_map=inputs["target_attention_map"],
+            source_dynamic_vocab_size=inputs["source_dynamic_vocab_size"],
+            target_dynamic_vocab_size=inputs["target_dynamic_vocab_size"],
+            eps=self._eps
         )
 
         # compute node attributes
@@ -575,7 +773,7 @@ class DecompParser(Transduction):
                 )
 
         node_pred_loss = self._compute_node_prediction_loss(
-            prob_dist=node_prediction_outputs["hybrid_prob_dist"],
+            log_prob_dist=node_prediction_outputs["hybrid_log_prob_dist"],
             generation_outputs=inputs["generation_outputs"],
             source_copy_indices=inputs["source_copy_indices"],
             target_copy_indices=inputs["target_copy_indices"],
@@ -619,20 +817,20 @@ class DecompParser(Transduction):
         # log_probs: [batch_size, beam_size]
 
     
-        all_predictions, rnn_outputs, log_probs, target_dynamic_vocabs = self._beam_search.search(
+        all_predictions, rnn_outputs, log_probs, __ = self._beam_search.search(
             start_predictions=start_predictions,
             start_state=start_state,
             auxiliaries=auxiliaries,
             step=lambda x, y, z: self._take_one_step_node_prediction(x, y, z, misc),
             tracked_state_name="rnn_output",
-            tracked_auxiliary_name="target_dynamic_vocabs"
+            tracked_auxiliary_name=None,
+            beam_invariant_state_names=self._beam_invariant_state_names()
         )
 
-        node_predictions, node_index_predictions, edge_head_mask, valid_node_mask = self._read_node_predictions(
-            # Remove the last one because we can't get the RNN state for the last one.
-            predictions=all_predictions[:, 0, :-1],
-            meta_data=inputs["instance_meta"],
-            target_dynamic_vocabs=target_dynamic_vocabs[0],
+        # Remove the last one because we can't get the RNN state for the last one.
+        node_predictions = all_predictions[:, 0, :-1]
+        node_index_predictions, edge_head_mask, valid_node_mask = self._read_node_predictions(
+            predictions=node_predictions,
             source_dynamic_vocab_size=inputs["source_dynamic_vocab_size"]
         )
 
@@ -671,10 +869,18 @@ class DecompParser(Transduction):
 
         loss = -log_probs[:, 0].sum() / edge_pred_loss["num_nodes"] + edge_pred_loss["loss_per_node"]
 
+        nodes, node_indices = self._read_node_tokens(
+            predictions=node_predictions,
+            node_index_predictions=node_index_predictions,
+            valid_node_mask=valid_node_mask,
+            meta_data=inputs["instance_meta"],
+            source_dynamic_vocab_size=inputs["source_dynamic_vocab_size"]
+        )
+
         outputs = dict(
             loss=loss,
-            nodes=node_predictions,
-            node_indices=node_index_predictions,
+            nodes=nodes,
+            node_indices=node_indices,
             edge_heads=edge_head_predictions,
             edge_types=edge_type_predictions,
             edge_types_inds=edge_type_ind_predictions,
@@ -224,7 +224,10 @@ class DecompSyntaxParser(DecompParser):
             source_attention_weights=decoding_outputs["source_attention_weights"],
             target_attention_weights=decoding_outputs["target_attention_weights"],
             source_attention_map=inputs["source_attention_map"],
-            target_attention_map=inputs["target_attention_map"]
+            target_attention_map=inputs["target_attention_map"],
+            source_dynamic_vocab_size=inputs["source_dynamic_vocab_size"],
+            target_dynamic_vocab_size=inputs["target_dynamic_vocab_size"],
+            eps=self._eps
         )
         
         try:
@@ -262,7 +265,7 @@ class DecompSyntaxParser(DecompParser):
             just_syntax = True
 
         node_pred_loss = self._compute_node_prediction_loss(
-            prob_dist=node_prediction_outputs["hybrid_prob_dist"],
+            log_prob_dist=node_prediction_outputs["hybrid_log_prob_dist"],
             generation_outputs=inputs["generation_outputs"],
             source_copy_indices=inputs["source_copy_indices"],
             target_copy_indices=inputs["target_copy_indices"],
@@ -336,20 +339,20 @@ class DecompSyntaxParser(DecompParser):
 
         # all_predictions: [batch_size, beam_size, max_steps]
         # log_probs: [batch_size, beam_size]
-        all_predictions, rnn_outputs, log_probs, target_dynamic_vocabs = self._beam_search.search(
+        all_predictions, rnn_outputs, log_probs, __ = self._beam_search.search(
             start_predictions=start_predictions,
             start_state=start_state,
             auxiliaries=auxiliaries,
             step=lambda x, y, z: self._take_one_step_node_prediction(x, y, z, misc),
             tracked_state_name="rnn_output",
-            tracked_auxiliary_name="target_dynamic_vocabs"
+            tracked_auxiliary_name=None,
+            beam_invariant_state_names=self._beam_invariant_state_names()
         )
 
-        node_predictions, node_index_predictions, edge_head_mask, valid_node_mask = self._read_node_predictions(
-            # Remove the last one because we can't get the RNN state for the last one.
-            predictions=all_predictions[:, 0, :-1],
-            meta_data=inputs["instance_meta"],
-            target_dynamic_vocabs=target_dynamic_vocabs[0],
+        # Remove the last one because we can't get the RNN state for the last one.
+        node_predictions = all_predictions[:, 0, :-1]
+        node_index_predictions, edge_head_mask, valid_node_mask = self._read_node_predictions(
+            predictions=node_predictions,
             source_dynamic_vocab_size=inputs["source_dynamic_vocab_size"]
         )
 
@@ -395,10 +398,18 @@ class DecompSyntaxParser(DecompParser):
         else:
             syn_edge_head_predictions, syn_edge_type_predictions, syn_edge_type_inds = self._read_edge_predictions(biaffine_outputs, is_syntax = True) 
 
+        nodes, node_indices = self._read_node_tokens(
+            predictions=node_predictions,
+            node_index_predictions=node_index_predictions,
+            valid_node_mask=valid_node_mask,
+            meta_data=inputs["instance_meta"],
+            source_dynamic_vocab_size=inputs["source_dynamic_vocab_size"]
+        )
+
         outputs = dict(
             loss=loss,
-            nodes=node_predictions,
-            node_indices=node_index_predictions,
+            nodes=nodes,
+            node_indices=node_indices,
             syn_nodes=inputs['syn_tokens_str'], 
             syn_edge_heads=syn_edge_head_predictions,
             syn_edge_types=syn_edge_type_predictions,
@@ -26,7 +26,7 @@ from miso.modules.label_smoothing import LabelSmoothing
 from miso.modules.decoders.attribute_decoder import NodeAttributeDecoder 
 from miso.modules.decoders.edge_decoder import EdgeAttributeDecoder 
 from miso.metrics.decomp_metrics import DecompAttrMetrics
-from miso.nn.beam_search import BeamSearch
+from miso.nn.beam_search import BeamSearch, expand_to_group
 from miso.data.dataset_readers.decomp_parsing.ontology import NODE_ONTOLOGY, EDGE_ONTOLOGY
 from miso.metrics.pearson_r import pearson_r
 # The following imports are added for mimick testing.
@@ -95,6 +95,9 @@ class DecompTransformerParser(DecompParser):
                          eps=eps,
                          pretrained_weights=pretrained_weights)
 
+        # Decode with per-layer key/value caches instead of re-running the input history.
+        self.incremental_decoding = True
+
     @overrides
     def _encode(self,
                 tokens: Dict[str, torch.Tensor],
@@ -168,41 +171,14 @@ class DecompTransformerParser(DecompParser):
                                        misc: Dict,
                                        ) -> Tuple[torch.Tensor, Dict[str, torch.Tensor], Dict[str, List[Any]]]:
 
-        inputs = self._prepare_next_inputs(
-            predictions=last_predictions,
-            target_attention_map=state["target_attention_map"],
-            target_dynamic_vocabs=auxiliaries["target_dynamic_vocabs"],
-            meta_data=misc["instance_meta"],
-            batch_size=misc["batch_size"],
-            last_decoding_step=misc["last_decoding_step"],
-            source_dynamic_vocab_size=misc["source_dynamic_vocab_size"]
-        )
+        inputs = self._prepare_step_inputs(last_predictions, state, auxiliaries, misc)
     
-        # TODO: HERE we go, just concatenate "inputs" to history stored in the state 
-        # need a node index history and a token history 
-        # no need to update history inside of _prepare_next_inputs or double-iterate 
-
         decoder_inputs = torch.cat([
             self._decoder_token_embedder(inputs["tokens"]),
             self._decoder_node_index_embedding(inputs["node_indices"]),
         ], dim=2)
 
-        # if previously decoded steps, concat them in before current input 
-        if state['input_history'] is not None:
-            decoder_inputs = torch.cat([state['input_history'], decoder_inputs], dim = 1)
-
-        # set previously decoded to current step  
-        state['input_history'] = decoder_inputs
-
-
-        decoding_outputs = self._decoder.one_step_forward(
-            inputs=decoder_inputs,
-            source_memory_bank=state["source_memory_bank"],
-            source_mask=state["source_mask"],
-            decoding_step=misc["last_decoding_step"] + 1,
-            total_decoding_steps=self._max_decoding_steps,
-            coverage=state.get("coverage", None)
-        )
+        decoding_outputs = self._decode_one_step(decoder_inputs, state, misc)
 
         state['attentional_tensor'] = decoding_outputs['attentional_tensor'].squeeze(1)
         state['output'] = decoding_outputs['output'].squeeze(1)
@@ -211,14 +187,7 @@ class DecompTransformerParser(DecompParser):
             state["coverage"] = decoding_outputs["coverage"]
 
 
-        node_prediction_outputs = self._extended_pointer_generator(
-            inputs=decoding_outputs["attentional_tensor"],
-            source_attention_weights=decoding_outputs["source_attention_weights"],
-            target_attention_weights=decoding_outputs["target_attention_weights"],
-            source_attention_map=state["source_attention_map"],
-            target_attention_map=state["target_attention_map"]
-        )
-        log_probs = (node_prediction_outputs["hybrid_prob_dist"] + self._eps).squeeze(1).log()
+        log_probs = self._predict_node_log_probs(last_predictions, decoding_outputs, state, misc)
 
         misc["last_decoding_step"] += 1
 
@@ -226,6 +195,66 @@ class DecompTransformerParser(DecompParser):
         return log_probs, state, auxiliaries
 
 
+    @overrides
+    def _beam_invariant_state_names(self) -> List[str]:
+        names = super()._beam_invariant_state_names()
+        if names:
+            names.append("target_mask")
+            # the projected source memory of each layer is cached at the first step
+            for i in range(len(self._decoder.layers)):
+                names += ["decoder_cache_memory_keys_{}".format(i), "decoder_cache_memory_values_{}".format(i)]
+        return names
+
+    def _decode_one_step(self,
+                         decoder_inputs: torch.Tensor,
+                         state: Dict[str, torch.Tensor],
+                         misc: Dict) -> Dict:
+        """
+        Run the decoder for the current step. With incremental decoding, the decoder caches
+        live in the beam search state under "decoder_cache_*" keys, so they are reindexed along
+        the beam backpointers like every other state tensor, except for the projected source
+        memory, which is beam invariant and, like the source memory bank, may be kept with one
+        row per instance; otherwise the whole input history is kept in the state and re-run.
+        :param decoder_inputs: [group_size, 1, input_vector_dim].
+        """
+        if self.incremental_decoding and self._decoder.supports_incremental_decoding:
+            # the input history is not needed, and beam search cannot reindex a None state.
+            state.pop("input_history", None)
+            cache_prefix = "decoder_cache_"
+            decoding_outputs = self._decoder.incremental_one_step_forward(
+                inputs=decoder_inputs,
+                source_memory_bank=state["source_memory_bank"],
+                source_mask=state["source_mask"],
+                cache={key[len(cache_prefix):]: value for key, value in state.items()
+                       if key.startswith(cache_prefix)},
+                decoding_step=misc["last_decoding_step"] + 1,
+                total_decoding_steps=self._max_decoding_steps
+            )
+            for key, value in decoding_outputs["cache"].items():
+                state[cache_prefix + key] = value
+            return decoding_outputs
+
+        # if previously decoded steps, concat them in before current input 
+        if state.get('input_history', None) is not None:
+            decoder_inputs = torch.cat([state['input_history'], decoder_inputs], dim = 1)
+
+        # set previously decoded to current step  
+        state['input_history'] = decoder_inputs
+
+        # the decoder layers need one row of source memory per hypothesis; the rows of an
+        # instance stay the same, so they are expanded once per search and never reindexed
+        group_size = decoder_inputs.size(0)
+        for key in ["source_memory_bank", "source_mask"]:
+            state[key] = expand_to_group(state[key], group_size)
+        return self._decoder.one_step_forward(
+            inputs=decoder_inputs,
+            source_memory_bank=state["source_memory_bank"],
+            source_mask=state["source_mask"],
+            decoding_step=misc["last_decoding_step"] + 1,
+            total_decoding_steps=self._max_decoding_steps,
+            coverage=state.get("coverage", None)
+        )
+
     @overrides
     def _prepare_inputs(self, raw_inputs):
         inputs = raw_inputs.copy()
@@ -250,13 +279,14 @@ class DecompTransformerParser(DecompParser):
         inputs["target_copy_indices"] = raw_inputs["target_copy_indices"][:, 1:]
 
 
-        # [batch, target_seq_length, target_seq_length + 1(sentinel)]
+        # [batch, target_seq_length], indices into target_seq_length + 1(sentinel) slots
         inputs["target_attention_map"] = raw_inputs["target_attention_map"][:, 1:]  # exclude UNK
-        # [batch, 1(unk) + source_seq_length, dynamic_vocab_size]
+        # [batch, source_seq_length], indices into the dynamic vocab.
         # Exclude unk and the last pad.
         inputs["source_attention_map"] = raw_inputs["source_attention_map"][:, 1:-1]
 
-        inputs["source_dynamic_vocab_size"] = inputs["source_attention_map"].size(2)
+        inputs["source_dynamic_vocab_size"] = raw_inputs["source_attention_map"].size(1)
+        inputs["target_dynamic_vocab_size"] = raw_inputs["target_attention_map"].size(1)
 
         inputs["edge_types"] = raw_inputs["edge_types"]["edge_types"]
 
@@ -297,110 +327,23 @@ class DecompTransformerParser(DecompParser):
             "source_mask": inputs["source_mask"],
             "target_mask": inputs["target_mask"], 
             "source_attention_map": inputs["source_attention_map"],
-            "target_attention_map": inputs["source_attention_map"].new_zeros(
-                (batch_size, self._max_decoding_steps, self._max_decoding_steps + 1)),
+            # [batch_size, max_steps], the target node index of each step, -1 until decoded
+            "target_attention_map": inputs["source_attention_map"].new_full(
+                (batch_size, self._max_decoding_steps), -1),
             "input_history": None, 
+            "batch_indices": torch.arange(batch_size, device=inputs["source_mask"].device),
         }
 
-        auxiliaries = {
-            "target_dynamic_vocabs": inputs["target_dynamic_vocab"]
-        }
         misc = {
             "batch_size": batch_size,
             "last_decoding_step": -1,  # At <BOS>, we set it to -1.
             "source_dynamic_vocab_size": inputs["source_dynamic_vocab_size"],
             "instance_meta": inputs["instance_meta"]
         }
+        auxiliaries = self._prepare_decoding_auxiliaries(inputs, misc)
 
         return start_predictions, start_state, auxiliaries, misc
 
-    @overrides
-    def _prepare_next_inputs(self,
-                             predictions: torch.Tensor,
-                             target_attention_map: torch.Tensor,
-                             target_dynamic_vocabs: List[Dict[int, str]],
-                             meta_data: List[Dict],
-                             batch_size: int,
-                             last_decoding_step: int,
-                             source_dynamic_vocab_size: int) -> Dict:
-        """
-        Read out a group of hybrid predictions. Based on different ways of node prediction,
-        find the corresponding token, node index and pos tags. Prepare the tensorized inputs
-        for the next decoding step. Update the target attention map, target dynamic vocab, etc.
-        :param predictions: [group_size,]
-        :param target_attention_map: [group_size, target_length, target_dynamic_vocab_size].
-        :param target_dynamic_vocabs: a group_size list of target dynamic vocabs.
-        :param meta_data: meta data for each instance.
-        :param batch_size: int.
-        :param last_decoding_step: the decoding step starts from 0, so the last decoding step
-            starts from -1.
-        :param source_dynamic_vocab_size: int.
-        """
-        # On the default, if a new node is created via either generation or source-side copy,
-        # its node index will be last_decoding_step + 1. One shift between the last decoding
-        # step and the default node index is because node index 0 is reserved for no target copy.
-        # See `_prepare_inputs` for detail.
-        default_node_index = last_decoding_step + 1
-
-        def batch_index(instance_i: int) -> int:
-            if predictions.size(0) == batch_size * self._beam_size:
-                return instance_i // self._beam_size
-            else:
-                return instance_i
-
-        token_instances = []
-
-        node_indices = torch.zeros_like(predictions)
-        pos_tags = torch.zeros_like(predictions)
-
-        for i, index in enumerate(predictions.tolist()):
-
-            instance_meta = meta_data[batch_index(i)]
-            pos_tag_lut = instance_meta["pos_tag_lut"]
-            target_dynamic_vocab = target_dynamic_vocabs[i]
-            # Generation.
-            if index < self._vocab_size:
-                token = self.vocab.get_token_from_index(index, self._target_output_namespace)
-                node_index = default_node_index
-                pos_tag = pos_tag_lut.get(token, DEFAULT_OOV_TOKEN)
-            # Source-side copy.
-            elif self._vocab_size <= index < self._vocab_size + source_dynamic_vocab_size:
-                index -= self._vocab_size
-                source_dynamic_vocab = instance_meta["source_dynamic_vocab"]
-                token = source_dynamic_vocab.get_token_from_idx(index)
-                node_index = default_node_index
-                pos_tag = pos_tag_lut.get(token, DEFAULT_OOV_TOKEN)
-            # Target-side copy.
-            else:
-                index -= (self._vocab_size + source_dynamic_vocab_size)
-                token = target_dynamic_vocab[index]
-                node_index = index
-                pos_tag = pos_tag_lut.get(token, DEFAULT_OOV_TOKEN)
-
-            target_token = TextField([Token(token)], instance_meta["target_token_indexers"])
-
-            token_instances.append(Instance({"target_tokens": target_token}))
-            node_indices[i] = node_index
-            pos_tags[i] = self.vocab.get_token_index(pos_tag, self._pos_tag_namespace)
-            if last_decoding_step != -1:  # For <BOS>, we set the last decoding step to -1.
-                target_attention_map[i, last_decoding_step, node_index] = 1
-                target_dynamic_vocab[node_index] = token
-
-        # Covert tokens to tensors.
-        batch = Batch(token_instances)
-        batch.index_instances(self.vocab)
-        padding_lengths = batch.get_padding_lengths()
-        tokens = {}
-        for key, tensor in batch.as_tensor_dict(padding_lengths)["target_tokens"].items():
-            tokens[key] = tensor.type_as(predictions)
-
-        return dict(
-            tokens=tokens,
-            # [group_size, 1]
-            node_indices=node_indices.unsqueeze(1),
-            pos_tags=pos_tags.unsqueeze(1),
-        )
-
     @overrides
     def _training_forward(self, inputs: Dict) -> Dict[str, torch.Tensor]:
         encoding_outputs = self._encode(
@@ -425,7 +368,10 @@ class DecompTransformerParser(DecompParser):
             source_attention_weights=decoding_outputs["source_attention_weights"],
             target_attention_weights=decoding_outputs["target_attention_weights"],
             source_attention_map=inputs["source_attention_map"],
-            target_attention_map=inputs["target_attention_map"]
+            target_attention_map=inputs["target_attention_map"],
+            source_dynamic_vocab_size=inputs["source_dynamic_vocab_size"],
+            target_dynamic_vocab_size=inputs["target_dynamic_vocab_size"],
+            eps=self._eps
         )
 
         # compute node attributes
@@ -450,7 +396,7 @@ class DecompTransformerParser(DecompParser):
                 )
 
         node_pred_loss = self._compute_node_prediction_loss(
-            prob_dist=node_prediction_outputs["hybrid_prob_dist"],
+            log_prob_dist=node_prediction_outputs["hybrid_log_prob_dist"],
             generation_outputs=inputs["generation_outputs"],
             source_copy_indices=inputs["source_copy_indices"],
             target_copy_indices=inputs["target_copy_indices"],
@@ -496,20 +442,20 @@ class DecompTransformerParser(DecompParser):
         # log_probs: [batch_size, beam_size]
 
     
-        all_predictions, outputs, log_probs, target_dynamic_vocabs = self._beam_search.search(
+        all_predictions, outputs, log_probs, __ = self._beam_search.search(
             start_predictions=start_predictions,
             start_state=start_state,
             auxiliaries=auxiliaries,
             step=lambda x, y, z: self._take_one_step_node_prediction(x, y, z, misc),
             tracked_state_name="output",
-            tracked_auxiliary_name="target_dynamic_vocabs"
+            tracked_auxiliary_name=None,
+            beam_invariant_state_names=self._beam_invariant_state_names()
         )
 
-        node_predictions, node_index_predictions, edge_head_mask, valid_node_mask = self._read_node_predictions(
-            # Remove the last one because we can't get the RNN state for the last one.
-            predictions=all_predictions[:, 0, :-1],
-            meta_data=inputs["instance_meta"],
-            target_dynamic_vocabs=target_dynamic_vocabs[0],
+        # Remove the last one because we can't get the RNN state for the last one.
+        node_predictions = all_predictions[:, 0, :-1]
+        node_index_predictions, edge_head_mask, valid_node_mask = self._read_node_predictions(
+            predictions=node_predictions,
             source_dynamic_vocab_size=inputs["source_dynamic_vocab_size"]
         )
 
@@ -547,10 +493,18 @@ class DecompTransformerParser(DecompParser):
 
         loss = -log_probs[:, 0].sum() / edge_pred_loss["num_nodes"] + edge_pred_loss["loss_per_node"]
 
+        nodes, node_indices = self._read_node_tokens(
+            predictions=node_predictions,
+            node_index_predictions=node_index_predictions,
+            valid_node_mask=valid_node_mask,
+            meta_data=inputs["instance_meta"],
+            source_dynamic_vocab_size=inputs["source_dynamic_vocab_size"]
+        )
+
         outputs = dict(
             loss=loss,
-            nodes=node_predictions,
-            node_indices=node_index_predictions,
+            nodes=nodes,
+            node_indices=node_indices,
             edge_heads=edge_head_predictions,
             edge_types=edge_type_predictions,
             edge_types_inds=edge_type_ind_predictions,
@@ -231,7 +231,10 @@ class DecompTransformerSyntaxParser(DecompTransformerParser):
             source_attention_weights=decoding_outputs["source_attention_weights"],
             target_attention_weights=decoding_outputs["target_attention_weights"],
             source_attention_map=inputs["source_attention_map"],
-            target_attention_map=inputs["target_attention_map"]
+            target_attention_map=inputs["target_attention_map"],
+            source_dynamic_vocab_size=inputs["source_dynamic_vocab_size"],
+            target_dynamic_vocab_size=inputs["target_dynamic_vocab_size"],
+            eps=self._eps
         )
 
         try:
@@ -270,7 +273,7 @@ class DecompTransformerSyntaxParser(DecompTransformerParser):
             just_syntax = True
 
         node_pred_loss = self._compute_node_prediction_loss(
-            prob_dist=node_prediction_outputs["hybrid_prob_dist"],
+            log_prob_dist=node_prediction_outputs["hybrid_log_prob_dist"],
             generation_outputs=inputs["generation_outputs"],
             source_copy_indices=inputs["source_copy_indices"],
             target_copy_indices=inputs["target_copy_indices"],
@@ -336,20 +339,20 @@ class DecompTransformerSyntaxParser(DecompTransformerParser):
         # log_probs: [batch_size, beam_size]
 
     
-        all_predictions, outputs, log_probs, target_dynamic_vocabs = self._beam_search.search(
+        all_predictions, outputs, log_probs, __ = self._beam_search.search(
             start_predictions=start_predictions,
             start_state=start_state,
             auxiliaries=auxiliaries,
             step=lambda x, y, z: self._take_one_step_node_prediction(x, y, z, misc),
             tracked_state_name="output",
-            tracked_auxiliary_name="target_dynamic_vocabs"
+            tracked_auxiliary_name=None,
+            beam_invariant_state_names=self._beam_invariant_state_names()
         )
 
-        node_predictions, node_index_predictions, edge_head_mask, valid_node_mask = self._read_node_predictions(
-            # Remove the last one because we can't get the RNN state for the last one.
-            predictions=all_predictions[:, 0, :-1],
-            meta_data=inputs["instance_meta"],
-            target_dynamic_vocabs=target_dynamic_vocabs[0],
+        # Remove the last one because we can't get the RNN state for the last one.
+        node_predictions = all_predictions[:, 0, :-1]
+        node_index_predictions, edge_head_mask, valid_node_mask = self._read_node_predictions(
+            predictions=node_predictions,
             source_dynamic_vocab_size=inputs["source_dynamic_vocab_size"]
         )
 
@@ -393,10 +396,18 @@ class DecompTransformerSyntaxParser(DecompTransformerParser):
         else:
             syn_edge_head_predictions, syn_edge_type_predictions, syn_edge_type_inds = self._read_edge_predictions(biaffine_outputs, is_syntax = True) 
 
+        nodes, node_indices = self._read_node_tokens(
+            predictions=node_predictions,
+            node_index_predictions=node_index_predictions,
+            valid_node_mask=valid_node_mask,
+            meta_data=inputs["instance_meta"],
+            source_dynamic_vocab_size=inputs["source_dynamic_vocab_size"]
+        )
+
         outputs = dict(
             loss=loss,
-            nodes=node_predictions,
-            node_indices=node_index_predictions,
+            nodes=nodes,
+            node_indices=node_indices,
             syn_nodes=inputs['syn_tokens_str'], 
             syn_edge_heads=syn_edge_head_predictions,
             syn_edge_types=syn_edge_type_predictions,
@@ -425,26 +436,33 @@ class DecompTransformerSyntaxParser(DecompTransformerParser):
             "source_mask": inputs["source_mask"],
             "target_mask": inputs["target_mask"], 
             "source_attention_map": inputs["source_attention_map"],
-            "target_attention_map": inputs["source_attention_map"].new_zeros(
-                (batch_size, self._max_decoding_steps, self._max_decoding_steps + 1)),
+            # [batch_size, max_steps], the target node index of each step, -1 until decoded
+            "target_attention_map": inputs["source_attention_map"].new_full(
+                (batch_size, self._max_decoding_steps), -1),
             "input_history": None, 
+            "batch_indices": torch.arange(batch_size, device=inputs["source_mask"].device),
         }
 
         if "op_vec" in inputs.keys() and inputs["op_vec"] is not None:
             start_state["op_vec"] = inputs["op_vec"]
 
-        auxiliaries = {
-            "target_dynamic_vocabs": inputs["target_dynamic_vocab"]
-        }
         misc = {
             "batch_size": batch_size,
             "last_decoding_step": -1,  # At <BOS>, we set it to -1.
             "source_dynamic_vocab_size": inputs["source_dynamic_vocab_size"],
             "instance_meta": inputs["instance_meta"]
         }
+        auxiliaries = self._prepare_decoding_auxiliaries(inputs, misc)
 
         return start_predictions, start_state, auxiliaries, misc
 
+    @overrides
+    def _beam_invariant_state_names(self) -> List[str]:
+        names = super()._beam_invariant_state_names()
+        if names:
+            names.append("op_vec")
+        return names
+
     @overrides
     def _take_one_step_node_prediction(self,
                                        last_predictions: torch.Tensor,
@@ -453,52 +471,15 @@ class DecompTransformerSyntaxParser(DecompTransformerParser):
                                        misc: Dict,
                                        ) -> Tuple[torch.Tensor, Dict[str, torch.Tensor], Dict[str, List[Any]]]:
 
-        inputs = self._prepare_next_inputs(
-            predictions=last_predictions,
-            target_attention_map=state["target_attention_map"],
-            target_dynamic_vocabs=auxiliaries["target_dynamic_vocabs"],
-            meta_data=misc["instance_meta"],
-            batch_size=misc["batch_size"],
-            last_decoding_step=misc["last_decoding_step"],
-            source_dynamic_vocab_size=misc["source_dynamic_vocab_size"]
-        )
+        inputs = self._prepare_step_inputs(last_predictions, state, auxiliaries, misc)
     
-        # TODO: HERE we go, just concatenate "inputs" to history stored in the state 
-        # need a node index history and a token history 
-        # no need to update history inside of _prepare_next_inputs or double-iterate 
-
         decoder_inputs = torch.cat([
             self._decoder_token_embedder(inputs["tokens"]),
             self._decoder_node_index_embedding(inputs["node_indices"]),
         ], dim=2)
 
-        # if previously decoded steps, concat them in before current input 
-        if state['input_history'] is not None:
-            decoder_inputs = torch.cat([state['input_history'], decoder_inputs], dim = 1)
-
-        # set previously decoded to current step  
-        state['input_history'] = decoder_inputs
-
-        if self.intermediate_graph:
-            # TODO: put op vec back in 
-            decoding_outputs = self._decoder.one_step_forward(
-                inputs=decoder_inputs,
-                source_memory_bank=state["source_memory_bank"],
-                # op_vec=state["op_vec"],
-                source_mask=state["source_mask"],
-                decoding_step=misc["last_decoding_step"] + 1,
-                total_decoding_steps=self._max_decoding_steps,
-                coverage=state.get("coverage", None)
-            )
-        else:
-            decoding_outputs = self._decoder.one_step_forward(
-                inputs=decoder_inputs,
-                source_memory_bank=state["source_memory_bank"],
-                source_mask=state["source_mask"],
-                decoding_step=misc["last_decoding_step"] + 1,
-                total_decoding_steps=self._max_decoding_steps,
-                coverage=state.get("coverage", None)
-            )
+        # TODO: put op vec back in for intermediate graphs
+        decoding_outputs = self._decode_one_step(decoder_inputs, state, misc)
 
         state['attentional_tensor'] = decoding_outputs['attentional_tensor'].squeeze(1)
         state['output'] = decoding_outputs['output'].squeeze(1)
@@ -507,14 +488,7 @@ class DecompTransformerSyntaxParser(DecompTransformerParser):
             state["coverage"] = decoding_outputs["coverage"]
 
 
-        node_prediction_outputs = self._extended_pointer_generator(
-            inputs=decoding_outputs["attentional_tensor"],
-            source_attention_weights=decoding_outputs["source_attention_weights"],
-            target_attention_weights=decoding_outputs["target_attention_weights"],
-            source_attention_map=state["source_attention_map"],
-            target_attention_map=state["target_attention_map"]
-        )
-        log_probs = (node_prediction_outputs["hybrid_prob_dist"] + self._eps).squeeze(1).log()
+        log_probs = self._predict_node_log_probs(last_predictions, decoding_outputs, state, misc)
 
         misc["last_decoding_step"] += 1
 
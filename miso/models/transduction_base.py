@@ -1,5 +1,6 @@
 from typing import Dict, Tuple
 import logging
+import os
 from collections import OrderedDict
 import pdb 
 
@@ -7,8 +8,11 @@ from overrides import overrides
 import torch
 from torch.nn import functional as F
 
+from allennlp.common import Params
+from allennlp.common.checks import ConfigurationError
 from allennlp.data import Vocabulary
 from allennlp.models import Model
+from allennlp.models.model import _DEFAULT_WEIGHTS, remove_pretrained_embedding_params
 from allennlp.modules import TextFieldEmbedder, Embedding, InputVariationalDropout, Seq2SeqEncoder
 from allennlp.training.metrics import AttachmentScores
 from allennlp.data.vocabulary import DEFAULT_PADDING_TOKEN
@@ -19,6 +23,7 @@ from miso.modules.generators import ExtendedPointerGenerator
 from miso.modules.parsers import DeepTreeParser
 from miso.modules.label_smoothing import LabelSmoothing
 from miso.metrics.extended_pointer_generator_metrics import ExtendedPointerGeneratorMetrics
+from miso.nn.quantization import quantize_dynamic_int8
 
 logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
 
@@ -75,6 +80,39 @@ class Transduction(Model):
 
         # loading partial weights
         self.pretrained_weights = pretrained_weights
+        # the precision of the encoder and decoder Linear weights; see `set_inference_precision`
+        self.inference_precision = "float32"
+
+    @classmethod
+    def _load(cls,
+              config: Params,
+              serialization_dir: str,
+              weights_file: str = None,
+              cuda_device: int = -1) -> Model:
+        """
+        Load archives written by ``miso.nn.quantization.quantize_archive``: their weights
+        only fit a model whose "quantized_modules" have been quantized already, so quantize
+        right after construction and load the weights afterwards. Other archives load as usual.
+        """
+        quantized_modules = config.pop("quantized_modules", None)
+        if quantized_modules is None:
+            return super()._load(config, serialization_dir, weights_file, cuda_device)
+        if cuda_device >= 0:
+            raise ConfigurationError("Int8 quantized models only run on CPU; use cuda_device -1")
+
+        weights_file = weights_file or os.path.join(serialization_dir, _DEFAULT_WEIGHTS)
+        vocab_dir = os.path.join(serialization_dir, "vocabulary")
+        vocab_params = config.get("vocabulary", Params({}))
+        vocab_choice = vocab_params.pop_choice("type", Vocabulary.list_available(), True)
+        vocab = Vocabulary.by_name(vocab_choice).from_files(vocab_dir)
+
+        model_params = config.get("model")
+        remove_pretrained_embedding_params(model_params)
+        model = Model.from_params(vocab=vocab, params=model_params)
+        model.extend_embedder_vocab()
+        quantize_dynamic_int8(model, quantized_modules)
+        model.load_state_dict(torch.load(weights_file, map_location="cpu"))
+        return model.cpu()
 
     @overrides
     def get_metrics(self, reset: bool = False) -> Dict[str, float]:
@@ -168,7 +206,7 @@ class Transduction(Model):
         )
 
     def _compute_node_prediction_loss(self,
-                                      prob_dist: torch.Tensor,
+                                      log_prob_dist: torch.Tensor,
                                       generation_outputs: torch.Tensor,
                                       source_copy_indices: torch.Tensor,
                                       target_copy_indices: torch.Tensor,
@@ -178,7 +216,7 @@ class Transduction(Model):
         """
         Compute the node prediction loss based on the final hybrid probability distribution.
 
-        :param prob_dist: probability distribution,
+        :param log_prob_dist: log of the probability distribution (plus eps),
             [batch_size, target_length, vocab_size + source_dynamic_vocab_size + target_dynamic_vocab_size].
         :param generation_outputs: generated node indices in the pre-defined vocabulary,
             [batch_size, target_length].
@@ -191,7 +229,7 @@ class Transduction(Model):
         :param coverage_history: None or a tensor recording the source-side coverage history.
             [batch_size, target_length, source_length].
         """
-        _, prediction = prob_dist.max(2)
+        _, prediction = log_prob_dist.max(2)
 
         batch_size, target_length = prediction.size()
         not_pad_mask = generation_outputs.ne(self._vocab_pad_index)
@@ -212,9 +250,9 @@ class Transduction(Model):
         hybrid_targets = _target_copy_indices + _source_copy_indices + _generation_outputs
 
         # Compute loss.
-        log_prob_dist = (prob_dist.view(batch_size * target_length, -1) + self._eps).log()
+        flat_log_prob_dist = log_prob_dist.view(batch_size * target_length, -1)
         flat_hybrid_targets = hybrid_targets.view(batch_size * target_length)
-        loss = self._label_smoothing(log_prob_dist, flat_hybrid_targets)
+        loss = self._label_smoothing(flat_log_prob_dist, flat_hybrid_targets)
 
         # Coverage loss.
         if coverage_history is not None:
@@ -346,7 +384,10 @@ class Transduction(Model):
             source_attention_weights=decoding_outputs["source_attention_weights"],
             target_attention_weights=decoding_outputs["target_attention_weights"],
             source_attention_map=inputs["source_attention_map"],
-            target_attention_map=inputs["target_attention_map"]
+            target_attention_map=inputs["target_attention_map"],
+            source_dynamic_vocab_size=inputs["source_dynamic_vocab_size"],
+            target_dynamic_vocab_size=inputs["target_dynamic_vocab_size"],
+            eps=self._eps
         )
         edge_prediction_outputs = self._parse(
             rnn_outputs=decoding_outputs["rnn_outputs"],
@@ -354,7 +395,7 @@ class Transduction(Model):
             edge_heads=inputs["edge_heads"]
         )
         node_pred_loss = self._compute_node_prediction_loss(
-            prob_dist=node_prediction_outputs["hybrid_prob_dist"],
+            log_prob_dist=node_prediction_outputs["hybrid_log_prob_dist"],
             generation_outputs=inputs["generation_outputs"],
             source_copy_indices=inputs["source_copy_indices"],
             target_copy_indices=inputs["target_copy_indices"],
@@ -37,7 +37,7 @@ class MLPAttention(Attention):
         """
         :param query:  [batch_size, query_seq_length, query_vector_dim].
         :param key:  [batch_size, key_seq_length, key_vector_dim].
-        :param coverage: [batch_size, key_seq_length]
+        :param coverage: [batch_size, key_seq_length], or [batch_size, query_seq_length, key_seq_length]
         :return:  [batch_size, query_seq_length, key_seq_length]
         """
         batch_size, query_seq_length, query_vector_dim = query.size()
@@ -52,7 +52,7 @@ class MLPAttention(Attention):
         activation_input = query_linear_output + key_linear_output
 
         if self._use_coverage:
-            coverage_linear_output = self.coverage_linear(coverage.view(batch_size, 1, key_seq_length, 1))
+            coverage_linear_output = self.coverage_linear(coverage.view(batch_size, -1, key_seq_length, 1))
             coverage_linear_output = coverage_linear_output.expand(
                 batch_size, query_seq_length, key_seq_length, self._hidden_vector_dim
             )
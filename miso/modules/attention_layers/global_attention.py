@@ -33,10 +33,27 @@ class GlobalAttention(AttentionLayer):
                 coverage: torch.Tensor = None) -> Dict[str, torch.Tensor]:
         """
         :param query: [batch_size, query_length, query_vector_dim]
-        :param key: [batch_size, key_length, key_vector_dim]
-        :param mask: fill with pad with 0, [batch_size, key_length]
+        :param key: [batch_size, key_length, key_vector_dim], or, for single-step queries,
+            [key_batch_size, key_length, key_vector_dim] with one row per group of consecutive
+            queries (e.g. the beam invariant source memory of the hypotheses of an instance),
+            where key_batch_size divides batch_size; each group then attends over its row
+            without copying it.
+        :param mask: fill with pad with 0, [batch_size, key_length], or [key_batch_size, key_length]
         :param coverage: [batch_size, query_length, key_length]
         """
+        batch_size = query.size(0)
+        key_batch_size = key.size(0)
+        if key_batch_size != batch_size:
+            assert query.size(1) == 1, "only single-step queries can share key rows"
+            # [key_batch_size, batch_size // key_batch_size, *]: the queries of a group become
+            # the query positions of its key row.
+            outputs = self.forward(query.view(key_batch_size, batch_size // key_batch_size, -1),
+                                   key,
+                                   mask,
+                                   None if coverage is None else coverage.view(key_batch_size, -1, key.size(1)))
+            return {name: None if value is None else value.view(batch_size, 1, -1)
+                    for name, value in outputs.items()}
+
         # Output: [batch_size, query_length, key_length]
         if coverage is not None:
             attention_weights = self.attention(query, key, coverage)
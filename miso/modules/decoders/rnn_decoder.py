@@ -17,6 +17,9 @@ logger = logging.getLogger(__name__)
 
 @MisoDecoder.register("rnn_decoder") 
 class RNNDecoder(MisoDecoder):
+    # run single steps with ``StackedLstm.step`` rather than packing length-1 sequences
+    use_lstm_step = True
+
     def __init__(self,
                  rnn_cell: StackedLstm,
                  source_attention_layer: AttentionLayer,
@@ -122,8 +125,9 @@ class RNNDecoder(MisoDecoder):
         """
         Run a single step decoding.
         :param input_tensor: [batch_size, 1, input_vector_dim].
-        :param source_memory_bank: [batch_size, source_seq_length, source_vector_dim].
-        :param source_mask: [batch_size, source_seq_length].
+        :param source_memory_bank: [batch_size, source_seq_length, source_vector_dim], or one row
+            per group of consecutive rows of `input_tensor`, e.g. per instance during beam search.
+        :param source_mask: [batch_size, source_seq_length], or one row per group like the memory bank.
         :param target_memory_bank: [batch_size, target_seq_length, target_vector_dim].
         :param decoding_step: index of the current decoding step.
         :param total_decoding_steps: the total number of decoding steps.
@@ -133,16 +137,21 @@ class RNNDecoder(MisoDecoder):
         :return:
         """
 
-        batch_size, source_seq_length, _ = source_memory_bank.size()
+        batch_size = input_tensor.size(0)
+        source_seq_length = source_memory_bank.size(1)
         if input_feed is None:
             input_feed = input_tensor.new_zeros(size=(batch_size, 1, self.hidden_vector_dim))
         if self.use_coverage and coverage is None:
             coverage = input_tensor.new_zeros(size=(batch_size, 1, source_seq_length))
         # RNN.
         concat_input = torch.cat([input_tensor, input_feed], 2)
-        packed_input = pack_padded_sequence(concat_input, [1] * batch_size, batch_first=True)
-        packed_output, hidden_state = self.rnn_cell(packed_input, hidden_state)
-        rnn_output, _ = pad_packed_sequence(packed_output, batch_first=True)
+        if self.use_lstm_step and self.rnn_cell.can_step():
+            rnn_output, hidden_state = self.rnn_cell.step(concat_input.squeeze(1), hidden_state)
+            rnn_output = rnn_output.unsqueeze(1)
+        else:
+            packed_input = pack_padded_sequence(concat_input, [1] * batch_size, batch_first=True)
+            packed_output, hidden_state = self.rnn_cell(packed_input, hidden_state)
+            rnn_output, _ = pad_packed_sequence(packed_output, batch_first=True)
     
 
         # source-side attention.
@@ -176,16 +185,24 @@ class RNNDecoder(MisoDecoder):
         Compute the target-side attention, and return a fixed length tensor
         representing attention weights for the current decoding step.
         :param query: [batch_size, 1, query_vector_dim].
-        :param key: None or [batch_size, key_seq_length, key_vector_dim].
+        :param key: None, [batch_size, decoding_step, key_vector_dim], or a preallocated
+            [batch_size, total_decoding_steps, key_vector_dim] memory bank whose first
+            decoding_step entries are filled; the rest are masked out.
         :param decoding_step: index of the current decoding step.
         :param total_decoding_steps: the total number of decoding steps.
         :return: [batch_size, 1, total_decoding_steps].
         """
-        if key is not None:
-            attention_weights = self.target_attention_layer(query, key)["attention_weights"]
-            if total_decoding_steps != 1:
-                attention_weights = F.pad(attention_weights, [0, total_decoding_steps - decoding_step], "constant", 0)
-        else:
+        if key is None or decoding_step == 0:
             batch_size = query.size(0)
-            attention_weights = query.new_zeros((batch_size, 1, total_decoding_steps))
+            return query.new_zeros((batch_size, 1, total_decoding_steps))
+
+        if key.size(1) == total_decoding_steps:
+            # [batch_size, total_decoding_steps]
+            mask = (torch.arange(total_decoding_steps, device=key.device) < decoding_step).long()
+            mask = mask.unsqueeze(0).expand(key.size(0), total_decoding_steps)
+            return self.target_attention_layer(query, key, mask)["attention_weights"]
+
+        attention_weights = self.target_attention_layer(query, key)["attention_weights"]
+        if total_decoding_steps != 1:
+            attention_weights = F.pad(attention_weights, [0, total_decoding_steps - decoding_step], "constant", 0)
         return attention_weights
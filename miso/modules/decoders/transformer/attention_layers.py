@@ -23,6 +23,68 @@ def _get_activation_fn(activation):
     else:
         raise RuntimeError("activation should be relu/gelu, not %s." % activation)
 
+def _split_heads(inputs, num_heads):
+    """
+    :param inputs: [batch_size, seq_len, d_model].
+    :return: [batch_size, num_heads, seq_len, head_dim].
+    """
+    batch_size, seq_len, d_model = inputs.size()
+    return inputs.view(batch_size, seq_len, num_heads, d_model // num_heads).transpose(1, 2)
+
+def _project_key_value(attention, inputs):
+    """
+    Project keys and values the same way ``torch.nn.MultiheadAttention`` does.
+    :param inputs: [batch_size, seq_len, d_model].
+    :return: keys and values, each [batch_size, num_heads, seq_len, head_dim].
+    """
+    d_model = attention.embed_dim
+    keys, values = F.linear(inputs,
+                            attention.in_proj_weight[d_model:],
+                            attention.in_proj_bias[d_model:]).chunk(2, dim=-1)
+    return _split_heads(keys, attention.num_heads), _split_heads(values, attention.num_heads)
+
+def _append_bias_key_value(attention, keys, values):
+    """
+    Append the learned ``bias_k``/``bias_v`` position as the last key/value.
+    :param keys: [batch_size, num_heads, seq_len, head_dim].
+    :param values: [batch_size, num_heads, seq_len, head_dim].
+    """
+    batch_size, num_heads, _, head_dim = keys.size()
+    bias_k = attention.bias_k.view(1, num_heads, 1, head_dim).expand(batch_size, -1, -1, -1)
+    bias_v = attention.bias_v.view(1, num_heads, 1, head_dim).expand(batch_size, -1, -1, -1)
+    return torch.cat([keys, bias_k], dim=2), torch.cat([values, bias_v], dim=2)
+
+def _attend_one_step(attention, query, keys, values, key_padding_mask=None):
+    """
+    Single-query multi-head attention over already projected keys and values.
+    The keys and values may have one row per group of consecutive queries (e.g. the
+    beam invariant source memory of the hypotheses of an instance); each group of
+    queries then attends over its row without copying it.
+    :param query: [batch_size, 1, d_model].
+    :param keys: [key_batch_size, num_heads, key_len, head_dim], where key_batch_size divides batch_size.
+    :param values: [key_batch_size, num_heads, key_len, head_dim].
+    :param key_padding_mask: [key_batch_size, key_len], True at positions to ignore.
+    :return: [batch_size, 1, d_model].
+    """
+    batch_size, _, d_model = query.size()
+    key_batch_size = keys.size(0)
+    num_heads = attention.num_heads
+    head_dim = d_model // num_heads
+
+    query = F.linear(query, attention.in_proj_weight[:d_model], attention.in_proj_bias[:d_model])
+    query = query * float(head_dim) ** -0.5
+    # [key_batch_size, batch_size // key_batch_size, d_model]
+    query = query.view(key_batch_size, batch_size // key_batch_size, d_model)
+    # [key_batch_size, num_heads, batch_size // key_batch_size, key_len]
+    weights = torch.matmul(_split_heads(query, num_heads), keys.transpose(2, 3))
+    if key_padding_mask is not None:
+        weights = weights.masked_fill(key_padding_mask.view(key_batch_size, 1, 1, -1), float("-inf"))
+    weights = F.softmax(weights, dim=-1)
+    weights = F.dropout(weights, p=attention.dropout, training=attention.training)
+    # [batch_size, 1, d_model]
+    outputs = torch.matmul(weights, values).transpose(1, 2).reshape(batch_size, 1, d_model)
+    return F.linear(outputs, attention.out_proj.weight, attention.out_proj.bias)
+
 class MisoTransformerDecoderLayer(torch.nn.Module, Registrable):
     """
     Modified TransformerDecoderLayer that returns attentions 
@@ -104,6 +166,33 @@ class MisoTransformerDecoderLayer(torch.nn.Module, Registrable):
     def forward(self, tgt, memory):
         pass 
 
+    # Whether the layer implements `one_step_forward` for incremental decoding.
+    supports_incremental_decoding = False
+
+    def project_memory(self, memory):
+        """
+        Project the source memory once for incremental decoding.
+        :param memory: [batch_size, source_seq_length, d_model].
+        :return: memory keys and values, each [batch_size, num_heads, source_seq_length + 1, head_dim];
+            the last position is the learned bias_k/bias_v, so padding masks need one extra column.
+        """
+        keys, values = _project_key_value(self.multihead_attn, memory)
+        return _append_bias_key_value(self.multihead_attn, keys, values)
+
+    def _self_attend_one_step(self, tgt, self_keys, self_values):
+        """
+        Attend from the newest position to itself and all cached previous positions.
+        :param tgt: [batch_size, 1, d_model], already normalized if pre-norm.
+        :param self_keys: [batch_size, num_heads, num_previous_steps, head_dim] or None.
+        :param self_values: [batch_size, num_heads, num_previous_steps, head_dim] or None.
+        """
+        keys, values = _project_key_value(self.self_attn, tgt)
+        if self_keys is not None:
+            keys = torch.cat([self_keys, keys], dim=2)
+            values = torch.cat([self_values, values], dim=2)
+        outputs = _attend_one_step(self.self_attn, tgt, *_append_bias_key_value(self.self_attn, keys, values))
+        return outputs, keys, values
+
 @MisoTransformerDecoderLayer.register("pre_norm") 
 class MisoPreNormTransformerDecoderLayer(MisoTransformerDecoderLayer):
     def __init__(self, 
@@ -164,6 +253,37 @@ class MisoPreNormTransformerDecoderLayer(MisoTransformerDecoderLayer):
 
         return tgt, tgt_attn, src_attn
 
+    supports_incremental_decoding = True
+
+    def one_step_forward(self, tgt, memory_keys, memory_values, self_keys, self_values,
+                         memory_key_padding_mask=None):
+        """
+        Run the layer on the newest position only, given cached keys and values.
+        :param tgt: [batch_size, 1, d_model] (batch-first).
+        :param memory_keys, memory_values: the outputs of `project_memory`; they may have
+            one row per group of consecutive rows of `tgt`, see `_attend_one_step`.
+        :param self_keys, self_values: cached self-attention keys and values of the previous
+            positions, [batch_size, num_heads, num_previous_steps, head_dim], or None at the first step.
+        :return: the new output [batch_size, 1, d_model], and the self-attention keys and values
+            extended with the newest position.
+        """
+        tgt2, self_keys, self_values = self._self_attend_one_step(self.norm1(tgt), self_keys, self_values)
+
+        tgt = tgt + self.dropout1(tgt2)
+
+        tgt = self.norm2(tgt)
+        tgt2 = _attend_one_step(self.multihead_attn, tgt, memory_keys, memory_values,
+                                key_padding_mask=memory_key_padding_mask)
+
+        tgt = tgt + self.dropout2(tgt2)
+
+        tgt = self.norm3(tgt)
+        tgt2 = self.linear2(self.dropout(F.relu(self.linear1(tgt))))
+
+        tgt = tgt + self.dropout3(tgt2)
+
+        return tgt, self_keys, self_values
+
 @MisoTransformerDecoderLayer.register("post_norm") 
 class MisoPostNormTransformerDecoderLayer(MisoTransformerDecoderLayer): 
     """
@@ -220,11 +340,39 @@ class MisoPostNormTransformerDecoderLayer(MisoTransformerDecoderLayer):
 
         return tgt, tgt_attn, src_attn
 
+    supports_incremental_decoding = True
+
+    def one_step_forward(self, tgt, memory_keys, memory_values, self_keys, self_values,
+                         memory_key_padding_mask=None):
+        """
+        See `MisoPreNormTransformerDecoderLayer.one_step_forward`.
+        """
+        tgt2, self_keys, self_values = self._self_attend_one_step(tgt, self_keys, self_values)
+
+        tgt = tgt + self.dropout1(tgt2)
+        tgt = self.norm1(tgt)
+
+        tgt2 = _attend_one_step(self.multihead_attn, tgt, memory_keys, memory_values,
+                                key_padding_mask=memory_key_padding_mask)
+
+        tgt = tgt + self.dropout2(tgt2)
+        tgt = self.norm2(tgt)
+
+        tgt2 = self.linear2(self.dropout(F.relu(self.linear1(tgt))))
+
+        tgt = tgt + self.dropout3(tgt2)
+        tgt = self.norm3(tgt)
+
+        return tgt, self_keys, self_values
+
 @MisoTransformerDecoderLayer.register("pre_norm_graph_positional") 
 class MisoGraphPositionalDecoderLayer(MisoPreNormTransformerDecoderLayer):
     """
     Modified TransformerDecoderLayer that with graph positional encoding
     """
+    # source attention depends on op_vec, which the incremental path does not support
+    supports_incremental_decoding = False
+
     def __init__(self, 
                 d_model, 
                 n_head, 
@@ -8,6 +8,7 @@ import numpy as np
 import torch
 import torch.nn.functional as F
 
+from allennlp.common.checks import ConfigurationError
 from allennlp.common.registrable import Registrable
 from allennlp.modules import InputVariationalDropout
 from allennlp.nn.util import add_positional_features
@@ -215,6 +216,127 @@ class MisoTransformerDecoder(MisoDecoder):
 
         return to_ret 
 
+    @property
+    def supports_incremental_decoding(self) -> bool:
+        return all(layer.supports_incremental_decoding for layer in self.layers)
+
+    def incremental_one_step_forward(self,
+                                     inputs: torch.Tensor,
+                                     source_memory_bank: torch.Tensor,
+                                     source_mask: torch.Tensor,
+                                     cache: Dict[str, torch.Tensor],
+                                     decoding_step: int = 0,
+                                     total_decoding_steps: int = 0) -> Dict:
+        """
+        Run a single step decoding on the newest position only, reusing per-layer self-attention
+        keys/values and projected source-memory keys/values from the previous steps.
+        Gives the same outputs as `one_step_forward` over the full input history.
+        :param inputs: [batch_size, 1, input_vector_dim], the input of the current step only.
+        :param source_memory_bank: [batch_size, source_seq_length, source_vector_dim], or one row
+            per group of consecutive rows of `inputs`, e.g. per instance during beam search.
+        :param source_mask: [batch_size, source_seq_length], or one row per group like the memory bank.
+        :param cache: the "cache" returned by the previous step, or an empty dict at the first step.
+            Every tensor in it has batch_size as its first dimension, so it can be reindexed
+            along with the rest of the beam search state, except for the projected source memory
+            ("memory_keys_*" and "memory_values_*"), which has the rows of `source_memory_bank`.
+        :param decoding_step: index of the current decoding step.
+        :param total_decoding_steps: the total number of decoding steps.
+        :return:
+        """
+        if not self.supports_incremental_decoding:
+            raise ConfigurationError("{} layers do not support incremental decoding".format(
+                type(self.layers[0]).__name__))
+
+        batch_size = inputs.size(0)
+        source_batch_size, source_seq_length, _ = source_memory_bank.size()
+
+        source_padding_mask = None
+        if source_mask is not None:
+            source_padding_mask = ~source_mask.bool()
+            # one more column for the bias_k/bias_v position
+            source_padding_mask = torch.cat(
+                [source_padding_mask, source_padding_mask.new_zeros((source_batch_size, 1))], dim=1)
+
+        # project to correct dimensionality
+        output = self.input_proj_layer(inputs)
+        # add the positional encoding of the current position
+        output = output + add_positional_features(
+            output.new_zeros((1, decoding_step + 1, output.size(2))))[:, -1:]
+
+        new_cache = {}
+        for i, layer in enumerate(self.layers):
+            if "memory_keys_{}".format(i) in cache:
+                memory_keys = cache["memory_keys_{}".format(i)]
+                memory_values = cache["memory_values_{}".format(i)]
+            else:
+                memory_keys, memory_values = layer.project_memory(source_memory_bank)
+            output, self_keys, self_values = layer.one_step_forward(
+                output,
+                memory_keys,
+                memory_values,
+                cache.get("self_keys_{}".format(i), None),
+                cache.get("self_values_{}".format(i), None),
+                memory_key_padding_mask=source_padding_mask
+            )
+            new_cache["memory_keys_{}".format(i)] = memory_keys
+            new_cache["memory_values_{}".format(i)] = memory_values
+            new_cache["self_keys_{}".format(i)] = self_keys
+            new_cache["self_values_{}".format(i)] = self_values
+
+        # do final norm here
+        if self.prenorm:
+            output = self.final_norm(output)
+
+        # [batch_size, decoding_step + 1, hidden_dim]
+        outputs = output if "outputs" not in cache else torch.cat([cache["outputs"], output], dim=1)
+        new_cache["outputs"] = outputs
+
+        # the source attention layer broadcasts a shared row of source memory over its group
+        if not self.use_coverage:
+            source_attention_output = self.source_attn_layer(output,
+                                                             source_memory_bank,
+                                                             source_mask,
+                                                             None)
+            coverage = None
+        else:
+            coverage = cache.get("coverage", None)
+            if coverage is None:
+                coverage = inputs.new_zeros(size=(batch_size, 1, source_seq_length))
+            source_attention_output = self.source_attn_layer(output,
+                                                             source_memory_bank,
+                                                             source_mask,
+                                                             coverage)
+            coverage = source_attention_output['coverage']
+            new_cache["coverage"] = coverage
+
+        attentional_tensor = self.dropout(source_attention_output['attentional'])
+
+        if decoding_step == 0:
+            # nothing to copy yet
+            target_attention_weights = attentional_tensor.new_zeros((batch_size, 1, 1))
+        else:
+            attn_mask = attentional_tensor.new_ones((batch_size, decoding_step + 1))
+            attn_mask[:, decoding_step:] = 0
+            target_attention_weights = self.target_attn_layer(attentional_tensor,
+                                                              outputs,
+                                                              mask = attn_mask)['attention_weights']
+
+        # pad attention weights
+        if total_decoding_steps != 1:
+            target_attention_weights = F.pad(target_attention_weights,
+                                             [0, total_decoding_steps - target_attention_weights.shape[2]],
+                                             "constant", 0)
+
+        return dict(
+                output=output,
+                attentional_tensor=attentional_tensor,
+                target_attention_weights=target_attention_weights,
+                source_attention_weights=source_attention_output['attention_weights'],
+                # same layout as `one_step_forward`: [batch_size, source_seq_length, 1]
+                coverage=coverage.transpose(1, 2) if coverage is not None else None,
+                cache=new_cache,
+                )
+
     def make_autoregressive_mask(self,
                                  size: int):
         mask = (torch.triu(torch.ones(size, size)) == 1).transpose(0, 1)
@@ -274,6 +396,11 @@ class MisoPositionalTransformerDecoder(MisoTransformerDecoder):
         self.prenorm = True
         self.final_norm = copy.deepcopy(decoder_layer.norm4)
 
+    @property
+    def supports_incremental_decoding(self) -> bool:
+        # source attention is conditioned on op_vec
+        return False
+
     @overrides
     def forward(self,
                 inputs: torch.Tensor,
@@ -6,6 +6,8 @@ from allennlp.common.registrable import Registrable
 
 
 class ExtendedPointerGenerator(torch.nn.Module, Registrable):
+    # copy attention with an index scatter-add rather than a bmm with one-hot maps
+    use_scatter = True
 
     def __init__(self,
                  input_vector_dim: int,
@@ -36,62 +38,102 @@ class ExtendedPointerGenerator(torch.nn.Module, Registrable):
                 source_attention_weights: Optional[torch.Tensor] = None,
                 source_attention_map: Optional[torch.Tensor] = None,
                 target_attention_weights: Optional[torch.Tensor] = None,
-                target_attention_map: Optional[torch.Tensor] = None) -> Dict[str, torch.Tensor]:
+                target_attention_map: Optional[torch.Tensor] = None,
+                source_dynamic_vocab_size: Optional[int] = None,
+                target_dynamic_vocab_size: Optional[int] = None,
+                eps: Optional[float] = None) -> Dict[str, torch.Tensor]:
         """
-        Compute a distribution over the target dictionary
+        Compute a log-probability distribution over the target dictionary
         extended by the dynamic dictionary implied by copying target nodes.
 
         :param inputs: [batch_size, target_length, input_vector_dim]
         :param source_attention_weights: attention of each source token,
             [batch_size, target_length, source_length].
-        :param source_attention_map: a sparse indicator matrix
-            mapping each source token to its index in the dynamic vocabulary.
-            [batch_size, source_length, source_dynamic_vocab_size]
+        :param source_attention_map: the index of each source token in the
+            dynamic vocabulary, -1 for tokens without one (e.g. padding).
+            [batch_size, source_length], or one row per group of consecutive rows
+            of `inputs`, e.g. per instance during beam search.
         :param target_attention_weights: attention of each target token,
             [batch_size, target_length, target_length]
-        :param target_attention_map: a sparse indicator matrix
-            mapping each target token to its index in the dynamic vocabulary.
-            [batch_size, target_length, target_dynamic_vocab_size]
-        :return hybrid_prob_dist: [batch_size, target_length, final_vocab_size].
+        :param target_attention_map: the index of each target token in the
+            dynamic vocabulary, -1 for tokens without one.
+            [batch_size, target_length]
+        :param source_dynamic_vocab_size: int.
+        :param target_dynamic_vocab_size: int.
+        :param eps: added to the probabilities before the log, so that
+            dynamic vocabulary slots that nothing is copied to stay finite.
+        :return hybrid_log_prob_dist: log(probability + eps),
+            [batch_size, target_length, final_vocab_size].
         """
-        hybrid_prob_dist = []
-        batch_size, target_length, _ = inputs.size()
+        if eps is None:
+            eps = self._eps
 
         # Soft switch: [batch_size, target_length, num_switches].
         p = torch.nn.functional.softmax(self.switch_linear(inputs), dim=2)
 
-        generation_switch = p[:, :, 0].unsqueeze(2)
-
-        if self._source_copy:
-            source_copy_switch = p[:, :, 1].unsqueeze(2) 
-        if self._target_copy:
-            target_copy_switch = p[:, :, 2].unsqueeze(2) 
-
         # Vocab generation.
         # [batch_size, target_length, vocab_size]
         scores = self.vocab_linear(inputs)
         scores[:, :, self._vocab_pad_index] = -float('inf')
         vocab_prob_dist = torch.nn.functional.softmax(scores, dim=2)
-        vocab_prob_part = torch.mul(vocab_prob_dist, generation_switch.expand_as(vocab_prob_dist))
-        hybrid_prob_dist.append(vocab_prob_part)
+        hybrid_prob_dist = [vocab_prob_dist * p[:, :, :1]]
 
         # Source-side copy.
         if self._source_copy:
             # [batch_size, target_length, source_dynamic_vocab_size]
-            source_copy_prob_dist = torch.bmm(source_attention_weights, source_attention_map.float())
-            source_copy_prob_part = torch.mul(
-                source_copy_prob_dist, source_copy_switch.expand_as(source_copy_prob_dist)
-            )
-            hybrid_prob_dist.append(source_copy_prob_part)
+            hybrid_prob_dist.append(self._copy_prob_dist(
+                source_attention_weights, source_attention_map, source_dynamic_vocab_size, p[:, :, 1:2]))
 
         # Target-side copy.
         if self._target_copy:
             # [batch_size, target_length, target_dymanic_vocab_size]
-            target_copy_prob_dist = torch.bmm(target_attention_weights, target_attention_map.float())
-            target_copy_prob_part = torch.mul(
-                target_copy_prob_dist, target_copy_switch.expand_as(target_copy_prob_dist)
-            )
-            hybrid_prob_dist.append(target_copy_prob_part)
+            hybrid_prob_dist.append(self._copy_prob_dist(
+                target_attention_weights, target_attention_map, target_dynamic_vocab_size, p[:, :, 2:3]))
+
+        hybrid_log_prob_dist = torch.cat(hybrid_prob_dist, dim=2).add_(eps).log_()
+        return {"hybrid_log_prob_dist": hybrid_log_prob_dist}
+
+    def _copy_prob_dist(self,
+                        attention_weights: torch.Tensor,
+                        attention_map: torch.Tensor,
+                        dynamic_vocab_size: int,
+                        copy_switch: torch.Tensor) -> torch.Tensor:
+        """
+        Sum the attention of the tokens copied to each dynamic vocabulary slot.
+
+        :param attention_weights: [batch_size, target_length, length].
+        :param attention_map: [batch_size, length], the slot of each token, -1 if none, or
+            [map_batch_size, length] with one row per group of consecutive rows of the
+            weights, where map_batch_size divides batch_size.
+        :param dynamic_vocab_size: int.
+        :param copy_switch: [batch_size, target_length, 1].
+        :return: [batch_size, target_length, dynamic_vocab_size].
+        """
+        batch_size, target_length, length = attention_weights.size()
+        map_batch_size = attention_map.size(0)
+        # the extra last slot collects the attention of tokens that are not copied anywhere
+        slots = attention_map.masked_fill(attention_map.lt(0), dynamic_vocab_size)
+        if not self.use_scatter:
+            one_hot = slots_to_attention_map(slots, dynamic_vocab_size + 1)
+            # [map_batch_size, batch_size // map_batch_size * target_length, length]: the rows of
+            # a group share the one-hot map of their row
+            copy_prob_dist = torch.bmm(attention_weights.reshape(map_batch_size, -1, length),
+                                       one_hot.type_as(attention_weights))
+            copy_prob_dist = copy_prob_dist.view(batch_size, target_length, dynamic_vocab_size + 1)
+            return copy_prob_dist[:, :, :dynamic_vocab_size] * copy_switch
+
+        weights = (attention_weights * copy_switch).view(map_batch_size, -1, length)
+        copy_prob_dist = weights.new_zeros(map_batch_size, weights.size(1), dynamic_vocab_size + 1)
+        copy_prob_dist.scatter_add_(2, slots.unsqueeze(1).expand_as(weights), weights)
+        copy_prob_dist = copy_prob_dist.view(batch_size, target_length, dynamic_vocab_size + 1)
+        return copy_prob_dist[:, :, :dynamic_vocab_size]
 
 
-        return {"hybrid_prob_dist": torch.cat(hybrid_prob_dist, dim=2)}
+def slots_to_attention_map(slots: torch.Tensor, dynamic_vocab_size: int) -> torch.Tensor:
+    """
+    :param slots: [batch_size, length], the dynamic vocabulary slot of each token.
+    :param dynamic_vocab_size: int, larger than every slot.
+    :return: [batch_size, length, dynamic_vocab_size], one-hot indicators of the slots.
+    """
+    attention_map = slots.new_zeros(slots.size(0), slots.size(1), dynamic_vocab_size)
+    return attention_map.scatter_(2, slots.unsqueeze(2), 1)
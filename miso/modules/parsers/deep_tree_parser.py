@@ -1,4 +1,5 @@
 from typing import Tuple, Dict, Optional
+from concurrent.futures import ThreadPoolExecutor
 from overrides import overrides
 import numpy as np 
 np.set_printoptions(precision=2, linewidth=300) 
@@ -21,7 +22,8 @@ class DeepTreeParser(torch.nn.Module, Registrable):
                  attention: Attention,
                  num_labels: int = 0,
                  dropout: float = 0.0,
-                 is_syntax: bool = False) -> None:
+                 is_syntax: bool = False,
+                 mst_num_workers: int = 0) -> None:
         super().__init__()
         self.edge_head_query_linear = torch.nn.Linear(query_vector_dim, edge_head_vector_dim)
         self.edge_head_key_linear = torch.nn.Linear(key_vector_dim, edge_head_vector_dim)
@@ -41,6 +43,8 @@ class DeepTreeParser(torch.nn.Module, Registrable):
         self._query_vector_dim = query_vector_dim
         self._key_vector_dim = key_vector_dim
         self._edge_type_vector_dim = edge_type_vector_dim
+        # threads for the instances whose MST needs cycle contraction
+        self._mst_num_workers = mst_num_workers
 
     def reset_edge_type_bilinear(self, num_labels: int) -> None:
         self.edge_type_bilinear = torch.nn.Bilinear(self._edge_type_vector_dim, self._edge_type_vector_dim, num_labels)
@@ -84,7 +88,7 @@ class DeepTreeParser(torch.nn.Module, Registrable):
 
         batch_energy = batch_energy.permute(0,1,3,2) 
         lengths += 1
-        edge_heads, edge_labels = self._run_mst_decoding(batch_energy, lengths)
+        edge_heads, edge_labels = self._run_mst_decoding(batch_energy, lengths, self._mst_num_workers)
 
         #edge_heads[edge_heads == 0] = -1
         #if not self.is_syntax: 
@@ -125,44 +129,103 @@ class DeepTreeParser(torch.nn.Module, Registrable):
         return energy
 
     @staticmethod
-    def _run_mst_decoding(batch_energy, lengths):
-        edge_heads = []
-        edge_labels = []
-
-        for i, (energy, length) in enumerate(zip(batch_energy.detach().cpu(), lengths)):
-            # decode heads and labels 
-            # need to decode labels separately so that we can enforce single root 
-            scores, label_ids = energy.max(dim=0)
-            energy = scores
-
-            instance_heads, instance_head_labels = decode_mst(energy.numpy(), length, has_labels=False)
-            #instance_heads, instance_head_labels = decode_mst(scores.numpy(), length, has_labels=True)
-
-            ## Find the labels which correspond to the edges in the max spanning tree.
-            instance_head_labels = []
-            for child, parent in enumerate(instance_heads):
-                instance_head_labels.append(label_ids[parent, child].item())
-            
-            # check for multiroot
-            multi_root = sum([1 if h == 0 else 0 for h in instance_heads[0:length]]) > 1
-
-            if multi_root: 
-                energy = energy.unsqueeze(0)
-                energy = DeepTreeParser._enforce_root(energy) 
-                energy = energy.squeeze(0) 
-                instance_heads, instance_head_labels = decode_mst(energy.numpy(), length, has_labels=False)
-                #instance_heads, instance_head_labels = decode_mst(scores.numpy(), length, has_labels=True)
-
-                ## Find the labels which correspond to the edges in the max spanning tree.
-                instance_head_labels = []
-                for child, parent in enumerate(instance_heads):
-                    instance_head_labels.append(label_ids[parent, child].item())
-
-
-            edge_heads.append(instance_heads)
-            edge_labels.append(instance_head_labels)
-
-        return torch.from_numpy(np.stack(edge_heads)), torch.from_numpy(np.stack(edge_labels))
+    def _greedy_heads(scores, lengths):
+        """
+        Pick the best incoming edge of every node, breaking ties the same way as
+        `chu_liu_edmonds` (the lowest head index wins), and check for cycles.
+        :param scores: [batch_size, seq_len(head), seq_len(child)] numpy array.
+        :param lengths: [batch_size] numpy array.
+        :return:
+            heads: [batch_size, seq_len], -1 for the root and 0 for padding, as in `decode_mst`.
+            has_cycle: [batch_size].
+        """
+        batch_size, seq_len, _ = scores.shape
+        positions = np.arange(seq_len)
+        # [batch_size, seq_len]
+        valid = positions[None, :] < lengths[:, None]
+
+        candidates = np.where(valid[:, :, None], scores, -np.inf)
+        candidates[:, positions, positions] = -np.inf
+        heads = np.where(valid, candidates.argmax(axis=1), 0)
+
+        # Follow heads by pointer doubling; the root and padding point to the root,
+        # so only nodes on (or hanging off) a cycle never reach it.
+        ancestors = heads.copy()
+        ancestors[:, 0] = 0
+        for _ in range(int(np.ceil(np.log2(max(seq_len, 2))))):
+            ancestors = np.take_along_axis(ancestors, ancestors, axis=1)
+        has_cycle = ((ancestors != 0) & valid).any(axis=1)
+
+        heads[:, 0] = -1
+        return heads, has_cycle
+
+    @staticmethod
+    def _batched_mst(scores, lengths, num_workers: int = 0):
+        """
+        Maximum spanning trees for a batch. The best-incoming-edge graph is the MST whenever
+        it has no cycle, which is checked for all instances at once; only instances with a
+        cycle go through `decode_mst`, optionally on a thread pool.
+        :param scores: [batch_size, seq_len(head), seq_len(child)] numpy array.
+        :param lengths: [batch_size] numpy array.
+        :return: heads, [batch_size, seq_len].
+        """
+        heads, has_cycle = DeepTreeParser._greedy_heads(scores, lengths)
+        cyclic = np.nonzero(has_cycle)[0].tolist()
+
+        def decode(i):
+            instance_heads, _ = decode_mst(scores[i].copy(), lengths[i], has_labels=False)
+            return instance_heads
+
+        if num_workers > 1 and len(cyclic) > 1:
+            with ThreadPoolExecutor(max_workers=num_workers) as executor:
+                cyclic_heads = list(executor.map(decode, cyclic))
+        else:
+            cyclic_heads = [decode(i) for i in cyclic]
+
+        for i, instance_heads in zip(cyclic, cyclic_heads):
+            heads[i] = instance_heads
+        return heads
+
+    @staticmethod
+    def _run_mst_decoding(batch_energy, lengths, num_workers: int = 0):
+        """
+        Decode heads and labels for the whole batch. Gives the same output as running
+        `decode_mst` per instance, and again after `_enforce_root` when the root has more than
+        one child.
+        :param batch_energy: [batch_size, num_labels, seq_len(head), seq_len(child)].
+        :param lengths: [batch_size] numpy array, including the root.
+        :param num_workers: threads for instances that need cycle contraction.
+        :return:
+            edge_heads: [batch_size, seq_len].
+            edge_labels: [batch_size, seq_len].
+        """
+        # decode heads and labels separately so that we can enforce single root 
+        scores, label_ids = batch_energy.detach().cpu().max(dim=1)
+        scores = scores.numpy()
+        label_ids = label_ids.numpy()
+        lengths = np.asarray(lengths)
+        batch_size, seq_len, _ = scores.shape
+        valid = np.arange(seq_len)[None, :] < lengths[:, None]
+
+        heads = DeepTreeParser._batched_mst(scores, lengths, num_workers)
+
+        # check for multiroot
+        multi_root = np.nonzero(((heads == 0) & valid).sum(axis=1) > 1)[0]
+        if len(multi_root) > 0:
+            # Same as `_enforce_root`: keep only the best edge out of the root.
+            energy = scores[multi_root]
+            rows = np.arange(len(multi_root))
+            root_children = energy[:, 0, 1:].argmax(axis=1) + 1
+            root_scores = energy[rows, 0, root_children]
+            energy[:, 0, 1:] = -1e8
+            energy[rows, 0, root_children] = root_scores
+            heads[multi_root] = DeepTreeParser._batched_mst(energy, lengths[multi_root], num_workers)
+
+        ## Find the labels which correspond to the edges in the max spanning tree.
+        # (the root's head is -1, which indexes the last row like the per-instance lookup did)
+        labels = label_ids[np.arange(batch_size)[:, None], heads, np.arange(seq_len)[None, :]]
+
+        return torch.from_numpy(heads.astype(np.int32)), torch.from_numpy(labels.astype(np.int64))
 
     @overrides
     def forward(self,
@@ -40,6 +40,7 @@ class StackedLstm(torch.nn.Module, Registrable):
         self.hidden_size = hidden_size
         self.num_layers = num_layers
         self.bidirectional = False
+        self.recurrent_dropout_probability = recurrent_dropout_probability
 
         layers = []
         lstm_input_size = input_size
@@ -56,6 +57,16 @@ class StackedLstm(torch.nn.Module, Registrable):
 
         self.lstm_layers = layers
 
+    def _initial_states(self, initial_state):
+        if not initial_state:
+            return [None] * len(self.lstm_layers)
+        elif initial_state[0].size()[0] != len(self.lstm_layers):
+            raise ConfigurationError("Initial states were passed to forward() but the number of "
+                                     "initial states does not match the number of layers.")
+        else:
+            return list(zip(initial_state[0].split(1, 0),
+                            initial_state[1].split(1, 0)))
+
     def forward(self,  # pylint: disable=arguments-differ
                 inputs: PackedSequence,
                 initial_state: Optional[Tuple[torch.Tensor, torch.Tensor]] = None):
@@ -75,14 +86,7 @@ class StackedLstm(torch.nn.Module, Registrable):
             The per-layer final (state, memory) states of the LSTM, each with shape
             (num_layers, batch_size, hidden_size).
         """
-        if not initial_state:
-            hidden_states = [None] * len(self.lstm_layers)
-        elif initial_state[0].size()[0] != len(self.lstm_layers):
-            raise ConfigurationError("Initial states were passed to forward() but the number of "
-                                     "initial states does not match the number of layers.")
-        else:
-            hidden_states = list(zip(initial_state[0].split(1, 0),
-                                     initial_state[1].split(1, 0)))
+        hidden_states = self._initial_states(initial_state)
 
         output_sequence = inputs
         final_states = []
@@ -94,3 +98,79 @@ class StackedLstm(torch.nn.Module, Registrable):
 
         final_state_tuple = [torch.cat(state_list, 0) for state_list in zip(*final_states)]
         return output_sequence, final_state_tuple
+
+    def can_step(self) -> bool:
+        """
+        Whether ``step`` gives the same outputs as ``forward`` on a length-1 sequence,
+        i.e. no recurrent dropout mask is sampled.
+        """
+        return not self.training or self.recurrent_dropout_probability == 0.0
+
+    def step(self,
+             inputs: torch.Tensor,
+             initial_state: Optional[Tuple[torch.Tensor, torch.Tensor]] = None):
+        """
+        Run all layers for a single timestep on plain tensors, without packing.
+        Parameters
+        ----------
+        inputs : torch.Tensor, required.
+            The inputs of the timestep, of shape (batch_size, input_size).
+        initial_state : Tuple[torch.Tensor, torch.Tensor], optional, (default = None)
+            As in ``forward``, each tensor of shape (num_layers, batch_size, hidden_size).
+        Returns
+        -------
+        output : torch.Tensor
+            The output of the last layer, of shape (batch_size, hidden_size).
+        final_states: Tuple[torch.Tensor, torch.Tensor]
+            The per-layer (state, memory) after the timestep, as in ``forward``.
+        """
+        hidden_states = self._initial_states(initial_state)
+
+        output = inputs
+        final_states = []
+        for i, state in enumerate(hidden_states):
+            layer = getattr(self, 'layer_{}'.format(i))
+            if state is None:
+                previous_state = output.new_zeros(output.size(0), self.hidden_size)
+                previous_memory = output.new_zeros(output.size(0), self.hidden_size)
+            else:
+                previous_state, previous_memory = state[0].squeeze(0), state[1].squeeze(0)
+            output, memory = augmented_lstm_step(layer, output, previous_state, previous_memory)
+            final_states.append((output, memory))
+
+        final_state_tuple = tuple(torch.stack(state_list, 0) for state_list in zip(*final_states))
+        return output, final_state_tuple
+
+
+def augmented_lstm_step(layer: AugmentedLstm,
+                        inputs: torch.Tensor,
+                        previous_state: torch.Tensor,
+                        previous_memory: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    One timestep of an ``AugmentedLstm`` layer without recurrent dropout, the same
+    computation as its ``forward`` with the gate nonlinearities applied to all gates at once.
+
+    :param inputs: [batch_size, input_size].
+    :param previous_state: [batch_size, hidden_size].
+    :param previous_memory: [batch_size, hidden_size].
+    :return: the (state, memory) after the timestep, each [batch_size, hidden_size].
+    """
+    hidden_size = layer.hidden_size
+    projected_input = layer.input_linearity(inputs)
+    projected_state = layer.state_linearity(previous_state)
+    # [batch_size, (4 or 5) * hidden_size]: input, forget, memory, output (and highway) gates
+    gates = projected_input[:, :projected_state.size(1)] + projected_state
+    sigmoid_gates = torch.sigmoid(gates)
+
+    input_gate = sigmoid_gates[:, 0 * hidden_size:1 * hidden_size]
+    forget_gate = sigmoid_gates[:, 1 * hidden_size:2 * hidden_size]
+    memory_init = torch.tanh(gates[:, 2 * hidden_size:3 * hidden_size])
+    output_gate = sigmoid_gates[:, 3 * hidden_size:4 * hidden_size]
+    memory = input_gate * memory_init + forget_gate * previous_memory
+    output = output_gate * torch.tanh(memory)
+
+    if layer.use_highway:
+        highway_gate = sigmoid_gates[:, 4 * hidden_size:5 * hidden_size]
+        highway_input_projection = projected_input[:, 5 * hidden_size:6 * hidden_size]
+        output = highway_gate * output + (1 - highway_gate) * highway_input_projection
+    return output, memory
@@ -1,4 +1,4 @@
-from typing import List, Callable, Tuple, Dict, Any
+from typing import List, Callable, Tuple, Dict, Any, Iterable, Optional
 import warnings
 
 import torch
@@ -12,6 +12,22 @@ AuxiliaryType = Dict[str, List[Any]]  # pylint: disable=invalid-name
 StepFunctionType = Callable[[torch.Tensor, StateType, AuxiliaryType], Tuple[torch.Tensor, StateType, AuxiliaryType]]  # pylint: disable=invalid-name
 
 
+def expand_to_group(state_tensor: torch.Tensor, group_size: int) -> torch.Tensor:
+    """
+    Repeat each row of a beam invariant state tensor for the hypotheses of its batch
+    element, which are consecutive in the group.
+    :param state_tensor: [batch_size, *], or already [group_size, *].
+    :return: [group_size, *].
+    """
+    batch_size, *last_dims = state_tensor.size()
+    if batch_size == group_size:
+        return state_tensor
+    return state_tensor.\
+            unsqueeze(1).\
+            expand(batch_size, group_size // batch_size, *last_dims).\
+            reshape(group_size, *last_dims)
+
+
 class BeamSearch:
     """
     Implements the beam search algorithm for decoding the most likely sequences.
@@ -31,17 +47,27 @@ class BeamSearch:
         to a number smaller than ``beam_size`` may give better results, as it can introduce
         more diversity into the search. See `Beam Search Strategies for Neural Machine Translation.
         Freitag and Al-Onaizan, 2017 <https://arxiv.org/abs/1702.01806>`_.
+    compact_finished : ``bool``, optional (default = False)
+        Drop a batch element from the state and auxiliaries passed to ``step`` once all of its
+        beams have predicted the end token, so later steps only run on unfinished elements.
+        The step function must then find the batch element of each hypothesis from the state
+        (e.g. a ``(batch_size,)`` index tensor in ``start_state``) rather than from its position
+        in the group. The outputs of a finished element are the same up to its end tokens;
+        after them its tracked states are zeros, and its auxiliaries are the ones it had when
+        it finished, scattered back into place at the end of the search.
     """
 
     def __init__(self,
                  end_index: int,
                  max_steps: int = 50,
                  beam_size: int = 10,
-                 per_node_beam_size: int = None) -> None:
+                 per_node_beam_size: int = None,
+                 compact_finished: bool = False) -> None:
         self._end_index = end_index
         self.max_steps = max_steps
         self.beam_size = beam_size
         self.per_node_beam_size = per_node_beam_size or beam_size
+        self.compact_finished = compact_finished
 
     def search(self,
                start_predictions: torch.Tensor,
@@ -49,7 +75,9 @@ class BeamSearch:
                auxiliaries: AuxiliaryType,
                step: StepFunctionType,
                tracked_state_name: str,
-               tracked_auxiliary_name: str) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, List[List[Any]]]:
+               tracked_auxiliary_name: Optional[str],
+               beam_invariant_state_names: Iterable[str] = ()
+               ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, List[List[Any]]]:
         """
         Given a starting state and a step function, apply beam search to find the
         most likely target sequences.
@@ -84,16 +112,30 @@ class BeamSearch:
             of shape ``(group_size,)``, representing the index of the predicted
             tokens from the last time step, and the second being the current state.
             The ``group_size`` will be ``batch_size * beam_size``, except in the initial
-            step, for which it will just be ``batch_size``.
+            step, for which it will just be ``batch_size``, and with ``compact_finished``,
+            for which it is ``beam_size`` times the number of unfinished batch elements.
             The function is expected to return a tuple, where the first element
             is a tensor of shape ``(group_size, target_vocab_size)`` containing
             the log probabilities of the tokens for the next step, and the second
             element is the updated state. The tensor in the state should have shape
-            ``(group_size, *)``, where ``*`` means any other number of dimensions.
+            ``(group_size, *)``, where ``*`` means any other number of dimensions, except for
+            the ``beam_invariant_state_names``.
+            A hypothesis whose last prediction is the end token is forced to predict it again,
+            so ``step`` may skip computing its log probabilities (any value is ignored); its
+            state must still be updated, since it is part of the tracked states.
         tracked_state_name: ``str``
             The tracked state name.
-        tracked_auxiliary_name: ``str``
-            The tracked auxiliary name.
+        tracked_auxiliary_name: ``Optional[str]``
+            The tracked auxiliary name. If None, no auxiliaries are tracked and
+            ``tracked_auxiliaries`` is None.
+        beam_invariant_state_names: ``Iterable[str]``, optional (default = ())
+            Names of state entries that are the same for every beam of a batch element and
+            that ``step`` never updates, e.g. the source memory bank. They keep their
+            ``(batch_size, *)`` shape at every step instead of being expanded to the beam and
+            reindexed by the backpointers, so ``step`` must broadcast them to the group where
+            it uses them, e.g. by viewing the group as ``(batch_size, beam_size, *)``. ``step``
+            may also replace them once with their ``(group_size, *)`` ``expand_to_group``,
+            which is never reindexed either.
 
         Returns
         -------
@@ -113,6 +155,7 @@ class BeamSearch:
         tracked_states: List[torch.Tensor] = []
         # A 2d array: (beam_size, batch_size)
         tracked_auxiliaries: List[List[Any]] = [[None for _ in range(batch_size)] for _ in range(self.beam_size)]
+        beam_invariant_state_names = set(beam_invariant_state_names)
 
         # List of (batch_size, beam_size) tensors. One for each time step. None for
         # the first.  Stores the index n for the parent prediction, i.e.
@@ -157,6 +200,8 @@ class BeamSearch:
 
         # Set the same state for each element in the beam.
         for key, state_tensor in state.items():
+            if key in beam_invariant_state_names:
+                continue
             _, *last_dims = state_tensor.size()
             # shape: (batch_size * beam_size, *)
             state[key] = state_tensor.\
@@ -179,34 +224,82 @@ class BeamSearch:
             warnings.warn("Empty sequences predicted. You may want to increase the beam size or ensure "
                           "your step function is working properly.",
                           RuntimeWarning)
-            # shape: (batch_size * beam_size)
-            tracked_auxiliary = auxiliaries[tracked_auxiliary_name]
-            # shape: (batch_size, beam_size)
-            for beam_index in range(self.beam_size):
-                for i in range(beam_index, len(tracked_auxiliary), self.beam_size):
-                    tracked_auxiliaries[beam_index][i // self.beam_size] = tracked_auxiliary[i]
+            if tracked_auxiliary_name is None:
+                tracked_auxiliaries = None
+            else:
+                # shape: (batch_size * beam_size)
+                tracked_auxiliary = auxiliaries[tracked_auxiliary_name]
+                # shape: (batch_size, beam_size)
+                for beam_index in range(self.beam_size):
+                    for i in range(beam_index, len(tracked_auxiliary), self.beam_size):
+                        tracked_auxiliaries[beam_index][i // self.beam_size] = tracked_auxiliary[i]
             return (start_predicted_classes.unsqueeze(-1),
                     tracked_states[-1].unsqueeze(2),
                     start_top_log_probabilities,
                     tracked_auxiliaries)
 
-        for timestep in range(self.max_steps - 1):
-            # shape: (batch_size * beam_size,)
-            last_predictions = predictions[-1].reshape(batch_size * self.beam_size)
+        # shape: (batch_size, 1)
+        group_offsets = (torch.arange(batch_size, device=start_predictions.device) * self.beam_size).unsqueeze(1)
+        # The batch elements still in the state and auxiliaries passed to `step`.
+        # shape: (num_active,)
+        active = torch.arange(batch_size, device=start_predictions.device)
+        # shape: (beam_size,)
+        beam_indices = torch.arange(self.beam_size, device=start_predictions.device)
+        # The auxiliaries of the elements that were compacted out, at their place in the full group.
+        finished_auxiliaries: Dict[str, List[Any]] = {
+                key: [None] * (batch_size * self.beam_size) for key in auxiliaries}
 
+        for timestep in range(self.max_steps - 1):
             # If every predicted token from the last step is `self._end_index`,
             # then we can stop early.
-            if (last_predictions == self._end_index).all():
+            if (predictions[-1] == self._end_index).all():
                 break
 
+            if self.compact_finished:
+                # An element is finished once all of its beams have predicted the end token;
+                # from then on beam search would only extend each beam with the end token
+                # and keep the beam order, unless some beam has -inf log probability.
+                # shape: (num_active,)
+                finished = ((predictions[-1][active] == self._end_index).all(1) &
+                            torch.isfinite(last_log_probabilities[active]).all(1))
+                if finished.any():
+                    num_active = active.size(0)
+                    for position in finished.nonzero().view(-1).tolist():
+                        batch_index = active[position].item()
+                        for key, aux in auxiliaries.items():
+                            finished_auxiliaries[key][batch_index * self.beam_size:(batch_index + 1) * self.beam_size] = \
+                                    aux[position * self.beam_size:(position + 1) * self.beam_size]
+
+                    # shape: (num_unfinished,)
+                    unfinished = (~finished).nonzero().view(-1)
+                    # shape: (num_unfinished * beam_size,)
+                    group_indices = (unfinished.unsqueeze(1) * self.beam_size + beam_indices).view(-1)
+                    for key, state_tensor in state.items():
+                        if key in beam_invariant_state_names and state_tensor.size(0) == num_active:
+                            # one row per batch element
+                            state[key] = state_tensor.index_select(0, unfinished)
+                        else:
+                            state[key] = state_tensor.index_select(0, group_indices)
+                    for key, aux in auxiliaries.items():
+                        auxiliaries[key] = [aux[index] for index in group_indices.tolist()]
+                    active = active[unfinished]
+
+            num_active = active.size(0)
+
+            # shape: (num_active * beam_size,)
+            if num_active == batch_size:
+                last_predictions = predictions[-1].reshape(batch_size * self.beam_size)
+            else:
+                last_predictions = predictions[-1][active].reshape(num_active * self.beam_size)
+
             # Take a step. This get the predicted log probs of the next classes
             # and updates the state.
-            # shape: (batch_size * beam_size, num_classes)
+            # shape: (num_active * beam_size, num_classes)
             class_log_probabilities, state, auxiliaries = step(last_predictions, state, auxiliaries)
 
-            # shape: (batch_size * beam_size, num_classes)
+            # shape: (num_active * beam_size, num_classes)
             last_predictions_expanded = last_predictions.unsqueeze(-1).expand(
-                    batch_size * self.beam_size,
+                    num_active * self.beam_size,
                     num_classes
             )
 
@@ -214,86 +307,111 @@ class BeamSearch:
             # the previous timestep and replacing the distribution with a
             # one-hot distribution, forcing the beam to predict the end token
             # this timestep as well.
-            # shape: (batch_size * beam_size, num_classes)
+            # shape: (num_active * beam_size, num_classes)
             cleaned_log_probabilities = torch.where(
                     last_predictions_expanded == self._end_index,
-                    log_probs_after_end,
+                    log_probs_after_end[:num_active * self.beam_size],
                     class_log_probabilities
             )
 
-            # shape (both): (batch_size * beam_size, per_node_beam_size)
+            # shape (both): (num_active * beam_size, per_node_beam_size)
             top_log_probabilities, predicted_classes = \
                 cleaned_log_probabilities.topk(self.per_node_beam_size)
 
-            # Here we expand the last log probabilities to (batch_size * beam_size, per_node_beam_size)
+            # Here we expand the last log probabilities to (num_active * beam_size, per_node_beam_size)
             # so that we can add them to the current log probs for this timestep.
             # This lets us maintain the log probability of each element on the beam.
-            # shape: (batch_size * beam_size, per_node_beam_size)
-            expanded_last_log_probabilities = last_log_probabilities.\
+            # shape: (num_active * beam_size, per_node_beam_size)
+            expanded_last_log_probabilities = last_log_probabilities[active].\
                     unsqueeze(2).\
-                    expand(batch_size, self.beam_size, self.per_node_beam_size).\
-                    reshape(batch_size * self.beam_size, self.per_node_beam_size)
+                    expand(num_active, self.beam_size, self.per_node_beam_size).\
+                    reshape(num_active * self.beam_size, self.per_node_beam_size)
 
-            # shape: (batch_size * beam_size, per_node_beam_size)
+            # shape: (num_active * beam_size, per_node_beam_size)
             summed_top_log_probabilities = top_log_probabilities + expanded_last_log_probabilities
 
-            # shape: (batch_size, beam_size * per_node_beam_size)
+            # shape: (num_active, beam_size * per_node_beam_size)
             reshaped_summed = summed_top_log_probabilities.\
-                    reshape(batch_size, self.beam_size * self.per_node_beam_size)
+                    reshape(num_active, self.beam_size * self.per_node_beam_size)
 
-            # shape: (batch_size, beam_size * per_node_beam_size)
+            # shape: (num_active, beam_size * per_node_beam_size)
             reshaped_predicted_classes = predicted_classes.\
-                    reshape(batch_size, self.beam_size * self.per_node_beam_size)
+                    reshape(num_active, self.beam_size * self.per_node_beam_size)
 
             # Keep only the top `beam_size` beam indices.
-            # shape: (batch_size, beam_size), (batch_size, beam_size)
+            # shape: (num_active, beam_size), (num_active, beam_size)
             restricted_beam_log_probs, restricted_beam_indices = reshaped_summed.topk(self.beam_size)
 
             # Use the beam indices to extract the corresponding classes.
-            # shape: (batch_size, beam_size)
+            # shape: (num_active, beam_size)
             restricted_predicted_classes = reshaped_predicted_classes.gather(1, restricted_beam_indices)
 
-            predictions.append(restricted_predicted_classes)
-
-            # shape: (batch_size, beam_size)
-            last_log_probabilities = restricted_beam_log_probs
-
             # The beam indices come from a `beam_size * per_node_beam_size` dimension where the
             # indices with a common ancestor are grouped together. Hence
             # dividing by per_node_beam_size gives the ancestor. (Note that this is integer
             # division as the tensor is a LongTensor.)
-            # shape: (batch_size, beam_size)
-            backpointer = restricted_beam_indices / self.per_node_beam_size
-
-            backpointers.append(backpointer)
+            # shape: (num_active, beam_size)
+            restricted_backpointer = restricted_beam_indices / self.per_node_beam_size
+
+            if num_active == batch_size:
+                predictions.append(restricted_predicted_classes)
+                last_log_probabilities = restricted_beam_log_probs
+                backpointers.append(restricted_backpointer)
+            else:
+                # Elements that were compacted out predict the end token and keep their log
+                # probabilities and beam order.
+                # shape: (batch_size, beam_size)
+                step_predictions = predictions[-1].new_full((batch_size, self.beam_size), self._end_index)
+                step_predictions[active] = restricted_predicted_classes
+                predictions.append(step_predictions)
+
+                # shape: (batch_size, beam_size)
+                last_log_probabilities = last_log_probabilities.clone()
+                last_log_probabilities[active] = restricted_beam_log_probs
+
+                # shape: (batch_size, beam_size)
+                backpointer = beam_indices.unsqueeze(0).repeat(batch_size, 1)
+                backpointer[active] = restricted_backpointer
+                backpointers.append(backpointer)
 
             # Keep only the pieces of the state tensors corresponding to the
             # ancestors created this iteration.
+            # shape: (num_active * beam_size,)
+            ancestor_indices = (restricted_backpointer + group_offsets[:num_active]).view(-1)
             for key, state_tensor in state.items():
-                _, *last_dims = state_tensor.size()
-                # shape: (batch_size, beam_size, *)
-                expanded_backpointer = backpointer.\
-                        view(batch_size, self.beam_size, *([1] * len(last_dims))).\
-                        expand(batch_size, self.beam_size, *last_dims)
-
-                # shape: (batch_size * beam_size, *)
-                state[key] = state_tensor.\
-                        reshape(batch_size, self.beam_size, *last_dims).\
-                        gather(1, expanded_backpointer).\
-                        reshape(batch_size * self.beam_size, *last_dims)
+                if key in beam_invariant_state_names:
+                    continue
+                # shape: (num_active * beam_size, *)
+                state[key] = state_tensor.index_select(0, ancestor_indices)
 
             # Keep only the pieces of the auxiliaries corresponding to the
             # ancestors created this iteration.
             for key, aux in auxiliaries.items():
                 new_aux = []
-                for ith, indices in enumerate(backpointer.tolist()):
+                for ith, indices in enumerate(restricted_backpointer.tolist()):
                     new_aux += [aux[ith * self.beam_size + index].copy() for index in indices]
                 auxiliaries[key] = new_aux
 
             tracked_state = state[tracked_state_name]
             _, *last_dims = tracked_state.size()
-            # shape: [(batch_size, beam_size, *)]
-            tracked_states.append(tracked_state.reshape(batch_size, self.beam_size, *last_dims))
+            if num_active == batch_size:
+                # shape: [(batch_size, beam_size, *)]
+                tracked_states.append(tracked_state.reshape(batch_size, self.beam_size, *last_dims))
+            else:
+                # The elements that were compacted out are padded with zeros after their end tokens.
+                # shape: (batch_size, beam_size, *)
+                step_tracked_state = tracked_state.new_zeros((batch_size, self.beam_size, *last_dims))
+                step_tracked_state[active] = tracked_state.reshape(num_active, self.beam_size, *last_dims)
+                tracked_states.append(step_tracked_state)
+
+        if active.size(0) < batch_size:
+            # Scatter the auxiliaries of the active elements back among the compacted ones.
+            for key, aux in auxiliaries.items():
+                full_aux = finished_auxiliaries[key]
+                for position, batch_index in enumerate(active.tolist()):
+                    full_aux[batch_index * self.beam_size:(batch_index + 1) * self.beam_size] = \
+                            aux[position * self.beam_size:(position + 1) * self.beam_size]
+                auxiliaries[key] = full_aux
 
         if not torch.isfinite(last_log_probabilities).all():
             warnings.warn("Infinite log probabilities encountered. Some final sequences may not make sense. "
@@ -348,11 +466,14 @@ class BeamSearch:
         # shape: (batch_size, beam_size, max_steps, *)
         all_tracked_states = torch.cat(list(reversed(reconstructed_tracked_states)), 2)
 
-        # shape: (batch_size * beam_size)
-        tracked_auxiliary = auxiliaries[tracked_auxiliary_name]
-        # shape: (batch_size, beam_size)
-        for beam_index in range(self.beam_size):
-            for i in range(beam_index, len(tracked_auxiliary), self.beam_size):
-                tracked_auxiliaries[beam_index][i // self.beam_size] = tracked_auxiliary[i]
+        if tracked_auxiliary_name is None:
+            tracked_auxiliaries = None
+        else:
+            # shape: (batch_size * beam_size)
+            tracked_auxiliary = auxiliaries[tracked_auxiliary_name]
+            # shape: (batch_size, beam_size)
+            for beam_index in range(self.beam_size):
+                for i in range(beam_index, len(tracked_auxiliary), self.beam_size):
+                    tracked_auxiliaries[beam_index][i // self.beam_size] = tracked_auxiliary[i]
 
         return all_predictions, all_tracked_states, last_log_probabilities, tracked_auxiliaries
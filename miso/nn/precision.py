@@ -0,0 +1,94 @@
+from typing import List
+import logging
+
+import torch
+
+from allennlp.common.checks import ConfigurationError
+
+from miso.nn.quantization import swappable_linear_modules
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+PRECISIONS = {
+    "float32": torch.float32,
+    "bfloat16": torch.bfloat16,
+    "float16": torch.float16,
+}
+
+# The Linear-heavy modules of the encoders and the decoder. The pointer generator and the
+# tree parsers keep their float32 weights: the pointer generator adds eps=1e-20, which
+# underflows in float16, to the probabilities whose logs beam search sums, and the edge
+# scores are masked with -1e8 before the log-softmaxes and the MST decoding.
+REDUCED_PRECISION_SUBMODULES = [
+    "_bert_encoder",
+    "_encoder",
+    "_decoder",
+]
+
+
+class ReducedPrecisionLinear(torch.nn.Module):
+    """
+    A ``torch.nn.Linear`` for inference with its weights stored in a reduced precision.
+    The inputs are cast to that precision and the outputs back to float32, so the modules
+    around it, their masks and masking constants, stay in float32: most other CPU kernels
+    of torch 1.4 only run in float32.
+    """
+    def __init__(self, linear: torch.nn.Linear, dtype: torch.dtype) -> None:
+        super().__init__()
+        self.in_features = linear.in_features
+        self.out_features = linear.out_features
+        self.weight = torch.nn.Parameter(linear.weight.detach().to(dtype), requires_grad=False)
+        if linear.bias is None:
+            self.bias = None
+        else:
+            self.bias = torch.nn.Parameter(linear.bias.detach().to(dtype), requires_grad=False)
+
+    def forward(self, inputs: torch.Tensor) -> torch.Tensor:
+        outputs = torch.nn.functional.linear(inputs.to(self.weight.dtype), self.weight, self.bias)
+        return outputs.float()
+
+    def extra_repr(self) -> str:
+        return "in_features={}, out_features={}, bias={}, dtype={}".format(
+            self.in_features, self.out_features, self.bias is not None, self.weight.dtype)
+
+
+def set_inference_precision(model: torch.nn.Module, precision: str) -> List[str]:
+    """
+    Swap the Linear modules of the ``REDUCED_PRECISION_SUBMODULES`` of ``model`` for
+    ``ReducedPrecisionLinear`` ones with ``precision`` weights, in place. Only for
+    inference: the new weights are not trained. float32 leaves the model as it is.
+    :return: the names of the swapped modules.
+    """
+    if precision not in PRECISIONS:
+        raise ConfigurationError("Unknown precision {}; choose from {}".format(
+            precision, ", ".join(PRECISIONS)))
+    if precision == "float32":
+        return []
+    if getattr(model, "inference_precision", "float32") != "float32":
+        raise ConfigurationError("The model already runs in {}".format(model.inference_precision))
+
+    device = next(model.parameters()).device
+    dtype = PRECISIONS[precision]
+    if not _supports_linear(device, dtype):
+        raise ConfigurationError("This torch version has no {} matmul on {}".format(precision, device.type))
+
+    module_names = swappable_linear_modules(model, REDUCED_PRECISION_SUBMODULES)
+    for module_name in module_names:
+        *parent_names, child_name = module_name.split(".")
+        parent = model
+        for name in parent_names:
+            parent = getattr(parent, name)
+        setattr(parent, child_name, ReducedPrecisionLinear(getattr(parent, child_name), dtype))
+    model.inference_precision = precision
+    logger.info("Running %d Linear modules in %s on %s", len(module_names), precision, device.type)
+    return module_names
+
+
+def _supports_linear(device: torch.device, dtype: torch.dtype) -> bool:
+    # e.g. torch 1.4 has bfloat16 but no float16 matmul on CPU
+    weight = torch.ones((1, 1), device=device, dtype=dtype)
+    try:
+        torch.nn.functional.linear(weight, weight, weight[0])
+    except RuntimeError:
+        return False
+    return True
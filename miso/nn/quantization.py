@@ -0,0 +1,90 @@
+from typing import List
+import json
+import logging
+import os
+import shutil
+import tarfile
+import tempfile
+
+import torch
+
+from allennlp.models.archival import archive_model, load_archive, CONFIG_NAME, _WEIGHTS_NAME
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+# The Linear-heavy modules that run once per decoding step or per node pair.
+QUANTIZED_SUBMODULES = [
+    "_decoder",
+    "_extended_pointer_generator",
+    "_tree_parser",
+    "biaffine_parser",
+    "_node_attribute_module",
+    "_edge_attribute_module",
+]
+
+
+def swappable_linear_modules(model: torch.nn.Module, submodule_names: List[str]) -> List[str]:
+    """
+    Names of the ``torch.nn.Linear`` modules of the ``submodule_names`` of ``model`` that
+    can be swapped for modules with other weights, e.g. quantized ones. Attention output
+    projections are left out, because the attention layers read their ``weight`` and
+    ``bias`` directly.
+    """
+    targets = []
+    for root in submodule_names:
+        module = getattr(model, root, None)
+        if module is None:
+            continue
+        for name, child in module.named_modules():
+            if type(child) is torch.nn.Linear and not name.endswith("out_proj"):
+                targets.append("{}.{}".format(root, name) if name else root)
+    return targets
+
+
+def dynamic_quantization_targets(model: torch.nn.Module) -> List[str]:
+    """
+    Names of the ``torch.nn.Linear`` modules of ``QUANTIZED_SUBMODULES`` that can be
+    swapped for dynamically quantized ones.
+    """
+    return swappable_linear_modules(model, QUANTIZED_SUBMODULES)
+
+
+def quantize_dynamic_int8(model: torch.nn.Module, module_names: List[str]) -> torch.nn.Module:
+    """
+    Swap the ``module_names`` Linear modules of ``model`` for int8 dynamically quantized
+    ones, in place. Quantized models only run on CPU.
+    """
+    return torch.quantization.quantize_dynamic(
+        model, qconfig_spec=set(module_names), dtype=torch.qint8, inplace=True)
+
+
+def quantize_archive(archive_file: str, output_file: str) -> List[str]:
+    """
+    Write a copy of a model archive with int8 dynamically quantized Linear modules. The
+    config of the new archive lists them under "quantized_modules", which
+    ``Transduction._load`` uses to quantize the model before loading the weights, so the
+    archive loads with ``load_archive`` like any other.
+    :return: the names of the quantized modules.
+    """
+    archive = load_archive(archive_file, cuda_device=-1)
+    model = archive.model
+    model.eval()
+    module_names = dynamic_quantization_targets(model)
+    quantize_dynamic_int8(model, module_names)
+    logger.info("Quantized %d Linear modules", len(module_names))
+
+    serialization_dir = tempfile.mkdtemp()
+    try:
+        with tarfile.open(archive_file, "r:gz") as archive_tar:
+            archive_tar.extractall(serialization_dir)
+
+        config = archive.config.as_dict(quiet=True)
+        config["quantized_modules"] = module_names
+        with open(os.path.join(serialization_dir, CONFIG_NAME), "w") as config_file:
+            json.dump(config, config_file, indent=4)
+        torch.save(model.state_dict(), os.path.join(serialization_dir, _WEIGHTS_NAME))
+
+        archive_model(serialization_dir, weights=_WEIGHTS_NAME, archive_path=output_file)
+    finally:
+        shutil.rmtree(serialization_dir, ignore_errors=True)
+    return module_names
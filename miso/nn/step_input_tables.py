@@ -0,0 +1,195 @@
+from typing import List, Dict, Tuple
+import logging
+
+import torch
+import torch.nn.functional as F
+
+from allennlp.data import Token, Vocabulary
+from allennlp.data.token_indexers import TokenIndexer, SingleIdTokenIndexer, TokenCharactersIndexer
+from allennlp.data.vocabulary import DEFAULT_PADDING_TOKEN, DEFAULT_OOV_TOKEN
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+def supports_token_indexers(token_indexers: Dict[str, TokenIndexer]) -> bool:
+    """
+    Lookup tables can only reproduce indexers that map one token to one row of ids.
+    """
+    for indexer in token_indexers.values():
+        if not isinstance(indexer, (SingleIdTokenIndexer, TokenCharactersIndexer)):
+            return False
+        if getattr(indexer, "_start_tokens", None) or getattr(indexer, "_end_tokens", None):
+            return False
+    return True
+
+
+def index_tokens(tokens: List[str],
+                 token_indexers: Dict[str, TokenIndexer],
+                 vocab: Vocabulary) -> Dict[str, Tuple[torch.Tensor, torch.Tensor]]:
+    """
+    Index each token on its own with every indexer.
+    :return: a dict from indexer name to (ids, lengths), where ids is [num_tokens] for
+        single-id indexers and [num_tokens, max_num_characters] for character indexers,
+        and lengths is [num_tokens].
+    """
+    tables = {}
+    for name, indexer in token_indexers.items():
+        indices = [indexer.tokens_to_indices([Token(token)], vocab, name)[name][0] for token in tokens]
+        if isinstance(indexer, TokenCharactersIndexer):
+            lengths = torch.tensor([len(x) for x in indices], dtype=torch.long)
+            ids = torch.zeros((len(tokens), max([1] + lengths.tolist())), dtype=torch.long)
+            for i, characters in enumerate(indices):
+                if len(characters) > 0:
+                    ids[i, :len(characters)] = torch.tensor(characters, dtype=torch.long)
+        else:
+            ids = torch.tensor(indices, dtype=torch.long)
+            lengths = torch.ones_like(ids)
+        tables[name] = (ids, lengths)
+    return tables
+
+
+class StepInputTables:
+    """
+    Per-batch lookup tensors that turn a group of hybrid predictions into the decoder inputs
+    of the next step with gather ops, instead of building a TextField/Instance/Batch per
+    hypothesis.
+
+    Each prediction is first resolved to a slot: slots [0, vocab_size) are generated tokens
+    and slots [vocab_size, vocab_size + source_dynamic_vocab_size) are source-side copies.
+    A target-side copy resolves to the slot of the node it copies, which the caller tracks
+    per hypothesis (see ``DecompParser._prepare_next_inputs_from_tables``).
+    """
+    def __init__(self,
+                 vocab_token_ids: Dict[str, Tuple[torch.Tensor, torch.Tensor]],
+                 source_token_ids: Dict[str, Tuple[torch.Tensor, torch.Tensor]],
+                 pos_tags: torch.Tensor,
+                 source_tokens: List[List[str]],
+                 token_indexers: Dict[str, TokenIndexer],
+                 vocab: Vocabulary,
+                 vocab_namespace: str) -> None:
+        self._vocab_token_ids = vocab_token_ids
+        self._source_token_ids = source_token_ids
+        self._pos_tags = pos_tags
+        self._source_tokens = source_tokens
+        self._token_indexers = token_indexers
+        self._vocab = vocab
+        self._vocab_namespace = vocab_namespace
+        self._vocab_size = vocab.get_vocab_size(vocab_namespace)
+
+    @classmethod
+    def build(cls,
+              meta_data: List[Dict],
+              vocab: Vocabulary,
+              vocab_namespace: str,
+              pos_tag_namespace: str,
+              source_dynamic_vocab_size: int,
+              vocab_token_ids: Dict[str, Tuple[torch.Tensor, torch.Tensor]],
+              device: torch.device) -> "StepInputTables":
+        """
+        :param meta_data: instance meta data of the batch.
+        :param vocab_token_ids: the output of ``index_tokens`` over the target output vocab,
+            which does not change across batches and is built once by the caller.
+        """
+        token_indexers = meta_data[0]["target_token_indexers"]
+        vocab_size = vocab.get_vocab_size(vocab_namespace)
+        token_to_index = vocab.get_token_to_index_vocabulary(vocab_namespace)
+
+        # Tokens of the source-side copy slots; slots past the end of an instance's
+        # source dynamic vocab are never valid predictions and are filled with padding.
+        source_tokens = []
+        for instance_meta in meta_data:
+            source_dynamic_vocab = instance_meta["source_dynamic_vocab"]
+            source_tokens.append([
+                source_dynamic_vocab.get_token_from_idx(index)
+                if index < source_dynamic_vocab.vocab_size else DEFAULT_PADDING_TOKEN
+                for index in range(source_dynamic_vocab_size)
+            ])
+
+        flat_source_tokens = [token for tokens in source_tokens for token in tokens]
+        source_token_ids = {}
+        for name, (ids, lengths) in index_tokens(flat_source_tokens, token_indexers, vocab).items():
+            source_token_ids[name] = (
+                # [batch_size, source_dynamic_vocab_size(, num_characters)]
+                ids.view(len(meta_data), source_dynamic_vocab_size, *ids.size()[1:]).to(device),
+                lengths.view(len(meta_data), source_dynamic_vocab_size).to(device)
+            )
+
+        # [batch_size, vocab_size + source_dynamic_vocab_size]
+        default_pos_tag = vocab.get_token_index(DEFAULT_OOV_TOKEN, pos_tag_namespace)
+        pos_tags = torch.full((len(meta_data), vocab_size + source_dynamic_vocab_size),
+                              default_pos_tag, dtype=torch.long)
+        for i, instance_meta in enumerate(meta_data):
+            pos_tag_lut = instance_meta["pos_tag_lut"]
+            for token, pos_tag in pos_tag_lut.items():
+                index = token_to_index.get(token, None)
+                if index is not None:
+                    pos_tags[i, index] = vocab.get_token_index(pos_tag, pos_tag_namespace)
+            for j, token in enumerate(source_tokens[i]):
+                pos_tags[i, vocab_size + j] = vocab.get_token_index(
+                    pos_tag_lut.get(token, DEFAULT_OOV_TOKEN), pos_tag_namespace)
+
+        return cls(
+            vocab_token_ids={name: (ids.to(device), lengths.to(device))
+                             for name, (ids, lengths) in vocab_token_ids.items()},
+            source_token_ids=source_token_ids,
+            pos_tags=pos_tags.to(device),
+            source_tokens=source_tokens,
+            token_indexers=token_indexers,
+            vocab=vocab,
+            vocab_namespace=vocab_namespace
+        )
+
+    def lookup(self,
+               slots: torch.Tensor,
+               batch_indices: torch.Tensor,
+               padding_slot: int = None) -> Tuple[Dict[str, torch.Tensor], torch.Tensor]:
+        """
+        :param slots: [group_size].
+        :param batch_indices: [group_size], the batch instance each hypothesis belongs to.
+        :param padding_slot: a generation slot whose token is padded for but not looked up,
+            e.g. <EOS> of the finished hypotheses that beam search dropped from the group.
+        :return:
+            tokens: a dict from indexer name to [group_size, 1(, num_characters)], padded
+                the same way ``Batch.as_tensor_dict`` pads a batch of one-token TextFields.
+            pos_tags: [group_size].
+        """
+        is_generation = slots < self._vocab_size
+        vocab_slots = slots.clamp(max=self._vocab_size - 1)
+        source_slots = (slots - self._vocab_size).clamp(min=0)
+
+        tokens = {}
+        for name, indexer in self._token_indexers.items():
+            vocab_ids, vocab_lengths = self._vocab_token_ids[name]
+            source_ids, source_lengths = self._source_token_ids[name]
+            generated_ids = vocab_ids[vocab_slots]
+            copied_ids = source_ids[batch_indices, source_slots]
+            if isinstance(indexer, TokenCharactersIndexer):
+                width = max(generated_ids.size(1), copied_ids.size(1))
+                generated_ids = F.pad(generated_ids, [0, width - generated_ids.size(1)])
+                copied_ids = F.pad(copied_ids, [0, width - copied_ids.size(1)])
+                # [group_size, width]
+                ids = torch.where(is_generation.unsqueeze(1), generated_ids, copied_ids)
+                lengths = torch.where(is_generation, vocab_lengths[vocab_slots],
+                                      source_lengths[batch_indices, source_slots])
+                num_characters = max(indexer._min_padding_length, lengths.max().item())
+                if padding_slot is not None:
+                    num_characters = max(num_characters, vocab_lengths[padding_slot].item())
+                ids = F.pad(ids, [0, max(0, num_characters - width)])[:, :num_characters]
+            else:
+                # [group_size]
+                ids = torch.where(is_generation, generated_ids, copied_ids)
+            # [group_size, 1, *]
+            ids = ids.unsqueeze(1)
+            num_tokens = max(1, indexer.get_token_min_padding_length())
+            if num_tokens > 1:
+                padding = [0, 0] * (ids.dim() - 2) + [0, num_tokens - 1]
+                ids = F.pad(ids, padding)
+            tokens[name] = ids
+
+        pos_tags = self._pos_tags[batch_indices, slots]
+        return tokens, pos_tags
+
+    def get_slot_token(self, batch_index: int, slot: int) -> str:
+        if slot < self._vocab_size:
+            return self._vocab.get_token_from_index(slot, self._vocab_namespace)
+        return self._source_tokens[batch_index][slot - self._vocab_size]
@@ -11,7 +11,9 @@ import traceback
 import math
 import os
 import re
+import shutil
 import pdb 
+from concurrent.futures import ThreadPoolExecutor
 
 import torch
 import torch.optim.lr_scheduler
@@ -35,12 +37,38 @@ from allennlp.training.momentum_schedulers import MomentumScheduler
 from allennlp.training.moving_average import MovingAverage
 from allennlp.training.optimizers import Optimizer
 
-from miso.data.dataset_readers.decomp_parsing.decomp import DecompGraph
 #from miso.data.iterators.data_iterator import DecompDataIterator, DecompBasicDataIterator 
-from miso.metrics.s_metric.s_metric import S, compute_s_metric
+from miso.metrics.s_metric.s_metric import S, compute_s_metric, scoring_pool, GoldTripleCache
 
 logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
 
+# Model attributes that hold validation scores computed by the trainer, and the metrics
+# that report them in ``get_metrics``.
+VALIDATION_SCORE_METRICS = {"val_s_f1": "s_f1", "syntax_las": "syn_las", "syntax_uas": "syn_uas"}
+
+# Validation modes, from the cheapest: teacher-forced loss only, beam search decoding of a
+# fixed subsample of the validation set, and decoding of the whole validation set.
+VALIDATION_MODES = ("loss", "subsample", "full")
+
+
+def _requires_validation_metric(scheduler: Union[LearningRateScheduler, MomentumScheduler]) -> bool:
+    """Whether ``scheduler`` steps on the validation metric, i.e. wraps ``ReduceLROnPlateau``."""
+    return isinstance(getattr(scheduler, "lr_scheduler", None), torch.optim.lr_scheduler.ReduceLROnPlateau)
+
+
+def stratified_subsample(lengths: List[int], ratio: float, seed: int) -> List[int]:
+    """
+    Pick about ``ratio`` of the instances, one at random from each of as many equal-sized
+    length strata, so that the subsample keeps the length distribution of the whole set.
+    :param lengths: the length of each instance.
+    :return: the sorted indices of the picked instances.
+    """
+    num_samples = min(len(lengths), max(1, int(round(ratio * len(lengths)))))
+    order = sorted(range(len(lengths)), key=lambda i: (lengths[i], i))
+    random_state = numpy.random.RandomState(seed)
+    return sorted(int(random_state.choice(stratum))
+                  for stratum in numpy.array_split(order, num_samples))
+
 
 @TrainerBase.register("decomp_parsing")
 class DecompTrainer(Trainer):
@@ -55,6 +83,12 @@ class DecompTrainer(Trainer):
                  syntactic_method:str = None,
                  accumulate_batches: int = 1,
                  bert_optimizer: Optimizer = None,
+                 s_metric_workers: int = 0,
+                 async_validation_scores: bool = False,
+                 intermediate_validation: str = "full",
+                 full_validation_every: int = 1,
+                 validation_subsample_ratio: float = 0.2,
+                 validation_subsample_seed: int = 13,
                  *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.validation_data_path = validation_data_path
@@ -62,6 +96,34 @@ class DecompTrainer(Trainer):
         self.semantics_only=semantics_only
         self.drop_syntax=drop_syntax
         self.include_attribute_scores=include_attribute_scores
+        self.s_metric_workers = s_metric_workers
+        # Score the validation predictions in a background thread while the next epoch trains.
+        # The thread only waits on the `s_metric_workers` scoring processes: scoring in the
+        # thread itself holds the GIL and barely overlaps with training.
+        self.async_validation_scores = async_validation_scores
+        if async_validation_scores and s_metric_workers == 0:
+            logger.warning("async_validation_scores without s_metric_workers scores in a thread "
+                           "that competes with training for the GIL; set s_metric_workers > 0")
+        self._score_executor = None
+        # The scoring processes, started once from the main thread and reused every epoch.
+        self._score_pool = None
+        self._pending_validation_scores = None
+
+        # Validation schedule: every `full_validation_every` epochs and at the last epoch the
+        # whole validation set is decoded; the other epochs use `intermediate_validation`.
+        if intermediate_validation not in VALIDATION_MODES:
+            raise ConfigurationError(f"intermediate_validation must be one of {VALIDATION_MODES}, "
+                                     f"got {intermediate_validation}")
+        if full_validation_every < 1:
+            raise ConfigurationError(f"full_validation_every must be positive, got {full_validation_every}")
+        self.intermediate_validation = intermediate_validation
+        self.full_validation_every = full_validation_every
+        self.validation_subsample_ratio = validation_subsample_ratio
+        self.validation_subsample_seed = validation_subsample_seed
+        self._validation_mode = "full"
+        self._validation_subsample = None
+        # the validation gold graphs are the same every epoch, so their triples are kept
+        self._gold_triples = GoldTripleCache()
         self.accumulate_batches = accumulate_batches
         self.bert_optimizer = bert_optimizer
 
@@ -71,6 +133,19 @@ class DecompTrainer(Trainer):
     def _update_validation_s_score(self, pred_instances: List[Dict[str, numpy.ndarray]],
                                          true_instances):
         """Write the validation output in pkl format, and compute the S score."""
+        self._set_validation_scores(self._compute_validation_scores(pred_instances, true_instances))
+
+    def _set_validation_scores(self, scores: Dict[str, float]) -> None:
+        for name, value in scores.items():
+            setattr(self.model, name, value)
+
+    def _compute_validation_scores(self, pred_instances: List[Dict[str, numpy.ndarray]],
+                                         true_instances) -> Dict[str, float]:
+        """
+        Compute the validation scores of the predictions.
+        Only reads its arguments, so that it can run in the background.
+        :return: a dict from model attribute name to score.
+        """
         logger.info("Computing S")
 
         for batch in true_instances:
@@ -78,17 +153,20 @@ class DecompTrainer(Trainer):
 
         true_graphs = [true_inst for batch in true_instances for true_inst in batch[0]['graph'] ]
         true_sents = [true_inst for batch in true_instances for true_inst in batch[0]['src_tokens_str']]
+        true_triples = self._gold_triples.get(true_graphs, self.semantics_only, self.drop_syntax,
+                                              self.include_attribute_scores)
 
-        pred_graphs = [DecompGraph.from_prediction(pred_inst) for pred_inst in pred_instances]
-
-        ret = compute_s_metric(true_graphs, pred_graphs, true_sents, 
+        # the predictions are scored as they are, see DecompPrediction
+        ret = compute_s_metric(true_triples, pred_instances, true_sents, 
                                self.semantics_only, 
                                self.drop_syntax, 
-                               self.include_attribute_scores)
+                               self.include_attribute_scores,
+                               num_workers=self.s_metric_workers,
+                               pool=self._score_pool)
 
-        self.model.val_s_precision = float(ret[0]) * 100
-        self.model.val_s_recall = float(ret[1]) * 100
-        self.model.val_s_f1 = float(ret[2]) * 100
+        return dict(val_s_precision=float(ret[0]) * 100,
+                    val_s_recall=float(ret[1]) * 100,
+                    val_s_f1=float(ret[2]) * 100)
 
     def _validation_forward(self, batch_group: List[TensorDict]) \
             -> TensorDict:
@@ -99,10 +177,33 @@ class DecompTrainer(Trainer):
         assert len(batch_group) == 1
         batch = batch_group[0]
         batch = nn_util.move_to_device(batch, self._cuda_devices[0])
-        output_dict = self.model(**batch)
+        if self._validation_mode == "loss":
+            # teacher-forced, as in training, but with the model in eval mode
+            output_dict = self.model._training_forward(self.model._prepare_inputs(batch))
+        else:
+            output_dict = self.model(**batch)
 
         return output_dict
 
+    def _get_validation_mode(self, epoch: int) -> str:
+        if epoch == self._num_epochs - 1 or (epoch + 1) % self.full_validation_every == 0:
+            return "full"
+        return self.intermediate_validation
+
+    def _get_validation_instances(self) -> List[Instance]:
+        if self._validation_mode != "subsample":
+            return self._validation_data
+
+        if self._validation_subsample is None:
+            validation_data = list(self._validation_data)
+            lengths = [len(instance.fields["source_tokens"]) for instance in validation_data]
+            indices = stratified_subsample(lengths, self.validation_subsample_ratio,
+                                           self.validation_subsample_seed)
+            self._validation_subsample = [validation_data[i] for i in indices]
+            logger.info("Validating intermediate epochs on %d of %d instances",
+                        len(indices), len(validation_data))
+        return self._validation_subsample
+
     def _validation_loss(self) -> Tuple[float, int]:
         """
         Computes the validation loss and updates loss weight. 
@@ -122,7 +223,7 @@ class DecompTrainer(Trainer):
             self._curr_epoch += 1
             return -1, -1
 
-        logger.info("Validating")
+        logger.info("Validating (%s)", self._validation_mode)
 
         self.model.eval()
 
@@ -138,11 +239,12 @@ class DecompTrainer(Trainer):
         # Disable multiple gpus in validation.
         num_gpus = 1
 
-        raw_val_generator = val_iterator(self._validation_data,
+        validation_data = self._get_validation_instances()
+        raw_val_generator = val_iterator(validation_data,
                                          num_epochs=1,
                                          shuffle=False)
         val_generator = lazy_groups_of(raw_val_generator, num_gpus)
-        num_validation_batches = math.ceil(val_iterator.get_num_batches(self._validation_data)/num_gpus)
+        num_validation_batches = math.ceil(val_iterator.get_num_batches(validation_data)/num_gpus)
         val_generator_tqdm = Tqdm.tqdm(val_generator,
                                        total=num_validation_batches)
         batches_this_epoch = 0
@@ -168,6 +270,9 @@ class DecompTrainer(Trainer):
             description = training_util.description_from_metrics(val_metrics)
             val_generator_tqdm.set_description(description, refresh=False)
 
+            if self._validation_mode == "loss":
+                continue
+
             # Update the validation outputs.
             peek = list(batch_output.values())[0]
             batch_size = peek.size(0) if isinstance(peek, torch.Tensor) else len(peek)
@@ -187,13 +292,286 @@ class DecompTrainer(Trainer):
         # Now restore the original parameter values.
         if self._moving_average is not None:
             self._moving_average.restore()
-        self._update_validation_s_score(val_outputs, val_true_instances)
+        if self._validation_mode == "loss":
+            return val_loss, batches_this_epoch
+
+        if self.async_validation_scores:
+            # The outputs are numpy arrays and the true instances are not moved to the GPU,
+            # so they are a snapshot that training does not change.
+            if self._score_executor is None:
+                self._score_executor = ThreadPoolExecutor(max_workers=1)
+            if self._score_pool is None and self.s_metric_workers > 0:
+                self._score_pool = scoring_pool(self.s_metric_workers)
+            self._pending_validation_scores = self._score_executor.submit(
+                self._compute_validation_scores, val_outputs, val_true_instances)
+        else:
+            self._update_validation_s_score(val_outputs, val_true_instances)
 
         if hasattr(self, "_update_validation_syntax_score"):
             self._update_validation_syntax_score(val_outputs, val_true_instances)
 
         return val_loss, batches_this_epoch
 
+    @overrides
+    def train(self) -> Dict[str, Any]:
+        """
+        Trains the supplied model with the supplied parameters.
+
+        Same as ``Trainer.train``, with a validation schedule and background scoring:
+        only epochs that decode the whole validation set take part in early stopping and
+        in picking the best checkpoint. With ``async_validation_scores``, the scores of epoch N
+        are computed while epoch N + 1 trains, and everything that depends on the validation
+        metric of epoch N (early stopping, best checkpoint, metric-based learning rate
+        schedules, ``metrics_epoch_N.json``) is resolved right after the training part of
+        epoch N + 1. This only pays off with ``s_metric_workers > 0``: the background thread
+        then waits on the scoring processes instead of competing with training for the GIL.
+        """
+        if self._validation_data is None or \
+                (not self.async_validation_scores and self.intermediate_validation == "full"):
+            return super().train()
+
+        try:
+            epoch_counter = self._restore_checkpoint()
+        except RuntimeError:
+            traceback.print_exc()
+            raise ConfigurationError("Could not recover training from the checkpoint.  Did you mean to output to "
+                                     "a different serialization directory or delete the existing serialization "
+                                     "directory?")
+
+        training_util.enable_gradient_clipping(self.model, self._grad_clipping)
+
+        logger.info("Beginning training.")
+
+        metrics: Dict[str, Any] = {}
+        training_start_time = time.time()
+
+        metrics['best_epoch'] = self._metric_tracker.best_epoch
+        for key, value in self._metric_tracker.best_epoch_metrics.items():
+            metrics["best_validation_" + key] = value
+
+        # (epoch, validation mode, train_metrics, val_metrics) of the epoch whose scores are pending.
+        pending = None
+        for epoch in range(epoch_counter, self._num_epochs):
+            train_metrics = self._train_epoch(epoch)
+
+            # get peak of memory usage
+            if 'cpu_memory_MB' in train_metrics:
+                metrics['peak_cpu_memory_MB'] = max(metrics.get('peak_cpu_memory_MB', 0),
+                                                    train_metrics['cpu_memory_MB'])
+            for key, value in train_metrics.items():
+                if key.startswith('gpu_'):
+                    metrics["peak_"+key] = max(metrics.get("peak_"+key, 0), value)
+
+            if pending is not None:
+                should_stop = self._finish_validation(*pending, metrics, epoch_counter, training_start_time)
+                pending = None
+                if should_stop:
+                    break
+
+            self._validation_mode = self._get_validation_mode(epoch)
+            with torch.no_grad():
+                # We have a validation set, so compute all the metrics on it.
+                val_loss, num_batches = self._validation_loss()
+                val_metrics = training_util.get_metrics(self.model, val_loss, num_batches, reset=True)
+            if self._validation_mode == "loss":
+                # the model still holds the scores of the last decoded epoch
+                for metric_name in VALIDATION_SCORE_METRICS.values():
+                    val_metrics.pop(metric_name, None)
+            val_metrics["decoded_fraction"] = self._decoded_fraction()
+
+            if self._pending_validation_scores is not None:
+                # Only the schedules that depend on the validation metric wait for the scores.
+                self._step_schedulers(None, epoch, metric_based=False)
+                # The epoch may still become the best one; `_finish_validation` copies it to best.th.
+                self._save_checkpoint(epoch, is_best_so_far=False)
+                pending = (epoch, self._validation_mode, train_metrics, val_metrics)
+            else:
+                should_stop = self._finish_validation(epoch, self._validation_mode, train_metrics, val_metrics,
+                                                      metrics, epoch_counter, training_start_time)
+                if should_stop:
+                    break
+                self._save_checkpoint(epoch, is_best_so_far=(self._validation_mode == "full" and
+                                                             self._metric_tracker.is_best_so_far()))
+
+        if pending is not None:
+            self._finish_validation(*pending, metrics, epoch_counter, training_start_time)
+        self._close_score_workers()
+
+        # make sure pending events are flushed to disk and files are closed properly
+        self._tensorboard.close()
+
+        # Load the best model state before returning
+        best_model_state = self._checkpointer.best_model_state()
+        if best_model_state:
+            self.model.load_state_dict(best_model_state)
+
+        return metrics
+
+    def _close_score_workers(self) -> None:
+        if self._score_executor is not None:
+            self._score_executor.shutdown()
+            self._score_executor = None
+        if self._score_pool is not None:
+            self._score_pool.close()
+            self._score_pool.join()
+            self._score_pool = None
+
+    def _decoded_fraction(self) -> float:
+        """The fraction of the validation set that the current validation mode decodes."""
+        if self._validation_mode == "loss":
+            return 0.0
+        if self._validation_mode == "subsample":
+            return len(self._get_validation_instances()) / len(self._validation_data)
+        return 1.0
+
+    def _finish_validation(self,
+                           epoch: int,
+                           validation_mode: str,
+                           train_metrics: Dict[str, float],
+                           val_metrics: Dict[str, float],
+                           metrics: Dict[str, Any],
+                           epoch_counter: int,
+                           training_start_time: float) -> bool:
+        """
+        Wait for the pending validation scores of ``epoch``, if any, add them to its metrics
+        and do the bookkeeping that ``Trainer.train`` does after validation.
+        :return: whether to stop early.
+        """
+        # The checkpoint of a pending epoch is already saved, without its validation metric.
+        is_pending = self._pending_validation_scores is not None
+        if is_pending:
+            scores = self._pending_validation_scores.result()
+            self._pending_validation_scores = None
+            self._set_validation_scores(scores)
+            for name, value in scores.items():
+                metric_name = VALIDATION_SCORE_METRICS.get(name, None)
+                if metric_name in val_metrics:
+                    val_metrics[metric_name] = value
+
+        is_full_validation = validation_mode == "full"
+        if is_full_validation:
+            # Check validation metric for early stopping
+            this_epoch_val_metric = val_metrics[self._validation_metric]
+            self._metric_tracker.add_metric(this_epoch_val_metric)
+            if self._metric_tracker.should_stop_early():
+                logger.info("Ran out of patience.  Stopping training.")
+                if is_pending:
+                    self._update_checkpoint_metric_tracker(epoch)
+                return True
+
+        self._tensorboard.log_metrics(train_metrics, val_metrics=val_metrics, log_to_console=True, epoch=epoch + 1)
+
+        # Create overall metrics dict
+        training_elapsed_time = time.time() - training_start_time
+        metrics["training_duration"] = str(datetime.timedelta(seconds=training_elapsed_time))
+        metrics["training_start_epoch"] = epoch_counter
+        metrics["training_epochs"] = epoch - epoch_counter + 1
+        metrics["epoch"] = epoch
+        metrics["validation_mode"] = validation_mode
+
+        for key, value in train_metrics.items():
+            metrics["training_" + key] = value
+        for key, value in val_metrics.items():
+            metrics["validation_" + key] = value
+
+        if is_full_validation and self._metric_tracker.is_best_so_far():
+            # Update all the best_ metrics.
+            # (Otherwise they just stay the same as they were.)
+            metrics['best_epoch'] = epoch
+            for key, value in val_metrics.items():
+                metrics["best_validation_" + key] = value
+
+            self._metric_tracker.best_epoch_metrics = val_metrics
+            model_path = os.path.join(self._serialization_dir or "", f"model_state_epoch_{epoch}.th")
+            if self._serialization_dir and os.path.exists(model_path):
+                # the checkpoint was saved before its scores were known
+                shutil.copyfile(model_path, os.path.join(self._serialization_dir, "best.th"))
+
+        if self._serialization_dir:
+            dump_metrics(os.path.join(self._serialization_dir, f'metrics_epoch_{epoch}.json'), metrics)
+
+        if not is_full_validation:
+            # The metrics of a partial validation are not comparable with the full ones, and
+            # there may be none yet, so only the schedules that don't use them step; those of
+            # a pending epoch already did at the end of the epoch.
+            if not is_pending:
+                self._step_schedulers(None, epoch, metric_based=False)
+        elif is_pending:
+            self._update_checkpoint_metric_tracker(epoch)
+            # the other schedules already stepped at the end of the epoch
+            self._step_schedulers(this_epoch_val_metric, epoch, metric_based=True)
+        else:
+            self._step_schedulers(this_epoch_val_metric, epoch)
+        return False
+
+    def _step_schedulers(self, metric: Optional[float], epoch: int, metric_based: bool = None) -> None:
+        """
+        Step the learning rate and momentum schedulers after ``epoch``. The Scheduler API is
+        agnostic to whether a schedule requires a validation metric; if it doesn't, ``metric``
+        is ignored.
+        :param metric_based: if given, only step the schedulers that do (True) or do not (False)
+            require the validation metric.
+        """
+        for scheduler in (self._learning_rate_scheduler, self._momentum_scheduler):
+            if scheduler is None:
+                continue
+            if metric_based is None or metric_based == _requires_validation_metric(scheduler):
+                scheduler.step(metric, epoch)
+
+    def _update_checkpoint_metric_tracker(self, epoch: int) -> None:
+        """
+        Put the metric tracker, now that it has the validation metric of ``epoch``, into the
+        training state of the checkpoint of ``epoch``, which was saved before the metric was
+        known, so that training resumed from it keeps track of patience and of the best epoch.
+        The rest of the training state is left as it was at the end of ``epoch``.
+        """
+        if self._serialization_dir is None:
+            return
+        training_path = os.path.join(self._serialization_dir, f"training_state_epoch_{epoch}.th")
+        if not os.path.exists(training_path):
+            # removed to keep only the last `num_serialized_models_to_keep` checkpoints
+            return
+        training_state = torch.load(training_path, map_location=nn_util.device_mapping(-1))
+        training_state["metric_tracker"] = self._metric_tracker.state_dict()
+        torch.save(training_state, training_path)
+
+    @overrides
+    def _save_checkpoint(self, epoch: Union[int, str], is_best_so_far: bool = None) -> None:
+        """
+        Same as ``Trainer._save_checkpoint``, except that ``is_best_so_far`` can be given
+        when the metric tracker does not know yet.
+        """
+        if is_best_so_far is None:
+            is_best_so_far = self._metric_tracker.is_best_so_far()
+
+        # If moving averages are used for parameters, we save
+        # the moving average values into checkpoint, instead of the current values.
+        if self._moving_average is not None:
+            self._moving_average.assign_average_value()
+
+        # These are the training states we need to persist.
+        training_states = {
+                "metric_tracker": self._metric_tracker.state_dict(),
+                "optimizer": self.optimizer.state_dict(),
+                "batch_num_total": self._batch_num_total
+        }
+
+        # If we have a learning rate or momentum scheduler, we should persist them too.
+        if self._learning_rate_scheduler is not None:
+            training_states["learning_rate_scheduler"] = self._learning_rate_scheduler.state_dict()
+        if self._momentum_scheduler is not None:
+            training_states["momentum_scheduler"] = self._momentum_scheduler.state_dict()
+
+        self._checkpointer.save_checkpoint(
+                model_state=self.model.state_dict(),
+                epoch=epoch,
+                training_states=training_states,
+                is_best_so_far=is_best_so_far)
+
+        # Restore the original values for parameters so that training will not be affected.
+        if self._moving_average is not None:
+            self._moving_average.restore()
+
     @overrides
     def _train_epoch(self, epoch: int) -> Dict[str, float]:
         """
@@ -382,6 +760,12 @@ def _from_params(cls,  # type: ignore
     semantics_only = params.pop("semantics_only", False)
     drop_syntax = params.pop("drop_syntax", True)
     include_attribute_scores = params.pop("include_attribute_scores", False)
+    s_metric_workers = params.pop_int("s_metric_workers", 0)
+    async_validation_scores = params.pop_bool("async_validation_scores", False)
+    intermediate_validation = params.pop("intermediate_validation", "full")
+    full_validation_every = params.pop_int("full_validation_every", 1)
+    validation_subsample_ratio = params.pop_float("validation_subsample_ratio", 0.2)
+    validation_subsample_seed = params.pop_int("validation_subsample_seed", 13)
 
     warmup_epochs = params.pop("warmup_epochs", 0) 
 
@@ -494,6 +878,12 @@ def _from_params(cls,  # type: ignore
                syntactic_method = syntactic_method,
                drop_syntax=drop_syntax,
                include_attribute_scores=include_attribute_scores,
+               s_metric_workers=s_metric_workers,
+               async_validation_scores=async_validation_scores,
+               intermediate_validation=intermediate_validation,
+               full_validation_every=full_validation_every,
+               validation_subsample_ratio=validation_subsample_ratio,
+               validation_subsample_seed=validation_subsample_seed,
                patience=patience,
                validation_metric=validation_metric,
                validation_iterator=validation_iterator,
@@ -51,7 +51,7 @@ class DecompSyntaxTrainer(DecompTrainer):
                                             total_epochs = self._num_epochs
                                                 )
 
-    def _update_attachment_scores(self, pred_instances, true_instances):
+    def _attachment_scores(self, pred_instances, true_instances) -> Dict[str, float]:
         las = []
         uas = []
 
@@ -120,20 +120,20 @@ class DecompSyntaxTrainer(DecompTrainer):
                 continue
 
         scores = self.attachment_scorer.get_metric(reset = True) 
-        self.model.syntax_las = scores["LAS"] * 100
-        self.model.syntax_uas = scores["UAS"] * 100
+        return dict(syntax_las=scores["LAS"] * 100,
+                    syntax_uas=scores["UAS"] * 100)
 
     @overrides
-    def _update_validation_s_score(self, pred_instances: List[Dict[str, numpy.ndarray]],
-                                         true_instances):
-        """Write the validation output in pkl format, and compute the S score."""
+    def _compute_validation_scores(self, pred_instances: List[Dict[str, numpy.ndarray]],
+                                         true_instances) -> Dict[str, float]:
+        """Compute the attachment scores and the S score of the predictions."""
         # compute attachement scores here without having to override another function
-        self._update_attachment_scores(pred_instances, true_instances) 
+        scores = self._attachment_scores(pred_instances, true_instances) 
         
         if isinstance(self.model, DecompSyntaxOnlyParser) or \
            isinstance(self.model, DecompTransformerSyntaxOnlyParser) or \
            isinstance(self.model, UDParser):
-            return 
+            return scores
 
         logger.info("Computing S")
 
@@ -142,17 +142,22 @@ class DecompSyntaxTrainer(DecompTrainer):
 
         true_graphs = [true_inst for batch in true_instances for true_inst in batch[0]['graph'] ]
         true_sents = [true_inst for batch in true_instances for true_inst in batch[0]['src_tokens_str']]
+        true_triples = self._gold_triples.get(true_graphs, self.semantics_only, self.drop_syntax,
+                                              self.include_attribute_scores)
 
         pred_graphs = [DecompGraphWithSyntax.from_prediction(pred_inst, self.syntactic_method) for pred_inst in pred_instances]
 
         pred_sem_graphs, pred_syn_graphs, __  = zip(*pred_graphs)
 
-        ret = compute_s_metric(true_graphs, pred_sem_graphs, true_sents, 
+        ret = compute_s_metric(true_triples, pred_sem_graphs, true_sents, 
                                self.semantics_only, 
                                self.drop_syntax, 
-                               self.include_attribute_scores)
-
-        self.model.val_s_precision = float(ret[0]) * 100
-        self.model.val_s_recall = float(ret[1]) * 100
-        self.model.val_s_f1 = float(ret[2]) * 100
+                               self.include_attribute_scores,
+                               num_workers=self.s_metric_workers,
+                               pool=self._score_pool)
+
+        scores.update(val_s_precision=float(ret[0]) * 100,
+                      val_s_recall=float(ret[1]) * 100,
+                      val_s_f1=float(ret[2]) * 100)
+        return scores
 
@@ -0,0 +1,110 @@
+"""
+CPU micro-benchmark of the extended pointer-generator distribution, comparing the
+one-hot bmm copy distributions with the index scatter-add, for a beam search step
+and for a teacher-forced sequence, and check that both give the same log-probabilities.
+
+Also compares the decoder state kept for the target attention map during beam search:
+the dense [group_size, max_steps, max_steps + 1] one-hot map updated one hypothesis at
+a time, against the [group_size, max_steps] node indices updated in one write.
+
+Usage: python scripts/benchmark_pointer_generator.py [--vocab-size 10000] [--repeats 50]
+
+With the default vocabulary the vocabulary projection dominates the pointer-generator
+times; ``--vocab-size 100`` isolates the copy distributions. On one CPU thread
+(torch 1.13.1, --repeats 20, --vocab-size 100), bmm -> scatter:
+    step, beam 5 x 32:          3.5 ms -> 1.0 ms
+    step, beam 5 x 32, long:   13.5 ms -> 1.5 ms
+    sequence, batch 32:        24.3 ms -> 25.8 ms (forward and backward)
+    sequence, batch 64, long: 103.7 ms -> 108.8 ms (forward and backward)
+and the target attention map state, dense -> index:
+    160 x 60 steps:   4.47 MB, 79 ms -> 0.073 MB, 0.7 ms
+    320 x 150 steps: 55.30 MB, 485 ms -> 0.366 MB, 1.8 ms
+"""
+import sys
+import os
+import time
+import argparse
+
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from miso.modules.generators import ExtendedPointerGenerator
+
+
+def make_inputs(batch_size, target_length, source_length, memory_length, input_dim):
+    return dict(inputs=torch.randn(batch_size, target_length, input_dim),
+                source_attention_weights=torch.randn(batch_size, target_length, source_length).softmax(2),
+                source_attention_map=torch.randint(source_length + 2, (batch_size, source_length)),
+                target_attention_weights=torch.randn(batch_size, target_length, memory_length).softmax(2),
+                target_attention_map=torch.randint(memory_length + 1, (batch_size, memory_length)),
+                source_dynamic_vocab_size=source_length + 2,
+                target_dynamic_vocab_size=memory_length + 1)
+
+
+def run(generator, inputs, use_scatter, repeats, backward):
+    ExtendedPointerGenerator.use_scatter = use_scatter
+    inputs["inputs"].requires_grad_(backward)
+    start = time.perf_counter()
+    for __ in range(repeats):
+        log_probs = generator(**inputs)["hybrid_log_prob_dist"]
+        if backward:
+            log_probs.sum().backward()
+    return (time.perf_counter() - start) / repeats, log_probs.detach()
+
+
+def decode_target_map(group_size, max_steps, dense):
+    """Fill the target attention map over a whole decode; return (seconds, bytes)."""
+    node_indices = torch.randint(1, max_steps + 1, (max_steps, group_size))
+    start = time.perf_counter()
+    if dense:
+        attention_map = torch.zeros(group_size, max_steps, max_steps + 1, dtype=torch.long)
+        for step in range(max_steps):
+            for i, node_index in enumerate(node_indices[step].tolist()):
+                attention_map[i, step, node_index] = 1
+    else:
+        attention_map = torch.full((group_size, max_steps), -1, dtype=torch.long)
+        for step in range(max_steps):
+            attention_map[:, step] = node_indices[step]
+    return time.perf_counter() - start, attention_map.numel() * attention_map.element_size()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vocab-size", type=int, default=10000)
+    parser.add_argument("--input-dim", type=int, default=512)
+    parser.add_argument("--repeats", type=int, default=50)
+    parser.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    torch.manual_seed(0)
+    generator = ExtendedPointerGenerator(args.input_dim, vocab_size=args.vocab_size)
+
+    # (name, batch_size, target_length, source_length, memory_length, backward)
+    shapes = [("step, beam 5 x 32", 160, 1, 40, 30, False),
+              ("step, beam 5 x 32, long", 160, 1, 80, 80, False),
+              ("sequence, batch 32", 32, 60, 40, 60, True),
+              ("sequence, batch 64, long", 64, 100, 80, 100, True)]
+
+    print(f"{'shape':<28} {'bmm ms':>10} {'scatter ms':>11} {'speedup':>8} {'max diff':>10}")
+    with torch.autograd.set_grad_enabled(True):
+        for name, batch_size, target_length, source_length, memory_length, backward in shapes:
+            inputs = make_inputs(batch_size, target_length, source_length, memory_length, args.input_dim)
+            dense_time, expected = run(generator, inputs, False, args.repeats, backward)
+            scatter_time, produced = run(generator, inputs, True, args.repeats, backward)
+            large = expected > -10
+            max_diff = (produced[large] - expected[large]).abs().max().item()
+            print(f"{name:<28} {1000 * dense_time:>10.3f} {1000 * scatter_time:>11.3f} "
+                  f"{dense_time / scatter_time:>8.2f} {max_diff:>10.2e}")
+    ExtendedPointerGenerator.use_scatter = True
+
+    print()
+    print(f"{'target map, group x steps':<28} {'dense MB':>10} {'index MB':>11} "
+          f"{'dense ms':>10} {'index ms':>10}")
+    for group_size, max_steps in [(32, 60), (160, 60), (160, 100), (320, 150)]:
+        dense_time, dense_bytes = decode_target_map(group_size, max_steps, True)
+        index_time, index_bytes = decode_target_map(group_size, max_steps, False)
+        print(f"{group_size:>12} x {max_steps:<13} {dense_bytes / 2 ** 20:>10.2f} "
+              f"{index_bytes / 2 ** 20:>11.3f} {1000 * dense_time:>10.2f} {1000 * index_time:>10.2f}")
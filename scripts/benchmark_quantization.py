@@ -0,0 +1,126 @@
+"""
+Compare a model archive with its int8 dynamically quantized copy (see
+scripts/quantize_archive.py) on CPU: decoding latency, size of the weights, S F1, LAS of
+the syntax parsers and Pearson's r of the predicted attributes (teacher-forced), with the
+deltas of the quantized model.
+
+Usage: python scripts/benchmark_quantization.py MODEL_ARCHIVE QUANTIZED_ARCHIVE SPLIT [--batch-size 32] [--beam-size 2] [--syntax]
+"""
+import sys
+import os
+import io
+import time
+import argparse
+
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from allennlp.common.util import import_submodules, lazy_groups_of
+from allennlp.models.archival import load_archive
+from allennlp.data import DatasetReader
+from allennlp.predictors import Predictor
+
+from miso.commands.s_score import Scorer
+from miso.commands.conllu_score import ConlluScorer
+
+
+def weights_megabytes(model):
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell() / 2 ** 20
+
+
+def decode_seconds_per_sentence(model, batches):
+    num_sentences = sum(len(batch) for batch in batches)
+    with torch.no_grad():
+        # warm up
+        model.forward_on_instances(batches[0])
+        start = time.perf_counter()
+        for batch in batches:
+            model.forward_on_instances(batch)
+    return (time.perf_counter() - start) / num_sentences
+
+
+def oracle_pearson(model, batches):
+    if not hasattr(model, "oracle"):
+        return None
+    model.get_metrics(reset=True)
+    model.oracle = True
+    try:
+        with torch.no_grad():
+            for batch in batches:
+                model.forward_on_instances(batch)
+    finally:
+        model.oracle = False
+    return model.get_metrics(reset=True)["pearson"]
+
+
+def evaluate(archive_file, args):
+    archive = load_archive(archive_file, cuda_device=-1)
+    model = archive.model
+    model.eval()
+    model._beam_size = args.beam_size
+    model._beam_search.beam_size = args.beam_size
+    model._beam_search.per_node_beam_size = args.beam_size
+
+    config = archive.config.duplicate()
+    reader = DatasetReader.from_params(config.pop("validation_dataset_reader", config.pop("dataset_reader")))
+    reader.set_evaluation()
+    if args.line_limit is not None:
+        reader.line_limit = args.line_limit
+    batches = [list(batch) for batch in lazy_groups_of(iter(reader.read(args.input_file)), args.batch_size)]
+
+    results = dict(size=weights_megabytes(model),
+                   latency=1000 * decode_seconds_per_sentence(model, batches),
+                   pearson=oracle_pearson(model, batches))
+
+    predictor = Predictor.from_archive(archive, args.predictor)
+    scorer_args = dict(predictor=predictor,
+                       input_file=args.input_file,
+                       batch_size=args.batch_size,
+                       silent=True,
+                       beam_size=args.beam_size,
+                       line_limit=args.line_limit)
+    __, __, results["s_f1"] = Scorer(**scorer_args).predict_and_compute()
+    results["las"] = None
+    if args.syntax:
+        __, results["las"], __, __ = ConlluScorer(**scorer_args).predict_and_compute()
+    return results
+
+
+def format_row(name, results, signed=False):
+    cells = [name]
+    for key, fmt in [("size", "{:.1f}"), ("latency", "{:.1f}"), ("s_f1", "{:.2f}"),
+                     ("las", "{:.2f}"), ("pearson", "{:.3f}")]:
+        if results[key] is None:
+            cells.append("-")
+        else:
+            cells.append((fmt.replace("{:", "{:+") if signed else fmt).format(results[key]))
+    return "".join(cell.rjust(12) for cell in cells)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("archive_file", type=str)
+    parser.add_argument("quantized_archive_file", type=str)
+    parser.add_argument("input_file", type=str)
+    parser.add_argument("--predictor", type=str, default="decomp_parsing")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--beam-size", type=int, default=2)
+    parser.add_argument("--line-limit", type=int, default=None)
+    parser.add_argument("--syntax", action="store_true", help="also score LAS of the syntax parser")
+    args = parser.parse_args()
+
+    for package_name in ["miso.data.dataset_readers", "miso.data.tokenizers",
+                         "miso.modules.seq2seq_encoders", "miso.models", "miso.predictors"]:
+        import_submodules(package_name)
+
+    float32 = evaluate(args.archive_file, args)
+    int8 = evaluate(args.quantized_archive_file, args)
+    delta = {key: None if float32[key] is None else int8[key] - float32[key] for key in float32}
+
+    print("".join(name.rjust(12) for name in ["", "size (MB)", "ms/sent", "S F1", "LAS", "pearson"]))
+    print(format_row("float32", float32))
+    print(format_row("int8", int8))
+    print(format_row("delta", delta, signed=True))
@@ -0,0 +1,71 @@
+"""
+Micro-benchmark S-metric hill-climbing on UDS graphs, comparing the dict-based
+``S.get_best_gain`` with the array-backed ``WeightTable``, and check that both give
+the same match numbers.
+
+Each gold graph is scored against itself and against the next graph of the split,
+grouped by the number of instance triples.
+
+Usage: python scripts/benchmark_s_metric.py [--split dev] [--num-graphs 200] [--keep-syntax]
+"""
+import sys
+import os
+import time
+import argparse
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from decomp import UDSCorpus
+
+from miso.data.dataset_readers.decomp_parsing.decomp_with_syntax import DecompGraphWithSyntax
+from miso.metrics.s_metric.s_metric import S, c_args, _to_triples
+
+
+def best_match(triples1, triples2, use_weight_table):
+    S.use_weight_table = use_weight_table
+    start = time.perf_counter()
+    __, match_num, test_num, gold_num = S.get_best_match(*triples1, *triples2, c_args)
+    return time.perf_counter() - start, (match_num, test_num, gold_num)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--split", type=str, default="dev")
+    parser.add_argument("--num-graphs", type=int, default=200)
+    parser.add_argument("--keep-syntax", action="store_true", default=False,
+                        help="score syntax nodes too (drop_syntax=False)")
+    args = parser.parse_args()
+
+    corpus = UDSCorpus(split=args.split)
+    graphs = []
+    for name in sorted(corpus.graphs)[:args.num_graphs]:
+        d_graph = DecompGraphWithSyntax(corpus[name], drop_syntax=not args.keep_syntax,
+                                        syntactic_method="concat-after")
+        list_data = d_graph.get_list_data(bos="@start@", eos="@end@")
+        if list_data is not None:
+            graphs.append(_to_triples(DecompGraphWithSyntax, list_data["arbor_graph"],
+                                      False, not args.keep_syntax, False))
+
+    pairs = [(g, g) for g in graphs] + list(zip(graphs, graphs[1:] + graphs[:1]))
+
+    times = defaultdict(lambda: [0, 0.0, 0.0])
+    mismatches = 0
+    for triples1, triples2 in pairs:
+        dict_time, expected = best_match(triples1, triples2, False)
+        table_time, produced = best_match(triples1, triples2, True)
+        mismatches += int(expected != produced)
+
+        size = max(len(triples1[0]), len(triples2[0]))
+        bucket = 10 * (size // 10)
+        times[bucket][0] += 1
+        times[bucket][1] += dict_time
+        times[bucket][2] += table_time
+    S.use_weight_table = True
+
+    print(f"{'nodes':>8} {'pairs':>6} {'dict ms':>10} {'table ms':>10} {'speedup':>8}")
+    for bucket in sorted(times):
+        count, dict_time, table_time = times[bucket]
+        print(f"{bucket:>4}-{bucket + 9:<3} {count:>6} {1000 * dict_time / count:>10.2f} "
+              f"{1000 * table_time / count:>10.2f} {dict_time / max(table_time, 1e-9):>8.1f}")
+    print(f"mismatched pairs: {mismatches} / {len(pairs)}")
@@ -0,0 +1,90 @@
+"""
+Benchmark the per-step latency of next-step input preparation in beam decoding, comparing
+the AllenNLP TextField/Instance/Batch path with the vectorized lookup-table path, and check
+that both paths produce identical predictions.
+
+Usage: python scripts/benchmark_step_inputs.py MODEL_ARCHIVE SPLIT [--batch-size 32] [--beam-size 5]
+"""
+import sys
+import os
+import time
+import argparse
+
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from allennlp.common.util import import_submodules, lazy_groups_of
+from allennlp.models.archival import load_archive
+from allennlp.data import DatasetReader
+
+
+def decode(model, batches, vectorized):
+    model.vectorized_step_inputs = vectorized
+    step_times = []
+    prepare_step_inputs = model._prepare_step_inputs
+
+    def timed_prepare_step_inputs(*args, **kwargs):
+        start = time.perf_counter()
+        outputs = prepare_step_inputs(*args, **kwargs)
+        step_times.append(time.perf_counter() - start)
+        return outputs
+
+    model._prepare_step_inputs = timed_prepare_step_inputs
+    try:
+        outputs = []
+        with torch.no_grad():
+            for batch in batches:
+                outputs += model.forward_on_instances(batch)
+    finally:
+        del model._prepare_step_inputs
+    return outputs, step_times
+
+
+def same_outputs(left, right):
+    for key in ["nodes", "node_indices", "edge_heads", "edge_types"]:
+        if left[key] != right[key]:
+            return False
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("archive_file", type=str)
+    parser.add_argument("input_file", type=str)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--beam-size", type=int, default=5)
+    parser.add_argument("--line-limit", type=int, default=None)
+    parser.add_argument("--cuda-device", type=int, default=-1)
+    args = parser.parse_args()
+
+    for package_name in ["miso.data.dataset_readers", "miso.data.tokenizers",
+                         "miso.modules.seq2seq_encoders", "miso.models"]:
+        import_submodules(package_name)
+
+    archive = load_archive(args.archive_file, cuda_device=args.cuda_device)
+    model = archive.model
+    model.eval()
+    model._beam_size = args.beam_size
+    model._beam_search.beam_size = args.beam_size
+    model._beam_search.per_node_beam_size = args.beam_size
+
+    config = archive.config.duplicate()
+    reader = DatasetReader.from_params(config.pop("validation_dataset_reader", config.pop("dataset_reader")))
+    reader.set_evaluation()
+    if args.line_limit is not None:
+        reader.line_limit = args.line_limit
+    batches = [list(batch) for batch in lazy_groups_of(iter(reader.read(args.input_file)), args.batch_size)]
+
+    # Warm up caches (vocab lookup tables) before timing.
+    decode(model, batches[:1], vectorized=True)
+
+    results = {}
+    for name, vectorized in [("allennlp", False), ("vectorized", True)]:
+        outputs, step_times = decode(model, batches, vectorized)
+        results[name] = outputs
+        mean_ms = 1000 * sum(step_times) / max(1, len(step_times))
+        print(f"{name}: {len(step_times)} steps, {mean_ms:.3f} ms/step, {sum(step_times):.3f} s total")
+
+    mismatches = sum(not same_outputs(left, right) for left, right in zip(results["allennlp"], results["vectorized"]))
+    print(f"mismatched instances: {mismatches} / {len(results['allennlp'])}")
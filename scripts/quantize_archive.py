@@ -0,0 +1,34 @@
+"""
+Write an int8 dynamically quantized copy of a model archive, for CPU inference. The copy
+loads like any other archive, e.g. with predict.py or s_score.py with --cuda-device -1;
+see scripts/benchmark_quantization.py to compare it with the original.
+
+Usage: python scripts/quantize_archive.py MODEL_ARCHIVE OUTPUT_ARCHIVE
+"""
+import sys
+import os
+import argparse
+import logging
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from allennlp.common.util import import_submodules
+
+from miso.nn.quantization import quantize_archive
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("archive_file", type=str)
+    parser.add_argument("output_file", type=str)
+    args = parser.parse_args()
+
+    for package_name in ["miso.data.dataset_readers", "miso.data.tokenizers",
+                         "miso.modules.seq2seq_encoders", "miso.models"]:
+        import_submodules(package_name)
+
+    module_names = quantize_archive(args.archive_file, args.output_file)
+    print("Quantized {} Linear modules:".format(len(module_names)))
+    for name in module_names:
+        print("  " + name)
@@ -1,6 +1,8 @@
 import pytest
 import sys 
 import os 
+import json
+import re
 
 test_path = os.path.dirname(os.path.abspath(__file__))
 path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -16,10 +18,11 @@ sys.path.insert(0, test_path)
 from test_interface_overfit import * 
 from test_intermediate_overfit import *
 
+from miso.commands.predict import Predict
 from miso.commands.s_score import SScore
 from miso.commands.conllu_score import ConlluScore
 
-def setup_and_test(func, model_path, predictor = "decomp_parsing"): 
+def setup_and_test(func, model_path, predictor = "decomp_parsing", extra_args = ()): 
     parser = ArgumentParserWithDefaults(description="Run AllenNLP")
     subparsers = parser.add_subparsers(title='Commands', metavar='')
 
@@ -27,7 +30,8 @@ def setup_and_test(func, model_path, predictor = "decomp_parsing"):
             # Default commands
             "eval": SScore(),
             "spr_eval": SScore(),
-            "conllu_eval": ConlluScore()
+            "conllu_eval": ConlluScore(),
+            "predict": Predict()
     }
 
     for name, subcommand in subcommands.items():
@@ -53,7 +57,7 @@ def setup_and_test(func, model_path, predictor = "decomp_parsing"):
     "--include-package", "miso.modules.seq2seq_encoders",
     "--include-package", "miso.models",
     "--include-package", "miso.predictors",
-    "--include-package", "miso.metrics"]
+    "--include-package", "miso.metrics"] + list(extra_args)
 
     args = parser.parse_args(arg_list) 
     if 'func' in dir(args):
@@ -139,4 +143,80 @@ def test_conllu_intermediate_transformer(capsys):
     model_path = os.path.join(test_path, "checkpoints", "overfit_intermediate_transformer.ckpt", "model.tar.gz") 
     base_conllu_test(model_path, test_intermediate_transformer, capsys) 
 
-
+def test_predict_output_file(tmp_path, capsys):
+    model_path = os.path.join(test_path, "checkpoints", "overfit_decomp_base.ckpt", "model.tar.gz") 
+    if not os.path.exists(model_path):
+        test_decomp_overfit()
+
+    output_file = str(tmp_path / "predictions.jsonl")
+    setup_and_test("predict", model_path, extra_args = ["--output-file", output_file, "--silent"])
+    out, __ = capsys.readouterr()
+    assert(out.strip() == "")
+
+    # one graph per input line, in node-link format 
+    with open(output_file) as f1:
+        lines = f1.readlines()
+    assert(len(lines) == 2)
+    for line in lines:
+        graph = json.loads(line)
+        assert(graph["directed"])
+        assert(len(graph["nodes"]) > 0)
+        assert(len(graph["links"]) > 0)
+
+    # without --silent the same lines go to stdout
+    setup_and_test("predict", model_path)
+    out, __ = capsys.readouterr()
+    predictions = [line[len("prediction: "):] for line in out.split("\n") if line.startswith("prediction: ")]
+    assert([json.loads(line) for line in predictions] == [json.loads(line) for line in lines])
+
+# the largest change of a score that reduced precision may cause: one point, on the 0-1
+# scale of the S score and the 0-100 scale of the CoNLL-U scores
+PRECISION_TOLERANCES = {"eval": 0.01, "conllu_eval": 1.0}
+
+def parse_scores(out):
+    # e.g. "averaged scores\nUAS: 100.0, LAS: 100.0, ..." -> {"averaged scores UAS": 100.0, ...}
+    scores, heading = {}, ""
+    for line in out.strip().split("\n"):
+        pairs = re.findall(r"(\w+): ([-+.\deE]+|nan)", line)
+        if len(pairs) == 0:
+            heading = line.strip() + " "
+        for name, value in pairs:
+            scores[heading + name] = float(value)
+    return scores
+
+def precision_regression_test(func, model_path, backoff_func, capsys, predictor, precision):
+    # reduced precision should give the float32 scores on the overfit fixtures, up to a point
+    if not os.path.exists(model_path):
+        backoff_func()
+
+    setup_and_test(func, model_path, predictor = predictor)
+    expected, __ = capsys.readouterr()
+    setup_and_test(func, model_path, predictor = predictor, extra_args = ["--precision", precision])
+    out, __ = capsys.readouterr()
+
+    expected, out = parse_scores(expected), parse_scores(out)
+    assert(len(expected) > 0 and out.keys() == expected.keys())
+    deltas = {name: out[name] - expected[name] for name in expected}
+    # shown in every run, not only on failures
+    with capsys.disabled():
+        for name, delta in deltas.items():
+            print(f"{func} {os.path.basename(os.path.dirname(model_path))} {name}: "
+                  f"float32 {expected[name]}, {precision} {out[name]}, delta {delta:+.4f}")
+    tolerance = PRECISION_TOLERANCES[func]
+    assert all(abs(delta) <= tolerance for delta in deltas.values()), \
+            f"{precision} changed the scores by more than {tolerance}: {deltas}"
+
+# float16 needs a GPU with torch 1.4
+def test_s_score_precision(capsys):
+    model_path = os.path.join(test_path, "checkpoints", "overfit_decomp_base.ckpt", "model.tar.gz")
+    precision_regression_test("eval", model_path, test_decomp_overfit, capsys, "decomp_parsing", "bfloat16")
+
+def test_conllu_precision(capsys):
+    model_path = os.path.join(test_path, "checkpoints", "overfit_interface_concat_after.ckpt", "model.tar.gz")
+    precision_regression_test("conllu_eval", model_path, test_interface_concat_after, capsys,
+                              "decomp_syntax_parsing", "bfloat16")
+
+def test_intermediate_transformer_precision(capsys):
+    model_path = os.path.join(test_path, "checkpoints", "overfit_intermediate_transformer.ckpt", "model.tar.gz")
+    precision_regression_test("conllu_eval", model_path, test_intermediate_transformer, capsys,
+                              "decomp_syntax_parsing", "bfloat16")
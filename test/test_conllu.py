@@ -0,0 +1,44 @@
+import pytest
+import sys 
+import os 
+import io
+
+path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, path) 
+
+from miso.metrics.conllu import ConlluEvaluator, load_conllu, evaluate, HEAD, DEPREL
+
+def load_rows(path):
+    with open(path) as f:
+        return [line.rstrip("\n").split("\t") for line in f if line.strip() and not line.startswith("#")]
+
+def rows_to_str(rows):
+    return "".join("\t".join(row) + "\n" for row in rows) + "\n"
+
+def test_conllu_evaluator():
+    gold = load_rows(os.path.join(path, "test", "data", "af-universal.conllu"))
+    # a system tree with some heads and labels changed
+    system = [list(row) for row in gold]
+    for row in system[::3]:
+        # attach to the root word 3
+        if row[0] != "3":
+            row[HEAD] = "3"
+    for row in system[1::4]:
+        row[DEPREL] = "dep"
+
+    evaluator = ConlluEvaluator()
+    evaluator.add(gold, rows_to_str(system))
+    evaluator.add(gold, gold)
+    # the tokens do not match the gold sentence
+    assert(evaluator.add(gold, "1\tx\t_\t_\t_\t_\t0\troot\t_\t_\n\n") is None)
+
+    expected = evaluate(load_conllu(io.StringIO(rows_to_str(gold))), load_conllu(io.StringIO(rows_to_str(system))))
+    scores = evaluator.get_metrics()
+    assert(evaluator.num_sentences == 3 and evaluator.num_errors == 1)
+    for metric in ["UAS", "LAS", "MLAS", "BLEX"]:
+        assert(scores[metric] == pytest.approx(100 * (expected[metric].f1 + 1.0) / 3))
+        # micro: the system words of the failed sentence are missing
+        gold_total = 3 * expected[metric].gold_total
+        system_total = expected[metric].system_total + expected[metric].gold_total
+        correct = expected[metric].correct + expected[metric].gold_total
+        assert(scores[metric + "_micro"] == pytest.approx(100 * 2 * correct / (gold_total + system_total)))
@@ -0,0 +1,227 @@
+import pytest
+import sys
+import os
+
+import torch
+
+test_path = os.path.dirname(os.path.abspath(__file__))
+path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, path)
+sys.path.insert(0, test_path)
+
+from allennlp.models.archival import load_archive
+from allennlp.data import DatasetReader
+
+from miso.nn.quantization import quantize_archive, quantize_dynamic_int8
+
+from test_interface_overfit import test_decomp_overfit
+from test_transformer_overfit import test_decomp_transformer_overfit
+
+def load_model_and_instances(model_path, backoff_func):
+    # if checkpoint doesn't exist, first run other test
+    if not os.path.exists(os.path.join(model_path, "model.tar.gz")):
+        backoff_func()
+
+    archive = load_archive(os.path.join(model_path, "model.tar.gz"), cuda_device=-1)
+    model = archive.model
+    model.eval()
+    reader = DatasetReader.from_params(archive.config.duplicate().pop("dataset_reader"))
+    reader.set_evaluation()
+    instances = list(reader.read("dev"))
+    return model, instances
+
+def decode(model, instances):
+    with torch.no_grad():
+        return model.forward_on_instances(instances)
+
+def assert_close_decoding(outputs, other_outputs):
+    assert_same_decoding(outputs, other_outputs)
+    for output, other_output in zip(outputs, other_outputs):
+        assert(torch.allclose(torch.as_tensor(output["node_attributes"]),
+                              torch.as_tensor(other_output["node_attributes"]), atol=1e-5))
+
+def assert_same_decoding(outputs, other_outputs):
+    assert(len(outputs) == len(other_outputs))
+    for output, other_output in zip(outputs, other_outputs):
+        for key in ["nodes", "node_indices", "edge_heads", "edge_types"]:
+            assert(output[key] == other_output[key])
+
+def test_vectorized_step_inputs():
+    model_path = os.path.join(test_path, "checkpoints", "overfit_decomp_base.ckpt")
+    model, instances = load_model_and_instances(model_path, test_decomp_overfit)
+
+    model.vectorized_step_inputs = False
+    expected = decode(model, instances)
+    model.vectorized_step_inputs = True
+    assert_same_decoding(expected, decode(model, instances))
+
+def test_preallocated_target_memory():
+    model_path = os.path.join(test_path, "checkpoints", "overfit_decomp_base.ckpt")
+    model, instances = load_model_and_instances(model_path, test_decomp_overfit)
+
+    model.preallocated_target_memory = False
+    expected = decode(model, instances)
+    model.preallocated_target_memory = True
+    assert_close_decoding(expected, decode(model, instances))
+
+def test_incremental_transformer_decoding():
+    model_path = os.path.join(test_path, "checkpoints", "overfit_decomp_transformer.ckpt")
+    model, instances = load_model_and_instances(model_path, test_decomp_transformer_overfit)
+    assert(model._decoder.supports_incremental_decoding)
+
+    model.incremental_decoding = False
+    expected = decode(model, instances)
+    model.incremental_decoding = True
+    assert_close_decoding(expected, decode(model, instances))
+
+@pytest.mark.parametrize("vectorized_step_inputs", [True, False])
+def test_beam_invariant_state(vectorized_step_inputs):
+    model_path = os.path.join(test_path, "checkpoints", "overfit_decomp_base.ckpt")
+    model, instances = load_model_and_instances(model_path, test_decomp_overfit)
+    model.vectorized_step_inputs = vectorized_step_inputs
+
+    model.share_beam_invariant_state = False
+    expected = decode(model, instances)
+    model.share_beam_invariant_state = True
+    assert_same_decoding(expected, decode(model, instances))
+
+def test_beam_invariant_transformer_state():
+    model_path = os.path.join(test_path, "checkpoints", "overfit_decomp_transformer.ckpt")
+    model, instances = load_model_and_instances(model_path, test_decomp_transformer_overfit)
+
+    model.share_beam_invariant_state = False
+    expected = decode(model, instances)
+    model.share_beam_invariant_state = True
+    # the hypotheses of an instance attend over its source memory in one batched matmul
+    assert_close_decoding(expected, decode(model, instances))
+
+def decode_with_search_outputs(model, instances):
+    """Decode, and keep what beam search returned and its final auxiliaries."""
+    search = model._beam_search.search
+    search_outputs = []
+
+    def recording_search(**kwargs):
+        outputs = search(**kwargs)
+        search_outputs.append((outputs, kwargs["auxiliaries"]))
+        return outputs
+
+    model._beam_search.search = recording_search
+    try:
+        outputs = decode(model, instances)
+    finally:
+        del model._beam_search.search
+    return outputs, search_outputs
+
+def assert_same_finished_decoding(outputs, other_outputs):
+    # positions after <EOS> are padding, which differs once finished sentences stop decoding
+    assert(len(outputs) == len(other_outputs))
+    for output, other_output in zip(outputs, other_outputs):
+        num_nodes = len(output["nodes"])
+        for key in ["nodes", "node_indices", "edge_heads", "edge_types"]:
+            assert(output[key][:num_nodes] == other_output[key][:num_nodes])
+        assert(torch.allclose(torch.as_tensor(output["node_attributes"])[:num_nodes],
+                              torch.as_tensor(other_output["node_attributes"])[:num_nodes], atol=1e-5))
+
+def assert_same_finished_search_outputs(search_outputs, other_search_outputs, end_index):
+    # the steps up to each hypothesis' first <EOS>, and the target dynamic vocab entries they add
+    assert(len(search_outputs) == len(other_search_outputs))
+    for (outputs, auxiliaries), (other_outputs, other_auxiliaries) in zip(search_outputs, other_search_outputs):
+        predictions, tracked_states, log_probs, __ = outputs
+        other_predictions, other_tracked_states, other_log_probs, __ = other_outputs
+        assert(torch.equal(predictions, other_predictions))
+        assert(torch.allclose(log_probs, other_log_probs, atol=1e-5))
+        # [batch_size, beam_size, max_steps], True up to and including the first <EOS>
+        is_end = (predictions == end_index).long()
+        is_valid = (is_end.cumsum(2) - is_end) == 0
+        assert(torch.allclose(tracked_states[is_valid], other_tracked_states[is_valid], atol=1e-5))
+        # the node index of the prediction at step i is i + 1
+        num_valid_steps = is_valid.sum(2).view(-1).tolist()
+        assert(auxiliaries.keys() == other_auxiliaries.keys())
+        for key in auxiliaries:
+            for vocab, other_vocab, num_steps in zip(auxiliaries[key], other_auxiliaries[key], num_valid_steps):
+                assert({index: token for index, token in vocab.items() if index < num_steps} ==
+                       {index: token for index, token in other_vocab.items() if index < num_steps})
+
+def compact_finished_test(model, instances):
+    model._beam_search.compact_finished = False
+    expected, expected_search_outputs = decode_with_search_outputs(model, instances)
+    model._beam_search.compact_finished = True
+    outputs, search_outputs = decode_with_search_outputs(model, instances)
+    assert_same_finished_decoding(expected, outputs)
+    assert_same_finished_search_outputs(expected_search_outputs, search_outputs, model._vocab_eos_index)
+
+@pytest.mark.parametrize("vectorized_step_inputs", [True, False])
+def test_compact_finished_beams(vectorized_step_inputs):
+    model_path = os.path.join(test_path, "checkpoints", "overfit_decomp_base.ckpt")
+    model, instances = load_model_and_instances(model_path, test_decomp_overfit)
+    model.vectorized_step_inputs = vectorized_step_inputs
+    compact_finished_test(model, instances)
+
+@pytest.mark.parametrize("incremental_decoding", [True, False])
+def test_compact_finished_transformer_beams(incremental_decoding):
+    model_path = os.path.join(test_path, "checkpoints", "overfit_decomp_transformer.ckpt")
+    model, instances = load_model_and_instances(model_path, test_decomp_transformer_overfit)
+    model.incremental_decoding = incremental_decoding
+    compact_finished_test(model, instances)
+
+def read_node_predictions_reference(model, predictions, source_dynamic_vocab_size):
+    batch_size, max_steps = predictions.size()
+    edge_head_mask = torch.tril(predictions.new_ones((batch_size, max_steps, max_steps)), diagonal=-1)
+    valid_node_mask = predictions.new_zeros((batch_size, max_steps))
+    node_index_predictions = []
+    for i in range(batch_size):
+        node_indices = []
+        for j, index in enumerate(predictions[i].tolist()):
+            if index == model._vocab_eos_index:
+                break
+            valid_node_mask[i, j] = 1
+            if index < model._vocab_size + source_dynamic_vocab_size:
+                node_index = j
+            else:
+                node_index = index - model._vocab_size - source_dynamic_vocab_size - 1
+                for k, prev_node_index in enumerate(node_indices):
+                    if node_index == prev_node_index:
+                        edge_head_mask[i, j, k] = 0
+            node_indices.append(node_index)
+        node_index_predictions.append(node_indices)
+    return node_index_predictions, edge_head_mask, valid_node_mask
+
+def test_read_node_predictions():
+    model_path = os.path.join(test_path, "checkpoints", "overfit_decomp_base.ckpt")
+    model, instances = load_model_and_instances(model_path, test_decomp_overfit)
+
+    torch.manual_seed(0)
+    batch_size, max_steps, source_dynamic_vocab_size = 8, 20, 5
+    predictions = torch.randint(model._vocab_size + source_dynamic_vocab_size, (batch_size, max_steps))
+    for j in range(1, max_steps):
+        # target-side copies of a previous node
+        is_target_copy = torch.rand(batch_size) < 0.3
+        target_copies = model._vocab_size + source_dynamic_vocab_size + torch.randint(1, j + 1, (batch_size,))
+        predictions[:, j] = torch.where(is_target_copy, target_copies, predictions[:, j])
+    predictions[torch.arange(batch_size), torch.randint(max_steps, (batch_size,))] = model._vocab_eos_index
+
+    expected_indices, expected_edge_head_mask, expected_valid_node_mask = \
+        read_node_predictions_reference(model, predictions, source_dynamic_vocab_size)
+    node_index_predictions, edge_head_mask, valid_node_mask = \
+        model._read_node_predictions(predictions, source_dynamic_vocab_size)
+
+    assert(torch.equal(edge_head_mask, expected_edge_head_mask))
+    assert(torch.equal(valid_node_mask, expected_valid_node_mask))
+    num_nodes = valid_node_mask.sum(1).tolist()
+    assert([indices[:n] for indices, n in zip(node_index_predictions.tolist(), num_nodes)] == expected_indices)
+
+def test_quantized_archive(tmp_path):
+    model_path = os.path.join(test_path, "checkpoints", "overfit_decomp_base.ckpt")
+    model, instances = load_model_and_instances(model_path, test_decomp_overfit)
+
+    quantized_file = str(tmp_path / "model.int8.tar.gz")
+    module_names = quantize_archive(os.path.join(model_path, "model.tar.gz"), quantized_file)
+    assert(len(module_names) > 0)
+    quantized_model = load_archive(quantized_file, cuda_device=-1).model
+    quantized_model.eval()
+    modules = dict(quantized_model.named_modules())
+    assert(all(isinstance(modules[name], torch.nn.quantized.dynamic.Linear) for name in module_names))
+
+    # the archive loads into the same model as quantizing in memory
+    quantize_dynamic_int8(model, module_names)
+    assert_close_decoding(decode(model, instances), decode(quantized_model, instances))
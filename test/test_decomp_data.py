@@ -6,7 +6,15 @@ path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.insert(0, path) 
 
 from decomp import UDSCorpus
-from miso.data.dataset_readers.decomp_parsing.decomp import DecompGraph 
+import numpy as np
+import torch
+from allennlp.data.fields import TextField, ArrayField, AdjacencyField
+from allennlp.data.token_indexers import SingleIdTokenIndexer
+from allennlp.data.tokenizers import Token
+from miso.data.fields.continuous_label_field import ContinuousLabelField
+from miso.data.dataset_readers.decomp_parsing.ontology import NODE_ONTOLOGY
+from miso.data.dataset_readers.decomp import DecompDatasetReader
+from miso.data.dataset_readers.decomp_parsing.decomp import DecompGraph, copy_map_to_slots
 from miso.data.dataset_readers.decomp_parsing.decomp_with_syntax import DecompGraphWithSyntax 
 
 def assert_dict(produced, expected):
@@ -84,6 +92,47 @@ def test_get_list_data_syntax_reentrancy(load_dev_graphs):
 
     assert_dict(list_data, expected) 
 
+def test_list_data_cache(tmpdir):
+    def read(reader):
+        instances = reader.read("dev")
+        return [(inst["src_tokens_str"].metadata, inst["tgt_tokens_str"].metadata, 
+                 inst["edge_heads"].labels, inst["edge_types"].tokens) for inst in instances]
+
+    indexers = {"tokens": SingleIdTokenIndexer("tokens")}
+    reader = DecompDatasetReader(indexers, indexers, indexers, drop_syntax = False, 
+                                 cache_directory = str(tmpdir))
+    cache = reader._get_list_data_cache("dev")
+    assert(not cache.exists())
+
+    expected = read(reader)
+    assert(cache.exists())
+    produced = read(reader)
+
+    assert(len(produced) == len(expected))
+    for produced_inst, expected_inst in zip(produced, expected):
+        assert(produced_inst[0:3] == expected_inst[0:3])
+        assert([t.text for t in produced_inst[3]] == [t.text for t in expected_inst[3]])
+
+    # different settings don't share a cache 
+    reader.set_evaluation()
+    assert(not reader._get_list_data_cache("dev").exists())
+
+def test_parallel_read():
+    def read(reader):
+        instances = reader.read("dev")
+        return [(inst["src_tokens_str"].metadata, inst["tgt_tokens_str"].metadata, 
+                 inst["edge_heads"].labels) for inst in instances]
+
+    indexers = {"tokens": SingleIdTokenIndexer("tokens")}
+    expected = read(DecompDatasetReader(indexers, indexers, indexers))
+
+    produced = read(DecompDatasetReader(indexers, indexers, indexers, num_workers = 4))
+    assert(produced == expected)
+
+    # streaming order yields the same instances 
+    produced = read(DecompDatasetReader(indexers, indexers, indexers, num_workers = 4, ordered = False))
+    assert(sorted(produced) == sorted(expected))
+
 #def test_get_list_data_syntax_long(load_dev_graphs): 
 #    # test 3: long data
 #    d_graph = DecompGraph(load_dev_graphs["long"])
@@ -92,3 +141,45 @@ def test_get_list_data_syntax_reentrancy(load_dev_graphs):
 #    print(list_data) 
 #    assert(2==1) 
 
+def test_continuous_label_field_batch(load_dev_graphs):
+    fields, expected = [], []
+    for name in ["basic", "long"]:
+        list_data = DecompGraph(load_dev_graphs[name]).get_list_data(bos="@start@", eos="@end@")
+        labels = list_data["tgt_attributes"]
+        tokens = TextField([Token(t) for t in list_data["tgt_tokens"]], {})
+        fields.append(ContinuousLabelField(labels, tokens, NODE_ONTOLOGY))
+
+        # dense [2, num_tokens, ontology_size] values and confidences
+        ontology = sorted(set(NODE_ONTOLOGY))
+        dense = np.zeros((2, len(labels), len(ontology)))
+        for i, label_dict in enumerate(labels):
+            for key, value in label_dict.items():
+                if key in ontology:
+                    dense[:, i, ontology.index(key)] = value['value'], value['confidence']
+        expected.append(dense)
+
+    num_tokens = max(len(x.labels) for x in fields)
+    padding_lengths = {"num_tokens": num_tokens}
+    produced = fields[0].batch_tensors([field.as_tensor(padding_lengths) for field in fields])
+
+    assert(produced.shape == (2, 2, num_tokens, len(set(NODE_ONTOLOGY))))
+    for i, dense in enumerate(expected):
+        assert(torch.equal(produced[:, i, :dense.shape[1]], torch.FloatTensor(dense)))
+        assert(produced[:, i, dense.shape[1]:].abs().sum() == 0)
+        assert(np.array_equal(np.stack(fields[i].labels), dense[0]))
+
+def test_attention_map_slots(load_dev_graphs):
+    list_data = DecompGraph(load_dev_graphs["coref"]).get_list_data(bos="@start@", eos="@end@")
+    src_tokens = list_data["src_copy_vocab"].get_special_tok_list() + list_data["src_tokens"]
+    for copy_map, tokens in [(list_data["tgt_copy_map"], list_data["tgt_tokens_to_generate"]),
+                             (list_data["src_copy_map"], src_tokens)]:
+        num_tokens = len(tokens) + 2
+        # the dense one-hot map the readers used to build
+        dense = AdjacencyField(copy_map, TextField([Token(t) for t in tokens], {}), padding_value=0)
+        dense = dense.as_tensor({"num_tokens": num_tokens})
+        has_slot, expected = dense.max(1)
+        expected[has_slot.eq(0)] = -1
+
+        slots = ArrayField(copy_map_to_slots(copy_map, len(tokens)), padding_value=-1, dtype=np.int64)
+        produced = slots.as_tensor({"dimension_0": num_tokens})
+        assert(torch.equal(produced, expected))
@@ -2,6 +2,8 @@ import pytest
 import sys 
 import os 
 
+import torch
+
 test_path = os.path.dirname(os.path.abspath(__file__))
 path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.insert(0, path) 
@@ -27,6 +29,26 @@ def test_decomp_overfit():
     assert(metrics["training_edge_pearson"] > 0.95)
 
 
+def test_decomp_overfit_async_validation_scores():
+    config_path = os.path.join(test_path, "configs", "overfit_decomp_base.jsonnet") 
+    output_dir = os.path.join(test_path, "checkpoints", "overfit_decomp_async_scores.ckpt") 
+
+    test_args = setup_checkpointing_and_args(config_path, output_dir) 
+    train_model_from_file(test_args.param_path,
+                          test_args.serialization_dir,
+                          overrides='{"trainer": {"async_validation_scores": true}}')
+
+    metrics = read_metrics(output_dir) 
+    assert_successful_overfit(metrics, {"validation_s_f1": 100.0, 
+                                        "best_validation_s_f1": 100.0}) 
+    assert(os.path.exists(os.path.join(output_dir, "best.th")))
+    # the last checkpoint was saved before its scores were known; its metric tracker has them
+    last_epoch = metrics["epoch"]
+    training_state = torch.load(os.path.join(output_dir, f"training_state_epoch_{last_epoch}.th"))
+    assert(training_state["metric_tracker"]["epoch_number"] == last_epoch + 1)
+    assert(training_state["metric_tracker"]["best_epoch"] == metrics["best_epoch"])
+
+
 def test_interface_concat_after():
 
     config_path = os.path.join(test_path, "configs", "overfit_synt_sem_concat_after.jsonnet") 
@@ -0,0 +1,46 @@
+import pytest
+import sys
+import os
+
+import numpy as np
+import torch
+
+path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, path)
+
+from allennlp.nn.chu_liu_edmonds import decode_mst
+
+from miso.modules.parsers import DeepTreeParser
+
+def per_instance_mst_decoding(batch_energy, lengths):
+    # the original per-instance implementation of DeepTreeParser._run_mst_decoding
+    edge_heads = []
+    edge_labels = []
+    for energy, length in zip(batch_energy.detach().cpu(), lengths):
+        scores, label_ids = energy.max(dim=0)
+        energy = scores
+        instance_heads, _ = decode_mst(energy.numpy(), length, has_labels=False)
+        multi_root = sum([1 if h == 0 else 0 for h in instance_heads[0:length]]) > 1
+        if multi_root:
+            energy = DeepTreeParser._enforce_root(energy.unsqueeze(0)).squeeze(0)
+            instance_heads, _ = decode_mst(energy.numpy(), length, has_labels=False)
+        instance_head_labels = [label_ids[parent, child].item() for child, parent in enumerate(instance_heads)]
+        edge_heads.append(instance_heads)
+        edge_labels.append(instance_head_labels)
+    return torch.from_numpy(np.stack(edge_heads)), torch.from_numpy(np.stack(edge_labels))
+
+@pytest.mark.parametrize("num_workers", [0, 4])
+def test_batched_mst_decoding(num_workers):
+    torch.manual_seed(12)
+    for seq_len in [1, 2, 5, 20, 40]:
+        for peak in [1.0, 8.0]:
+            batch_size, num_labels = 16, 7
+            # same form as DeepTreeParser._decode_mst: probabilities, with the root in row 0
+            batch_energy = torch.softmax(peak * torch.randn(batch_size, num_labels, seq_len, seq_len), dim=2)
+            lengths = np.random.RandomState(seq_len).randint(1, seq_len + 1, size=batch_size)
+
+            expected_heads, expected_labels = per_instance_mst_decoding(batch_energy.clone(), lengths.copy())
+            heads, labels = DeepTreeParser._run_mst_decoding(batch_energy.clone(), lengths.copy(), num_workers)
+
+            assert(torch.equal(heads, expected_heads))
+            assert(torch.equal(labels, expected_labels))
@@ -0,0 +1,55 @@
+import pytest
+import sys 
+import os 
+
+import torch
+
+path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, path) 
+
+from miso.modules.generators import ExtendedPointerGenerator
+
+
+def random_attention_map(batch_size, length, dynamic_vocab_size, num_padded):
+    """dynamic vocab slot of each token; the last tokens are padding (-1)"""
+    attention_map = torch.randint(dynamic_vocab_size, (batch_size, length))
+    attention_map[:, length - num_padded:] = -1
+    return attention_map
+
+
+def pointer_generator_inputs(batch_size, target_length, source_length, memory_length):
+    torch.manual_seed(0)
+    return dict(inputs=torch.randn(batch_size, target_length, 16, requires_grad=True),
+                source_attention_weights=torch.randn(batch_size, target_length, source_length).softmax(2),
+                source_attention_map=random_attention_map(batch_size, source_length, source_length + 2, 2),
+                target_attention_weights=torch.randn(batch_size, target_length, memory_length).softmax(2),
+                target_attention_map=random_attention_map(batch_size, memory_length, memory_length + 1, 1),
+                source_dynamic_vocab_size=source_length + 2,
+                target_dynamic_vocab_size=memory_length + 1)
+
+
+@pytest.mark.parametrize("target_length, memory_length", [(1, 7), (9, 9)])
+def test_scatter_pointer_generator_parity(target_length, memory_length):
+    generator = ExtendedPointerGenerator(input_vector_dim=16, vocab_size=50, vocab_pad_index=0)
+    inputs = pointer_generator_inputs(4, target_length, 11, memory_length)
+
+    outputs = {}
+    try:
+        for use_scatter in [False, True]:
+            ExtendedPointerGenerator.use_scatter = use_scatter
+            inputs["inputs"].grad = None
+            log_probs = generator(**inputs, eps=1e-20)["hybrid_log_prob_dist"]
+            log_probs.clamp(min=-20).sum().backward()
+            outputs[use_scatter] = (log_probs.detach(), inputs["inputs"].grad.clone())
+    finally:
+        ExtendedPointerGenerator.use_scatter = True
+
+    (expected, expected_grad), (produced, produced_grad) = outputs[False], outputs[True]
+    assert(produced.shape == (4, target_length, 50 + 13 + memory_length + 1))
+    assert(torch.isfinite(produced).all())
+    # probabilities agree everywhere, log-probabilities wherever the probability is not tiny
+    assert(torch.allclose(produced.exp(), expected.exp(), atol=1e-6))
+    large = expected > -10
+    assert(torch.allclose(produced[large], expected[large], atol=1e-5))
+    assert(torch.equal(produced < -40, expected < -40))
+    assert(torch.allclose(produced_grad, expected_grad, atol=1e-4))
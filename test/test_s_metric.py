@@ -0,0 +1,146 @@
+import pytest
+import sys 
+import os 
+import random
+
+import numpy as np
+
+path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, path) 
+
+from decomp import UDSCorpus
+from miso.data.dataset_readers.decomp_parsing.decomp import DecompGraph, DecompPrediction
+from miso.data.dataset_readers.decomp_parsing.ontology import NODE_ONTOLOGY, EDGE_ONTOLOGY
+from miso.metrics.s_metric.s_metric import S, compute_s_metric, compute_s_metric_from_pairs, GoldTripleCache
+from miso.metrics.s_metric.graph_store import GraphPairStoreWriter, iter_graph_pairs
+
+@pytest.fixture
+def load_dev_arbor_graphs():
+    all_dev_graphs = UDSCorpus(split="dev") 
+    arbor_graphs = []
+    for i in range(1, 41):
+        d_graph = DecompGraph(all_dev_graphs[f"ewt-dev-{i}"]) 
+        list_data = d_graph.get_list_data(bos="@start@", eos="@end@", max_tgt_length = 100)
+        if list_data is not None:
+            arbor_graphs.append(list_data["arbor_graph"])
+    return arbor_graphs
+
+@pytest.mark.parametrize("include_attribute_scores", [False, True])
+def test_parallel_s_metric(load_dev_arbor_graphs, include_attribute_scores):
+    true_graphs = load_dev_arbor_graphs
+    # score each graph against its neighbour so that matches are partial 
+    pred_graphs = true_graphs[1:] + true_graphs[:1]
+    sents = [None for __ in true_graphs]
+
+    expected = compute_s_metric(true_graphs, pred_graphs, sents, True, True, 
+                                include_attribute_scores = include_attribute_scores)
+    produced = compute_s_metric(true_graphs, pred_graphs, sents, True, True, 
+                                include_attribute_scores = include_attribute_scores,
+                                num_workers = 4)
+
+    assert(produced == expected)
+
+def test_weight_table_hill_climbing(load_dev_arbor_graphs):
+    true_graphs = load_dev_arbor_graphs
+    pred_graphs = true_graphs[1:] + true_graphs[:1]
+    sents = [None for __ in true_graphs]
+
+    try:
+        S.use_weight_table = False
+        expected = compute_s_metric(true_graphs, pred_graphs, sents, False, False)
+    finally:
+        S.use_weight_table = True
+    produced = compute_s_metric(true_graphs, pred_graphs, sents, False, False)
+
+    assert(produced == expected)
+
+@pytest.mark.parametrize("include_attribute_scores", [False, True])
+def test_graph_store_s_metric(load_dev_arbor_graphs, include_attribute_scores, tmpdir):
+    true_graphs = load_dev_arbor_graphs
+    pred_graphs = true_graphs[1:] + true_graphs[:1]
+    store_path = os.path.join(str(tmpdir), "graphs")
+
+    with GraphPairStoreWriter(store_path) as writer:
+        for pred_graph, true_graph in zip(pred_graphs, true_graphs):
+            writer.add(pred_graph, true_graph)
+
+    expected = compute_s_metric_from_pairs(zip(pred_graphs, true_graphs), True, True, 
+                                           include_attribute_scores = include_attribute_scores)
+    produced = compute_s_metric_from_pairs(iter_graph_pairs(store_path), True, True, 
+                                           include_attribute_scores = include_attribute_scores,
+                                           num_workers = 2)
+
+    assert(produced == pytest.approx(expected))
+
+def random_prediction(rng):
+    """a decomp predictor output with copied nodes, syntax edges and masked attributes"""
+    num_nodes = rng.randint(1, 15)
+    num_steps = num_nodes + rng.randint(0, 3)
+    nodes = [rng.choice(["@@ROOT@@", "a", "b", "c"]) for __ in range(num_nodes)]
+    node_indices = []
+    for i in range(num_nodes):
+        real_nodes = [j for j in range(i) if node_indices[j] == j]
+        if len(real_nodes) > 0 and rng.random() < 0.25:
+            node_indices.append(rng.choice(real_nodes))
+        else:
+            node_indices.append(i)
+
+    np_rng = np.random.RandomState(rng.randint(0, 1000))
+    return dict(nodes=nodes,
+                node_indices=node_indices,
+                edge_heads=np.array([rng.randint(0, num_nodes) for __ in range(num_steps)]),
+                edge_types=[rng.choice(["EMPTY", "arg", "head"]) for __ in range(num_steps)],
+                node_attributes=3 * np_rng.randn(1, num_steps, len(NODE_ONTOLOGY)).astype(np.float32),
+                node_attributes_mask=np_rng.randn(1, num_steps, len(NODE_ONTOLOGY)).astype(np.float32),
+                edge_attributes=3 * np_rng.randn(num_steps, len(EDGE_ONTOLOGY)).astype(np.float32),
+                edge_attributes_mask=np_rng.randn(num_steps, len(EDGE_ONTOLOGY)).astype(np.float32))
+
+@pytest.mark.parametrize("semantics_only", [False, True])
+@pytest.mark.parametrize("include_attribute_scores", [False, True])
+def test_prediction_triples(semantics_only, include_attribute_scores):
+    def node_name(node):
+        if isinstance(node, tuple):
+            return "predicted-{}-predicted-{}".format(*node)
+        return f"predicted-{node}"
+
+    rng = random.Random(0)
+    outputs = [random_prediction(rng) for __ in range(200)]
+    for output in outputs:
+        instances, relations, attributes = DecompGraph.get_triples(DecompGraph.from_prediction(output), 
+                                                                   semantics_only, True,
+                                                                   include_attribute_scores = include_attribute_scores)
+        fast_instances, fast_relations, fast_attributes = DecompPrediction.get_triples(output, 
+                                                                   semantics_only, True,
+                                                                   include_attribute_scores = include_attribute_scores)
+
+        assert(instances == [(inst, node_name(node), text) for inst, node, text in fast_instances])
+        assert(relations == [(rel, node_name(child), node_name(parent)) for rel, child, parent in fast_relations])
+        assert(attributes == [(key, node_name(node), value) for key, node, value in fast_attributes])
+
+    true_graphs = [DecompGraph.from_prediction(output) for output in outputs[1:] + outputs[:1]]
+    pred_graphs = [DecompGraph.from_prediction(output) for output in outputs]
+    sents = [None for __ in outputs]
+    expected = compute_s_metric(true_graphs, pred_graphs, sents, semantics_only, True, 
+                                include_attribute_scores = include_attribute_scores)
+    produced = compute_s_metric(true_graphs, outputs, sents, semantics_only, True, 
+                                include_attribute_scores = include_attribute_scores)
+
+    assert(produced == expected)
+
+@pytest.mark.parametrize("include_attribute_scores", [False, True])
+def test_gold_triple_cache(load_dev_arbor_graphs, include_attribute_scores):
+    true_graphs = load_dev_arbor_graphs
+    pred_graphs = true_graphs[1:] + true_graphs[:1]
+    sents = [None for __ in true_graphs]
+
+    expected = compute_s_metric(true_graphs, pred_graphs, sents, True, True, 
+                                include_attribute_scores = include_attribute_scores)
+
+    cache = GoldTripleCache()
+    for __ in range(2):
+        true_triples = cache.get(true_graphs, True, True, include_attribute_scores)
+        produced = compute_s_metric(true_triples, pred_graphs, sents, True, True, 
+                                    include_attribute_scores = include_attribute_scores,
+                                    num_workers = 2)
+        assert(produced == expected)
+    assert(cache.get(true_graphs, True, True, include_attribute_scores)[0] is true_triples[0])
@@ -0,0 +1,37 @@
+import pytest
+import sys 
+import os 
+
+import torch
+from torch.nn.utils.rnn import pack_padded_sequence, pad_packed_sequence
+
+path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, path) 
+
+from miso.modules.stacked_lstm import StackedLstm
+
+
+@pytest.mark.parametrize("use_highway", [True, False])
+def test_stacked_lstm_step(use_highway):
+    torch.manual_seed(0)
+    lstm = StackedLstm(12, 8, num_layers=2, recurrent_dropout_probability=0.3, use_highway=use_highway)
+    lstm.eval()
+    assert(lstm.can_step())
+
+    batch_size = 5
+    expected_state, produced_state = None, None
+    for __ in range(3):
+        inputs = torch.randn(batch_size, 1, 12)
+        packed_output, expected_state = lstm(
+            pack_padded_sequence(inputs, [1] * batch_size, batch_first=True), expected_state)
+        expected, __ = pad_packed_sequence(packed_output, batch_first=True)
+        produced, produced_state = lstm.step(inputs.squeeze(1), produced_state)
+
+        assert(torch.allclose(produced, expected.squeeze(1), atol=1e-6))
+        for produced_tensor, expected_tensor in zip(produced_state, expected_state):
+            assert(produced_tensor.shape == (2, batch_size, 8))
+            assert(torch.allclose(produced_tensor, expected_tensor, atol=1e-6))
+
+    # recurrent dropout samples a mask per sequence while training
+    lstm.train()
+    assert(not lstm.can_step())
@@ -0,0 +1,24 @@
+import pytest
+import sys 
+import os 
+import random
+
+path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, path) 
+
+from miso.commands.predict import token_budget_batches
+
+def test_token_budget_batches():
+    rand = random.Random(12)
+    for __ in range(100):
+        lengths = [rand.randint(1, 80) for __ in range(rand.randint(0, 50))]
+        max_tokens = rand.randint(1, 300)
+        batches = token_budget_batches(lengths, max_tokens)
+
+        # every instance is in exactly one batch 
+        assert(sorted(i for batch in batches for i in batch) == list(range(len(lengths))))
+        for batch in batches:
+            padded_size = len(batch) * max(lengths[i] for i in batch)
+            assert(len(batch) == 1 or padded_size <= max_tokens)
+
+    assert(token_budget_batches([5, 80, 3, 3, 10], 40) == [[2, 3, 0, 4], [1]])
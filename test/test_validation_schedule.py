@@ -0,0 +1,71 @@
+import pytest
+import sys 
+import os 
+import json
+import random
+
+test_path = os.path.dirname(os.path.abspath(__file__))
+path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, path) 
+
+from allennlp.commands.train import train_model_from_file
+
+from miso.training.decomp_parsing_trainer import stratified_subsample
+from utils import read_metrics, setup_checkpointing_and_args
+
+def test_stratified_subsample():
+    rand = random.Random(12)
+    for __ in range(50):
+        lengths = [rand.randint(1, 80) for __ in range(rand.randint(1, 300))]
+        ratio = rand.choice([0.01, 0.1, 0.5, 1.0])
+        indices = stratified_subsample(lengths, ratio, seed=13)
+
+        assert(indices == sorted(set(indices)))
+        assert(len(indices) >= 1 and abs(len(indices) - ratio * len(lengths)) <= 1)
+        # fixed by the seed
+        assert(indices == stratified_subsample(lengths, ratio, seed=13))
+        # one instance from each length stratum: the shortest and longest ones are close to the extremes
+        if len(indices) > 2:
+            picked = sorted(lengths[i] for i in indices)
+            ranked = sorted(lengths)
+            stratum_size = -(-len(lengths) // len(indices))
+            assert(picked[0] <= ranked[stratum_size - 1])
+            assert(picked[-1] >= ranked[-stratum_size])
+
+def test_loss_only_intermediate_validation():
+    config_path = os.path.join(test_path, "configs", "overfit_decomp_base.jsonnet") 
+    output_dir = os.path.join(test_path, "checkpoints", "overfit_decomp_validation_schedule.ckpt") 
+
+    test_args = setup_checkpointing_and_args(config_path, output_dir) 
+    train_model_from_file(test_args.param_path,
+                          test_args.serialization_dir,
+                          overrides='{"trainer": {"intermediate_validation": "loss", "full_validation_every": 50}}')
+
+    metrics = read_metrics(output_dir) 
+    # the last epoch always decodes the whole validation set
+    assert(metrics["validation_decoded_fraction"] == 1.0)
+    assert(metrics["best_validation_decoded_fraction"] == 1.0)
+
+    with open(os.path.join(output_dir, "metrics_epoch_0.json")) as f1:
+        epoch_metrics = json.load(f1)
+    assert(epoch_metrics["validation_mode"] == "loss")
+    assert(epoch_metrics["validation_decoded_fraction"] == 0.0)
+    assert("validation_s_f1" not in epoch_metrics)
+
+def test_loss_only_intermediate_validation_with_plateau_schedule():
+    config_path = os.path.join(test_path, "configs", "overfit_decomp_base.jsonnet") 
+    output_dir = os.path.join(test_path, "checkpoints", "overfit_decomp_validation_schedule_plateau.ckpt") 
+
+    test_args = setup_checkpointing_and_args(config_path, output_dir) 
+    # epochs 0 and 1 have no validation metric yet, epoch 2 is the first full validation
+    train_model_from_file(test_args.param_path,
+                          test_args.serialization_dir,
+                          overrides=json.dumps({"trainer": {
+                              "num_epochs": 5,
+                              "intermediate_validation": "loss",
+                              "full_validation_every": 3,
+                              "learning_rate_scheduler": {"type": "reduce_on_plateau", "mode": "max", "patience": 0}}}))
+
+    for epoch, mode in enumerate(["loss", "loss", "full", "loss", "full"]):
+        with open(os.path.join(output_dir, f"metrics_epoch_{epoch}.json")) as f1:
+            assert(json.load(f1)["validation_mode"] == mode)